@@ -0,0 +1,291 @@
+"""
+Season-wide index of player actions from play-by-play data.
+
+Game._get_player_actions() searches one game's play-by-play for a player
+given by exact name.  ActionIndex is built once from the play-by-play of
+every game in a season (no tracking data is loaded) and maps each player
+to their events by type, so a season of a player's actions is a dict
+lookup.  By default the play-by-play is read from the responses
+prefetch.load_game_data() keeps (see prefetch.load_playbyplay_data()):
+
+    index = build_action_index(gamelist)
+    index.save('data/actions.p')
+    index.lookup('curry', 'made_3PT')
+
+Player names are matched case-insensitively, by first or last name, and
+approximately (difflib) for misspellings, so 'curry', 'Steph Curry' and
+'Stephen Cury' all work.  Entries hold game times; action_frames()
+converts them to frame windows once a game's tracking data is loaded,
+e.g. for Game.animate_play().
+"""
+
+import difflib
+import pickle
+import numpy as np
+import pandas as pd
+from prefetch import load_playbyplay_data
+
+# EVENTMSGTYPE of each action (see pbpevents.txt) and whether only three
+# point attempts count
+ACTIONS = {'all_FG': ([1, 2], False), 'made_FG': ([1], False),
+           'miss_FG': ([2], False), 'all_3PT': ([1, 2], True),
+           'made_3PT': ([1], True), 'miss_3PT': ([2], True),
+           'free_throw': ([3], False), 'rebound': ([4], False),
+           'turnover': ([5], False), 'foul': ([6], False)}
+
+ENTRY_COLUMNS = ['player_name', 'player_id', 'date', 'home_team',
+                 'away_team', 'game_id', 'period', 'game_time', 'eventnum',
+                 'event_type', 'three']
+
+_DESCRIPTIONS = ['HOMEDESCRIPTION', 'NEUTRALDESCRIPTION',
+                 'VISITORDESCRIPTION']
+
+
+class ActionIndex(object):
+    """
+    Inverted index of player -> event type -> events.
+    """
+
+    def __init__(self):
+        # {player_id: {event_type: [(game, period, game_time, eventnum,
+        #                            three), ...]}}
+        self.actions = {}
+        # {player_id: name}
+        self.names = {}
+        # (date, home_team, away_team, game_id) of each game
+        self.games = []
+
+    def add_playbyplay(self, date, home_team, away_team, playbyplay_data):
+        """
+        Adds the events of one game.
+
+        Args:
+            date (str): date of game in form 'MM.DD.YYYY'
+            home_team (str): home team in form 'XXX'
+            away_team (str): away team in form 'XXX'
+            playbyplay_data (dict): play-by-play result set with
+                'headers' and 'rowSet' (see game.fetch_playbyplay_data())
+
+        Returns: an instance of self
+        """
+        pbp = pd.DataFrame(playbyplay_data['rowSet'],
+                           columns=playbyplay_data['headers'])
+        game = len(self.games)
+        game_id = str(pbp['GAME_ID'].iloc[0]) if len(pbp) else None
+        self.games.append((date, home_team, away_team, game_id))
+        pbp = pbp[pbp['PLAYER1_ID'].notnull() & (pbp['PLAYER1_ID'] != 0) &
+                  pbp['PLAYER1_NAME'].notnull()]
+        if len(pbp) == 0:
+            return self
+        # Same game time as Game._get_playbyplay_data()
+        clock = pbp['PCTIMESTRING'].str.split(':', expand=True).astype(int)
+        game_time = ((pbp['PERIOD'] - 1) * 720 +
+                     (720 - (clock[0] * 60 + clock[1])))
+        description = pbp[_DESCRIPTIONS].fillna('').astype(str).agg(
+            ' '.join, axis=1)
+        three = description.str.contains('3PT', regex=False)
+        for player_id, name in zip(pbp['PLAYER1_ID'], pbp['PLAYER1_NAME']):
+            self.names[int(player_id)] = name
+        for player_id, event_type, period, time, eventnum, is_three in zip(
+                pbp['PLAYER1_ID'].astype(int), pbp['EVENTMSGTYPE'],
+                pbp['PERIOD'], game_time, pbp['EVENTNUM'], three):
+            (self.actions.setdefault(player_id, {})
+             .setdefault(int(event_type), [])
+             .append((game, int(period), int(time), int(eventnum),
+                      bool(is_three))))
+        return self
+
+    def add_game(self, game):
+        """
+        Adds the events of a loaded Game.
+
+        Args:
+            game (Game): game to add
+
+        Returns: an instance of self
+        """
+        columns = [column for column in game.pbp.columns
+                   if column not in ['Qmin', 'Qsec', 'Qtime', 'game_time']]
+        return self.add_playbyplay(game.date, game.home_team,
+                                   game.away_team,
+                                   {'headers': columns,
+                                    'rowSet': game.pbp[columns].values})
+
+    def merge(self, other):
+        """
+        Adds the games of another index, e.g. built by another process.
+
+        Returns: an instance of self
+        """
+        offset = len(self.games)
+        self.games.extend(other.games)
+        self.names.update(other.names)
+        for player_id, events in other.actions.items():
+            player = self.actions.setdefault(player_id, {})
+            for event_type, entries in events.items():
+                player.setdefault(event_type, []).extend(
+                    (entry[0] + offset,) + entry[1:] for entry in entries)
+        return self
+
+    def find_players(self, name, cutoff=0.75):
+        """
+        Player ids matching a name.  Tries, in order: the full name
+        ignoring case, a first or last name ignoring case, and names
+        within cutoff similarity (difflib).
+
+        Args:
+            name (str or int): name, or player_id
+            cutoff (float): 0 to 1, minimum similarity of approximate
+                matches
+
+        Returns:
+            list: player ids, best match first.  Empty if none match.
+        """
+        if not isinstance(name, str):
+            return [int(name)] if int(name) in self.names else []
+        query = ' '.join(name.lower().split())
+        lowered = {player_id: ' '.join(player_name.lower().split())
+                   for player_id, player_name in self.names.items()}
+        exact = [player_id for player_id, player_name in lowered.items()
+                 if player_name == query]
+        if exact:
+            return exact
+        partial = [player_id for player_id, player_name in lowered.items()
+                   if query in player_name.split()]
+        if partial:
+            return sorted(partial,
+                          key=lambda player_id: -len(self._events(player_id)))
+        # Compare against full and last names, e.g. 'cury'
+        candidates = {}
+        for player_id, player_name in lowered.items():
+            for candidate in set([player_name, player_name.split()[-1]]):
+                candidates.setdefault(candidate, []).append(player_id)
+        matches = difflib.get_close_matches(query, list(candidates), n=5,
+                                            cutoff=cutoff)
+        found = []
+        for match in matches:
+            found.extend(player_id for player_id in candidates[match]
+                         if player_id not in found)
+        return found
+
+    def _events(self, player_id):
+        return [entry for entries in self.actions.get(player_id, {}).values()
+                for entry in entries]
+
+    def lookup(self, name, action, all_matches=False):
+        """
+        A player's actions across every indexed game.
+
+        Args:
+            name (str or int): player name (see find_players()) or id
+            action (str): key of ACTIONS, e.g. 'made_3PT' or 'rebound'
+            all_matches (bool): If True, actions of every player matching
+                name (e.g. both Currys for 'curry').  If False, only the
+                best match.
+
+        Returns:
+            pd.DataFrame: ENTRY_COLUMNS, one row per action in game and
+                time order
+        """
+        if action not in ACTIONS:
+            raise ValueError('Unknown action {0}, use one of {1}'
+                             .format(action, sorted(ACTIONS)))
+        event_types, threes_only = ACTIONS[action]
+        player_ids = self.find_players(name)
+        if not all_matches:
+            player_ids = player_ids[:1]
+        rows = []
+        for player_id in player_ids:
+            events = self.actions.get(player_id, {})
+            for event_type in event_types:
+                for game, period, time, eventnum, three in events.get(
+                        event_type, []):
+                    if threes_only and not three:
+                        continue
+                    date, home_team, away_team, game_id = self.games[game]
+                    rows.append((self.names[player_id], player_id, date,
+                                 home_team, away_team, game_id, period, time,
+                                 eventnum, event_type, three))
+        table = pd.DataFrame(rows, columns=ENTRY_COLUMNS)
+        return table.sort_values(['game_id', 'game_time', 'eventnum'],
+                                 kind='stable').reset_index(drop=True)
+
+    def save(self, filename):
+        """
+        Writes the index to a pickle file
+        """
+        with open(filename, 'wb') as index_file:
+            pickle.dump({'actions': self.actions, 'names': self.names,
+                         'games': self.games}, index_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads an index written by save()
+
+        Returns: ActionIndex
+        """
+        with open(filename, 'rb') as index_file:
+            data = pickle.load(index_file)
+        index = cls()
+        index.actions = data['actions']
+        index.names = data['names']
+        index.games = data['games']
+        return index
+
+
+def build_action_index(gamelist, loader=load_playbyplay_data):
+    """
+    Builds an index from the play-by-play of every game.  Games that
+    cannot be loaded are logged to errorlog.txt.
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+        loader (function): called as loader(date, home_team, away_team),
+            returns the play-by-play result set.  The default reads the
+            play-by-play kept by prefetch.load_game_data().  For
+            synthetic games, use functools.partial to set the directory
+            of prefetch.load_local_playbyplay_data.
+
+    Returns: ActionIndex
+    """
+    index = ActionIndex()
+    for game in gamelist:
+        try:
+            index.add_playbyplay(game[0], game[1], game[2],
+                                 loader(game[0], game[1], game[2]))
+        except Exception:
+            with open('errorlog.txt', 'a') as myfile:
+                myfile.write("{game} Could not index play-by-play\n"
+                             .format(game=game))
+    return index
+
+
+def action_frames(game, actions, length=15):
+    """
+    Frame windows of actions in a loaded game, leading up to each action.
+    Like Game.get_frame(), the latest second at or before each time is
+    used.
+
+    Args:
+        game (Game): game of the actions
+        actions (pd.DataFrame): rows of ActionIndex.lookup()
+        length (int): seconds of play before each action
+
+    Returns:
+        list: (starting_frame, ending_frame) for each action of the game,
+            e.g. for Game.animate_play()
+    """
+    times = actions[actions.game_id == game.game_id].game_time.values
+    rounded = game.moments.game_time.round().values
+    seconds, frames = np.unique(rounded, return_index=True)
+    if len(seconds) == 0:
+        return []
+
+    def lookup(targets):
+        index = np.searchsorted(seconds, targets, side='right') - 1
+        return frames[np.clip(index, 0, len(frames) - 1)]
+    return [(int(start), int(end)) for start, end in
+            zip(lookup(times - length), lookup(times))]
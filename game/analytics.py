@@ -0,0 +1,241 @@
+"""
+Per-frame analytics computed on game arrays instead of frame by frame.
+
+Game arrays are the position arrays of Game.get_position_arrays() plus
+the clock columns of game.moments, all as numpy arrays with one row per
+frame.  They can be shared with other processes (see shared_game.py) and
+reproduce the results of Game.get_offensive_team(),
+Game.get_spacing_area() and velocity_analysis.calculate_velocities().
+Frames are analyzed when they pass the quality checks every analysis
+shares (see quality.valid_frames()).
+"""
+
+import numpy as np
+from scipy.spatial import ConvexHull
+import quality
+
+# Codes returned by offensive_teams()
+NO_OFFENSE = 0
+HOME_OFFENSE = 1
+AWAY_OFFENSE = 2
+
+CLOCK_COLUMNS = ['quarter', 'universe_time', 'quarter_time', 'shot_clock',
+                 'game_time']
+
+
+def game_arrays(game):
+    """
+    Collects the arrays of a game.
+
+    Args:
+        game (Game): game to get arrays for
+
+    Returns:
+        dict: position arrays (see Game.get_position_arrays()) plus
+            quarter, universe_time, quarter_time, shot_clock, game_time
+            and quality (see quality.quality_mask())
+    """
+    arrays = dict(game.get_position_arrays())
+    for column in CLOCK_COLUMNS:
+        arrays[column] = game.moments[column].values
+    if getattr(game, '_quality_mask', None) is None:
+        game._quality_mask = quality.quality_mask(arrays)
+    arrays['quality'] = game._quality_mask
+    return arrays
+
+
+def game_metadata(game):
+    """
+    Collects the small, non-array attributes analyses need.
+
+    Args:
+        game (Game): game to get metadata for
+
+    Returns:
+        dict: game_id, home_id, away_id, home_team, away_team and
+            flip_direction
+    """
+    return {'game_id': game.game_id, 'home_id': game.home_id,
+            'away_id': game.away_id, 'home_team': game.home_team,
+            'away_team': game.away_team,
+            'flip_direction': game.flip_direction}
+
+
+def offensive_teams(arrays, flip_direction=False):
+    """
+    Determines which team is on offense for every frame.
+    Same rules as Game.get_offensive_team()
+
+    Args:
+        arrays (dict): game arrays
+        flip_direction (bool): Game.flip_direction
+
+    Returns:
+        np.ndarray: int8 array of NO_OFFENSE, HOME_OFFENSE or AWAY_OFFENSE
+    """
+    x_pos = arrays['xyz'][:, :, 0]
+    complete = quality.valid_frames(arrays)
+    # NaN padding compares False, but padded frames are not valid
+    left = complete & (x_pos[:, :11] < 47).all(axis=1)
+    right = complete & (x_pos[:, :11] > 47).all(axis=1)
+    first_half = np.isin(arrays['quarter'], [1, 2])
+    second_half = np.isin(arrays['quarter'], [3, 4])
+    home_left = (left & first_half) | (right & second_half)
+    home_right = (left & second_half) | (right & first_half)
+    if flip_direction:
+        home_left, home_right = home_right, home_left
+    offense = np.full(len(x_pos), NO_OFFENSE, dtype=np.int8)
+    offense[home_left] = HOME_OFFENSE
+    offense[home_right] = AWAY_OFFENSE
+    return offense
+
+
+def spacing_areas(arrays, frames=None):
+    """
+    Convex hull of each team for every frame.
+    Same value as Game.get_spacing_area()
+
+    Args:
+        arrays (dict): game arrays
+        frames (np.ndarray): frames to compute.  If None, all frames
+            passing quality.valid_frames().
+
+    Returns:
+        np.ndarray: float64 (frames, 2) of (home_area, away_area).
+            NaN for frames not computed.
+    """
+    xy = arrays['xyz'][:, :, :2]
+    if frames is None:
+        frames = np.where(quality.valid_frames(arrays))[0]
+    areas = np.full((len(xy), 2), np.nan)
+    for frame in frames:
+        areas[frame, 0] = ConvexHull(xy[frame, 1:6]).area
+        areas[frame, 1] = ConvexHull(xy[frame, 6:11]).area
+    return areas
+
+
+def entity_speeds(arrays):
+    """
+    Speed of every player and the ball for every frame.
+
+    Args:
+        arrays (dict): game arrays
+
+    Returns:
+        np.ndarray: float64 (frames, 11) speeds in ft/msec, in the order
+            of the positions.  0 for the first frame and for frames where
+            this or the previous frame does not pass
+            quality.valid_frames(), for entities that are not the same
+            player as in the previous frame (substitutions), and for the
+            first frame of each segment of resampled arrays (see
+            resample.resample_arrays()).
+    """
+    xy = arrays['xyz'][:, :11, :2]
+    speeds = np.zeros(xy.shape[:2])
+    if len(xy) < 2:
+        return speeds
+    distances = np.linalg.norm(xy[1:] - xy[:-1], axis=2)
+    delta_time = np.diff(arrays['universe_time']).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speeds[1:] = distances / delta_time[:, np.newaxis]
+    complete = quality.valid_frames(arrays)
+    valid = np.zeros(len(xy), dtype=bool)
+    valid[1:] = complete[1:] & complete[:-1]
+    if 'segment' in arrays:
+        # Resampled arrays: no velocities across gaps or periods
+        segment = arrays['segment']
+        valid[1:] &= (segment[1:] == segment[:-1]) & (segment[1:] >= 0)
+    speeds[~valid] = 0
+    # Distances between two different players are not speeds
+    player_ids = arrays['player_ids'][:, :11]
+    speeds[1:][player_ids[1:] != player_ids[:-1]] = 0
+    return speeds
+
+
+def team_velocities(arrays):
+    """
+    Cumulative velocity of each team for every frame.
+    Same value as velocity_analysis.calculate_velocities(), except that
+    players substituted between two frames count 0 instead of the
+    distance between the two players (see entity_speeds()).
+
+    Args:
+        arrays (dict): game arrays
+
+    Returns:
+        np.ndarray: float64 (frames, 2) of (home_velocity, away_velocity)
+            in ft/msec.  0 for the first frame and for frames where this
+            or the previous frame does not have all 10 players and the ball.
+    """
+    speeds = entity_speeds(arrays)
+    return np.column_stack((speeds[:, 1:6].sum(axis=1),
+                            speeds[:, 6:11].sum(axis=1)))
+
+
+def player_velocities(arrays, player_id):
+    """
+    Velocity of one player for every frame.
+
+    Args:
+        arrays (dict): game arrays
+        player_id (int): id of player
+
+    Returns:
+        np.ndarray: float64 (frames,) in ft/msec.  NaN when the player
+            is not on the court, 0 as in entity_speeds() otherwise.
+    """
+    speeds = entity_speeds(arrays)
+    on_court = arrays['player_ids'][:, :11] == player_id
+    velocities = np.full(len(speeds), np.nan)
+    frames, index = np.nonzero(on_court)
+    velocities[frames] = speeds[frames, index]
+    return velocities
+
+
+def spacing_statistics(arrays, metadata):
+    """
+    Spacing of each team split by offense and defense.
+
+    Args:
+        arrays (dict): game arrays
+        metadata (dict): see game_metadata()
+
+    Returns:
+        tuple: (home_offense_areas, home_defense_areas,
+            away_offense_areas, away_defense_areas) as in
+            spacing_analysis.get_spacing_statistics()
+    """
+    offense = offensive_teams(arrays, metadata['flip_direction'])
+    areas = spacing_areas(arrays, np.where(offense != NO_OFFENSE)[0])
+    home = offense == HOME_OFFENSE
+    away = offense == AWAY_OFFENSE
+    return (list(areas[home, 0]), list(areas[away, 0]),
+            list(areas[away, 1]), list(areas[home, 1]))
+
+
+def velocity_statistics(arrays, metadata):
+    """
+    Velocity of each team split by offense and defense.
+
+    Args:
+        arrays (dict): game arrays
+        metadata (dict): see game_metadata()
+
+    Returns:
+        tuple: (home_offense_velocities, home_defense_velocities,
+            away_offense_velocities, away_defense_velocities) of
+            (frame, universe_time, velocity) tuples as in
+            velocity_analysis.get_velocity_statistics()
+    """
+    offense = offensive_teams(arrays, metadata['flip_direction'])
+    offense[0] = NO_OFFENSE
+    velocities = team_velocities(arrays)
+    universe_time = arrays['universe_time']
+    results = []
+    for side, team in [(HOME_OFFENSE, 0), (AWAY_OFFENSE, 0),
+                       (AWAY_OFFENSE, 1), (HOME_OFFENSE, 1)]:
+        frames = np.where(offense == side)[0]
+        results.append(list(zip(frames.tolist(),
+                                universe_time[frames].tolist(),
+                                velocities[frames, team].tolist())))
+    return tuple(results)
@@ -0,0 +1,441 @@
+"""
+Benchmarks of loading, per-frame analytics, season scripts and rendering.
+
+Benchmarks run on synthetic games (see synthetic.py) written to a scratch
+directory, so nothing is downloaded and runs are comparable between
+machines and commits.  Each benchmark is timed several times and run once
+more under tracemalloc for its peak memory.  Results are written as JSON
+and can be compared against a saved baseline:
+
+    python benchmark.py --output baseline.json
+    (change code)
+    python benchmark.py --baseline baseline.json --output results.json
+
+Comparing exits with status 1 if any benchmark got slower or uses more
+memory than the baseline by more than --tolerance, or fails where it
+passed in the baseline.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import datetime
+import functools
+import tracemalloc
+import numpy as np
+
+# Dates and teams of the synthetic games
+FIXTURE_GAMES = [['01.01.2016', 'TOR', 'CHI'], ['01.02.2016', 'GSW', 'DEN'],
+                 ['01.03.2016', 'SAS', 'MIA'], ['01.04.2016', 'BOS', 'LAL'],
+                 ['01.05.2016', 'POR', 'NYK'], ['01.06.2016', 'DAL', 'HOU'],
+                 ['01.07.2016', 'CLE', 'PHI'], ['01.08.2016', 'OKC', 'UTA']]
+
+# Number of calls timed by the per-frame benchmarks
+FRAME_SAMPLES = 500
+
+
+class Fixture(object):
+    """
+    Synthetic games of one size, written once and loaded on demand.
+    """
+
+    def __init__(self, directory, quarter_length, n_games, seed=0):
+        """
+        Args:
+            directory (str): scratch directory the games are written to
+            quarter_length (int): seconds per quarter of the games
+            n_games (int): number of games, for season benchmarks
+            seed (int): seed of the synthetic games
+        """
+        import synthetic
+        self.directory = os.path.join(directory, 'data', 'synthetic')
+        self.gamelist = [list(game) for game in FIXTURE_GAMES[:n_games]]
+        for date, home_team, away_team in self.gamelist:
+            synthetic.write_game(date, home_team, away_team, self.directory,
+                                 seed=seed, quarter_length=quarter_length)
+        self._data = None
+        self._game = None
+
+    @property
+    def data(self):
+        """
+        (tracking_data, playbyplay_data) of the first game
+        """
+        from prefetch import load_local_game_data
+        if self._data is None:
+            self._data = load_local_game_data(*self.gamelist[0],
+                                              directory=self.directory)
+        return self._data
+
+    @property
+    def game(self):
+        """
+        Game of the first game
+        """
+        from game import Game
+        if self._game is None:
+            self._game = Game(*(self.gamelist[0] + list(self.data)))
+        return self._game
+
+    def loader(self):
+        """
+        Loader of the fixture games for prefetch.prefetch_games()
+        """
+        from prefetch import load_local_game_data
+        return functools.partial(load_local_game_data,
+                                 directory=self.directory)
+
+    def sample_frames(self, offense=False):
+        """
+        Evenly spaced frames of the first game, skipping frame 0.
+        If offense, only frames with a team on offense.
+        """
+        frames = np.arange(1, len(self.game.moments))
+        if offense:
+            import analytics
+            labels = analytics.offensive_teams(
+                analytics.game_arrays(self.game), self.game.flip_direction)
+            frames = frames[labels[1:] != analytics.NO_OFFENSE]
+        step = max(len(frames) // FRAME_SAMPLES, 1)
+        return frames[::step][:FRAME_SAMPLES].tolist()
+
+
+# Benchmarks.  Each takes a Fixture and returns the function to time.
+
+def bench_game_construction(fixture):
+    from game import Game
+    tracking_data, playbyplay_data = fixture.data
+    return lambda: Game(*(fixture.gamelist[0] +
+                          [tracking_data, playbyplay_data]))
+
+
+def bench_game_construction_slim(fixture):
+    from game import Game
+    tracking_data, playbyplay_data = fixture.data
+    return lambda: Game(*(fixture.gamelist[0] +
+                          [tracking_data, playbyplay_data]), slim=True)
+
+
+def bench_get_frame(fixture):
+    game = fixture.game
+    # Game times of played frames, since get_frame() searches backwards
+    times = game.moments.game_time.values[
+        fixture.sample_frames()].round().tolist()
+    return lambda: [game.get_frame(game_time) for game_time in times]
+
+
+def bench_get_offensive_team(fixture):
+    game = fixture.game
+    frames = fixture.sample_frames()
+    return lambda: [game.get_offensive_team(frame) for frame in frames]
+
+
+def bench_get_spacing_area(fixture):
+    game = fixture.game
+    frames = fixture.sample_frames(offense=True)
+    return lambda: [game.get_spacing_area(frame) for frame in frames]
+
+
+def bench_calculate_velocities(fixture):
+    from velocity_analysis import calculate_velocities
+    game = fixture.game
+    frames = fixture.sample_frames()
+    return lambda: [calculate_velocities(game, frame) for frame in frames]
+
+
+def bench_spacing_statistics(fixture):
+    import analytics
+    game = fixture.game
+    return lambda: analytics.spacing_statistics(
+        analytics.game_arrays(game), analytics.game_metadata(game))
+
+
+def bench_plot_frame(fixture):
+    import matplotlib.pyplot as plt
+    game = fixture.game
+    frames = fixture.sample_frames()[:10]
+
+    def run():
+        for frame in frames:
+            game.plot_frame(frame, commentary=False)
+        plt.close('all')
+    return run
+
+
+def bench_animate_play(fixture):
+    if shutil.which('ffmpeg') is None:
+        raise _Skip('ffmpeg not found')
+    game = fixture.game
+    start = fixture.sample_frames()[len(fixture.sample_frames()) // 2]
+    return lambda: game.animate_play((start, start + 100), 4,
+                                     commentary=False)
+
+
+def _season_benchmark(fixture, module_name, function_name, directory):
+    """
+    Helper function for a season script over all fixture games.  Its
+    results are removed before every run, since the scripts skip games
+    already written.
+    """
+    module = __import__(module_name)
+    write = getattr(module, function_name)
+    loader = fixture.loader()
+
+    def run():
+        for subdirectory in [directory, 'score']:
+            path = os.path.join('data', subdirectory)
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+        write(fixture.gamelist, loader=loader)
+    return run
+
+
+def bench_write_spacing(fixture):
+    return _season_benchmark(fixture, 'spacing_analysis', 'write_spacing',
+                             'spacing')
+
+
+def bench_write_velocity(fixture):
+    return _season_benchmark(fixture, 'velocity_analysis', 'write_velocity',
+                             'velocity')
+
+
+class _Skip(Exception):
+    """
+    Raised by a benchmark that cannot run here
+    """
+
+
+# (name, function, True if it runs once per game count)
+BENCHMARKS = [('game_construction', bench_game_construction, False),
+              ('game_construction_slim', bench_game_construction_slim, False),
+              ('get_frame', bench_get_frame, False),
+              ('get_offensive_team', bench_get_offensive_team, False),
+              ('get_spacing_area', bench_get_spacing_area, False),
+              ('calculate_velocities', bench_calculate_velocities, False),
+              ('spacing_statistics', bench_spacing_statistics, False),
+              ('plot_frame', bench_plot_frame, False),
+              ('animate_play', bench_animate_play, False),
+              ('write_spacing', bench_write_spacing, True),
+              ('write_velocity', bench_write_velocity, True)]
+
+
+def measure(function, repeat=3):
+    """
+    Times a function and measures its peak memory.
+
+    Args:
+        function (function): called without arguments
+        repeat (int): number of timed calls
+
+    Returns:
+        dict: min, median and mean seconds of the timed calls, and
+            peak_memory in bytes of one more call under tracemalloc
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'min': min(times), 'median': float(np.median(times)),
+            'mean': float(np.mean(times)), 'repeat': repeat,
+            'peak_memory': peak_memory}
+
+
+def run_benchmarks(quarter_lengths=(120, 360), game_counts=(1, 4),
+                   names=None, repeat=3, directory=None):
+    """
+    Runs benchmarks at every game size, and the season benchmarks at
+    every game count.  The working directory is changed to a scratch
+    directory while they run, since the season scripts write to data/
+    and animations to temp/.
+
+    Args:
+        quarter_lengths (iterable): seconds per quarter of the games.
+            720 is a full game (about 80000 frames).  Games need at
+            least 10000 frames (Game._determine_direction()), so at
+            least 120.
+        game_counts (iterable): numbers of games for season benchmarks
+        names (list): names of benchmarks to run.  If None, all.
+        repeat (int): number of timed runs of each benchmark
+        directory (str): scratch directory.  If None, a temporary
+            directory that is removed afterwards.
+
+    Returns:
+        list: dict for each benchmark run with name, params, status
+            ('ok', 'skipped' or 'error') and, if ok, the results of
+            measure().  error holds the reason if not ok.
+    """
+    scratch = directory or tempfile.mkdtemp(prefix='benchmark')
+    working_directory = os.getcwd()
+    results = []
+    try:
+        os.chdir(scratch)
+        for subdirectory in ['temp', 'data/spacing', 'data/velocity',
+                             'data/score']:
+            if not os.path.exists(subdirectory):
+                os.makedirs(subdirectory)
+        for quarter_length in quarter_lengths:
+            fixture = Fixture(scratch, quarter_length, max(game_counts))
+            for name, benchmark, per_game_count in BENCHMARKS:
+                if names is not None and name not in names:
+                    continue
+                counts = game_counts if per_game_count else [1]
+                for n_games in counts:
+                    params = {'quarter_length': quarter_length,
+                              'games': n_games}
+                    results.append(_run_benchmark(name, benchmark, fixture,
+                                                  params, n_games, repeat))
+            shutil.rmtree(fixture.directory, ignore_errors=True)
+    finally:
+        os.chdir(working_directory)
+        if directory is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def _run_benchmark(name, benchmark, fixture, params, n_games, repeat):
+    """
+    Helper function to run one benchmark, recording failures instead of
+    stopping
+    """
+    result = {'name': name, 'params': params}
+    gamelist = fixture.gamelist
+    fixture.gamelist = gamelist[:n_games]
+    try:
+        function = benchmark(fixture)
+        if not name.startswith('write_'):
+            result['params']['frames'] = len(fixture.game.moments)
+        result.update(measure(function, repeat))
+        result['status'] = 'ok'
+    except _Skip as reason:
+        result.update({'status': 'skipped', 'error': str(reason)})
+    except Exception as error:
+        result.update({'status': 'error', 'error': repr(error)})
+    finally:
+        fixture.gamelist = gamelist
+    print('{name} {params}: {status}'.format(
+        name=name, params=params, status=result['status']))
+    return result
+
+
+def write_results(results, filename):
+    """
+    Writes benchmark results with details of the machine to JSON
+    """
+    with open(filename, 'w') as results_file:
+        json.dump({'created': datetime.datetime.now().isoformat(),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'processor': platform.processor(),
+                   'results': results}, results_file, indent=2)
+
+
+def _key(result):
+    return (result['name'], json.dumps(
+        {key: value for key, value in result['params'].items()
+         if key != 'frames'}, sort_keys=True))
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares results against a baseline.
+
+    Args:
+        results (list): see run_benchmarks()
+        baseline (list): results of an earlier run
+        tolerance (float): allowed relative increase in median time and
+            peak memory.  Timings of short benchmarks are noisy, so keep
+            this generous.
+
+    Returns:
+        list: dict for each benchmark in both with name, params,
+            time_ratio, memory_ratio, regression (bool) and error.
+            A benchmark that was ok in the baseline and now fails is a
+            regression with its error and no ratios.  Benchmarks skipped
+            now or not ok in the baseline are left out.
+    """
+    previous = {_key(result): result for result in baseline
+                if result.get('status') == 'ok'}
+    comparisons = []
+    for result in results:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        if result.get('status') == 'error':
+            comparisons.append({'name': result['name'],
+                                'params': result['params'],
+                                'time_ratio': None, 'memory_ratio': None,
+                                'regression': True,
+                                'error': result.get('error')})
+            continue
+        if result.get('status') != 'ok':
+            continue
+        time_ratio = result['median'] / max(old['median'], 1e-9)
+        memory_ratio = (result['peak_memory'] /
+                        float(max(old['peak_memory'], 1)))
+        comparisons.append({'name': result['name'],
+                            'params': result['params'],
+                            'time_ratio': time_ratio,
+                            'memory_ratio': memory_ratio,
+                            'regression': (time_ratio > 1 + tolerance or
+                                           memory_ratio > 1 + tolerance),
+                            'error': None})
+    return comparisons
+
+
+def _print_comparisons(comparisons):
+    for comparison in comparisons:
+        if comparison['error'] is not None:
+            print('{flag:10} {name:24} {params:40} {error}'.format(
+                flag='REGRESSION', name=comparison['name'],
+                params=json.dumps(comparison['params'], sort_keys=True),
+                error=comparison['error']))
+            continue
+        print('{flag:10} {name:24} {params:40} time x{time:.2f} '
+              'memory x{memory:.2f}'.format(
+                  flag='REGRESSION' if comparison['regression'] else '',
+                  name=comparison['name'],
+                  params=json.dumps(comparison['params'], sort_keys=True),
+                  time=comparison['time_ratio'],
+                  memory=comparison['memory_ratio']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--output', default='benchmark.json',
+                        help='file to write results to')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--quarter-lengths', default='120,360',
+                        help='seconds per quarter of the synthetic games')
+    parser.add_argument('--games', default='1,4',
+                        help='numbers of games for season benchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='comma separated benchmark names')
+    args = parser.parse_args()
+    # Benchmarks import the scripts from this directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    results = run_benchmarks(
+        [int(value) for value in args.quarter_lengths.split(',')],
+        [int(value) for value in args.games.split(',')],
+        args.only.split(',') if args.only else None, args.repeat)
+    write_results(results, args.output)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            comparisons = compare(results, json.load(baseline_file)['results'],
+                                  args.tolerance)
+        _print_comparisons(comparisons)
+        if any(comparison['regression'] for comparison in comparisons):
+            sys.exit(1)
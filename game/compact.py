@@ -0,0 +1,173 @@
+"""
+Compact fixed-point storage for player tracking data.
+
+Court coordinates (0-94 ft by 0-50 ft) and ball height are stored as
+int16 hundredths of a foot, so every decoded coordinate is within
+0.005 ft of the original.  Ids are stored as int32 and universe_time as
+int32 deltas from the first frame.  A game read back keeps its positions
+in this encoding and decodes them on demand: Game.get_position_arrays()
+decodes the whole game on each call without keeping the result, and
+single frames are decoded as they are drawn or analyzed.
+
+    from compact import write_compact_game, read_compact_game
+    write_compact_game(game, 'data/game/01.01.2016-CHI-TOR.pz')
+    game = read_compact_game('data/game/01.01.2016-CHI-TOR.pz')
+"""
+
+import gzip
+import pickle
+import numpy as np
+import pandas as pd
+from game import Game
+
+# Coordinates are stored in units of 1 / POSITION_SCALE feet
+POSITION_SCALE = 100
+# Stored in place of a missing coordinate (padding)
+MISSING = np.iinfo(np.int16).min
+
+
+def encode_position_arrays(arrays):
+    """
+    Quantizes position arrays (see Game.get_position_arrays()).
+
+    Args:
+        arrays (dict): dict with 'xyz', 'team_ids', 'player_ids' and
+            'n_entities' arrays
+
+    Returns:
+        dict: the same keys, with 'xyz' as int16 hundredths of a foot,
+            ids as int32 and 'n_entities' as int8
+    """
+    xyz = np.round(arrays['xyz'] * POSITION_SCALE)
+    xyz = np.clip(xyz, MISSING + 1, np.iinfo(np.int16).max)
+    xyz[np.isnan(xyz)] = MISSING
+    return {'xyz': xyz.astype(np.int16),
+            'team_ids': arrays['team_ids'].astype(np.int32),
+            'player_ids': arrays['player_ids'].astype(np.int32),
+            'n_entities': arrays['n_entities'].astype(np.int8)}
+
+
+def decode_xyz(xyz):
+    """
+    Coordinates in feet of encoded coordinates (see
+    encode_position_arrays()).
+
+    Args:
+        xyz (np.ndarray): int16 hundredths of a foot
+
+    Returns:
+        np.ndarray: float32, NaN where missing
+    """
+    decoded = xyz.astype(np.float32) / POSITION_SCALE
+    decoded[xyz == MISSING] = np.nan
+    return decoded
+
+
+def decode_position_arrays(encoded):
+    """
+    Inverse of encode_position_arrays().  The ids are not copied.
+
+    Args:
+        encoded (dict): output of encode_position_arrays()
+
+    Returns:
+        dict: position arrays in the dtypes of a slim game (see
+            Game.get_position_arrays())
+    """
+    return {'xyz': decode_xyz(encoded['xyz']),
+            'team_ids': encoded['team_ids'],
+            'player_ids': encoded['player_ids'],
+            'n_entities': encoded['n_entities']}
+
+
+def encode_moments(game):
+    """
+    Encodes game.moments into compact arrays.
+
+    Args:
+        game (Game): game to encode
+
+    Returns:
+        dict: encoded position arrays (see encode_position_arrays()) plus
+            quarter (int8), universe_time_start (int64),
+            universe_time_delta (int32 msec since previous frame),
+            quarter_time and shot_clock (float32)
+    """
+    moments = game.moments
+    encoded = encode_position_arrays(game.get_position_arrays())
+    universe_time = moments.universe_time.values.astype(np.int64)
+    encoded['quarter'] = moments.quarter.values.astype(np.int8)
+    encoded['universe_time_start'] = (universe_time[0] if len(universe_time)
+                                      else 0)
+    encoded['universe_time_delta'] = (np.diff(universe_time, prepend=(
+        encoded['universe_time_start'])).astype(np.int32))
+    encoded['quarter_time'] = moments.quarter_time.values.astype(np.float32)
+    encoded['shot_clock'] = moments.shot_clock.values.astype(np.float32)
+    return encoded
+
+
+def decode_moments(encoded):
+    """
+    Inverse of encode_moments() for the clock columns.  Positions stay
+    encoded (see read_compact_game()).
+
+    Args:
+        encoded (dict): output of encode_moments()
+
+    Returns:
+        pd.DataFrame: moments in the format of a slim game's moments
+            (see Game._compact_moments()), with universe_time in msec
+            since encoded['universe_time_start']
+    """
+    quarter_time = encoded['quarter_time']
+    moments = pd.DataFrame({
+        'quarter': encoded['quarter'],
+        'universe_time': np.cumsum(encoded['universe_time_delta'],
+                                   dtype=np.int64).astype(np.int32),
+        'quarter_time': quarter_time,
+        'shot_clock': encoded['shot_clock']})
+    moments['game_time'] = ((encoded['quarter'].astype(np.int64) - 1) * 720 +
+                            (720 - quarter_time)).astype(np.float32)
+    return moments
+
+
+def write_compact_game(game, filename):
+    """
+    Writes a game to disk with compact moments.
+    The raw tracking_data dict and cached arrays are not written.
+
+    Args:
+        game (Game): game to write
+        filename (str): path of file to write
+    """
+    state = game.__getstate__()
+    state['tracking_data'] = None
+    state['moments'] = None
+    state['_positions'] = None
+    with gzip.open(filename, 'wb', compresslevel=6) as game_file:
+        pickle.dump({'state': state, 'moments': encode_moments(game)},
+                    game_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_compact_game(filename):
+    """
+    Reads a game written by write_compact_game().  Its positions are kept
+    encoded and decoded on demand (see Game.get_position_arrays()).
+
+    Args:
+        filename (str): path of file to read
+
+    Returns:
+        Game: game with the clock columns of moments decoded
+    """
+    with gzip.open(filename, 'rb') as game_file:
+        data = pickle.load(game_file)
+    encoded = data['moments']
+    game = Game.__new__(Game)
+    game.__dict__.update(data['state'])
+    game.moments = decode_moments(encoded)
+    game.universe_time_start = (getattr(game, 'universe_time_start', 0) +
+                                int(encoded['universe_time_start']))
+    game._positions = dict((key, encoded[key]) for key in
+                           ['xyz', 'team_ids', 'player_ids', 'n_entities'])
+    return game
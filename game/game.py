@@ -1,25 +1,129 @@
 """
 Library for retrieving basektball player-tracking and play-by-play data.
-"""
 
-import matplotlib
-matplotlib.use('TkAgg')
+Plotting and rendering (matplotlib, seaborn, render.py, ...) are imported
+by the methods that use them, so games can be loaded and analyzed
+without a display or GUI backend, and importing has no side effects.
+"""
 
 import os
+import sys
 import warnings
 import json
 from subprocess import Popen, PIPE
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.patches import Circle, Rectangle, Arc, Polygon
 import numpy as np
-import seaborn as sns
-from scipy.spatial import ConvexHull
-
-# Initialize project
-os.system('mkdir temp')
+import instrument
+import quality
+
+# Data sources.  As before, datalink is the URL of a tracking archive and
+# curl_request the shell command that writes the play-by-play response
+# to temp/pbp_{game_id}.json, both used as they are.  When set,
+# datalink_template (with a {tracking_id} field) and
+# curl_request_template (with {game_id} and {directory} fields) are used
+# instead; fetching several games at once (prefetch.py) needs them.
 datalink = None
 curl_request = None
+datalink_template = None
+curl_request_template = None
+
+
+def fetch_tracking_data(tracking_id, directory='temp'):
+    """
+    Downloads and extracts the tracking data for a game.
+
+    Args:
+        tracking_id (str): 'MM.DD.YYYY.AWAYTEAM.at.HOMETEAM'
+            For Example: 01.13.2016.GSW.at.DEN
+        directory (str): directory the archive is extracted into.
+            Games fetched at the same time need their own directories.
+
+    Returns: tuple of data (game_id, tracking_data)
+        game_id (str): ID for game
+        tracking_data (dict): Dictionary of unstructured tracking data
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    zipfile = os.path.join(directory, 'zipdata')
+    url = datalink
+    if datalink_template is not None:
+        url = datalink_template.format(tracking_id=tracking_id)
+    # Retrive and extract Data into directory
+    with instrument.span('curl'):
+        os.system("curl {datalink} -o {zipfile}"
+                  .format(datalink=url, zipfile=zipfile))
+    with instrument.span('7za'):
+        os.system("7za -o{directory} x {zipfile}"
+                  .format(directory=directory, zipfile=zipfile))
+    os.remove(zipfile)
+
+    # Extract game ID from extracted file name.
+    game_id = None
+    for file in os.listdir(directory):
+        if os.path.splitext(file)[1] == '.json' and \
+                not file.startswith('pbp_'):
+            game_id = file[:-5]
+
+    # Load tracking data and remove json file
+    json_file = os.path.join(directory, '{game_id}.json'
+                             .format(game_id=game_id))
+    with open(json_file) as data_file, instrument.span('json.load'):
+        tracking_data = json.load(data_file)
+    os.remove(json_file)
+    return (game_id, tracking_data)
+
+
+def fetch_playbyplay_data(game_id, directory='temp'):
+    """
+    Downloads the play-by-play data for a game.
+    curl_request_template must write the response to
+    {directory}/pbp_{game_id}.json.  If it is None, curl_request is run
+    as it is and must write it to temp/pbp_{game_id}.json.
+
+    Args:
+        game_id (str): ID for game
+        directory (str): directory the response is written into
+
+    Returns:
+        dict: play-by-play result set with 'headers' and 'rowSet'
+    """
+    if curl_request_template is None:
+        command, directory = curl_request, 'temp'
+    else:
+        command = curl_request_template.format(game_id=game_id,
+                                               directory=directory)
+    with instrument.span('curl'):
+        os.system(command)
+    # Load play by play and remove json file
+    json_file = os.path.join(directory, 'pbp_{game_id}.json'
+                             .format(game_id=game_id))
+    with open(json_file) as data_file, instrument.span('json.load'):
+        parsed = json.load(data_file)['resultSets'][0]
+    os.remove(json_file)
+    return parsed
+
+
+def _make_directory(directory='temp'):
+    """
+    Helper function to create the directory videos and images are
+    written to.  '' (the current directory) is left alone.
+    """
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+
+def _deep_getsizeof(obj):
+    """
+    Helper function for the size in bytes of an object and everything
+    it contains.  Follows dicts, lists and tuples.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_getsizeof(key) + _deep_getsizeof(value)
+                    for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_deep_getsizeof(item) for item in obj)
+    return size
 
 
 class Game(object):
@@ -29,7 +133,12 @@ class Game(object):
     anaylsis and plotting.
     """
 
-    def __init__(self, date, team1, team2):
+    # Derived data that is not pickled with the game
+    _cached_attributes = ['_position_arrays', '_stints', '_quality_mask',
+                          '_matchups']
+
+    def __init__(self, date, team1, team2, tracking_data=None,
+                 playbyplay_data=None, slim=False):
         """
         Args:
             date (str): 'MM.DD.YYYY', date of game
@@ -37,6 +146,15 @@ class Game(object):
                 tracking file name
             team2 (str): 'XXX', abbreviation of team2 in data
                 tracking file name
+            tracking_data (dict): Already loaded tracking data
+                (see fetch_tracking_data()).  If None, it is downloaded.
+            playbyplay_data (dict): Already loaded play-by-play result set
+                (see fetch_playbyplay_data()).  If None, it is downloaded.
+            slim (bool): If True, release tracking_data once it is
+                formatted and store moments in compact dtypes, with
+                positions in one float32 block for the game instead of
+                moments['positions'] (see _compact_moments()).  Useful
+                for keeping many games in memory or pickling games.
 
         Attributes:
             date (str): 'MM.DD.YYYY', date of game
@@ -49,7 +167,7 @@ class Game(object):
                 complicated: 'MM.DD.YYYY.AWAYTEAM.at.HOMETEAM'
                 For Example: 01.13.2016.GSW.at.DEN
             tracking_data (dict): Dictionary of unstructured tracking
-                data scraped from github.
+                data scraped from github.  None if slim.
             game_id (str): ID for game.  Lukcily, SportVU and play by
                 play use the same game ID
             pbp (pd.DataFrame): Play by play data.  33 columns per pbp
@@ -60,7 +178,10 @@ class Game(object):
                 Columns: ['quarter', 'universe_time', 'quarter_time',
                 'shot_clock', 'positions', 'game_time'].
                 moments['positions'] contains a list of where each player
-                and the ball are located.
+                and the ball are located.  Slim games have no positions
+                column; use get_position_arrays() instead.
+            universe_time_start (int): moments.universe_time is msec
+                since this universe_time.  0 unless slim.
             player_ids (dict): dictionary of {player: player_id} for
                 all players in game.
             away_id (int): ID of away team
@@ -81,10 +202,23 @@ class Game(object):
         self.pbp = None
         self.moments = None
         self.player_ids = None
-        self._get_tracking_data()
-        self._get_playbyplay_data()
-        self._format_tracking_data()
-        self._get_player_ids()
+        self.universe_time_start = 0
+        self._positions = None
+        self._position_arrays = None
+        self._quality_mask = None
+        self._matchups = None
+        if tracking_data is None:
+            with instrument.span('fetch_tracking_data'):
+                self._get_tracking_data()
+        else:
+            self.tracking_data = tracking_data
+            self.game_id = tracking_data['gameid']
+        with instrument.span('playbyplay_data'):
+            self._get_playbyplay_data(playbyplay_data)
+        with instrument.span('format_tracking_data'):
+            self._format_tracking_data()
+        with instrument.span('player_ids'):
+            self._get_player_ids()
         self.away_id = self.tracking_data['events'][0]['visitor']['teamid']
         self.home_id = self.tracking_data['events'][0]['home']['teamid']
         self.team_colors = {-1: "orange",
@@ -94,8 +228,13 @@ class Game(object):
                           ['abbreviation'])
         self.away_team = (self.tracking_data['events'][0]['visitor']
                           ['abbreviation'])
+        if slim:
+            self.tracking_data = None
+            with instrument.span('compact_moments'):
+                self._compact_moments()
         self.flip_direction = False
-        self._determine_direction()
+        with instrument.span('determine_direction'):
+            self._determine_direction()
         print('All data is loaded')
 
     def _get_tracking_data(self):
@@ -104,38 +243,23 @@ class Game(object):
         Tracking Data is provided by NBA.com,
         hosted at: https://www.github.com/neilmj
         """
-        # Retrive and extract Data into /temp folder
-
-        os.system(("curl {datalink} -o temp/zipdata"
-                   .format(datalink=datalink)))
-        os.system("7za -o./temp x temp/zipdata")
-        os.remove("./temp/zipdata")
-
-        # Extract game ID from extracted file name.
-        for file in os.listdir('./temp'):
-            if os.path.splitext(file)[1] == '.json':
-                self.game_id = file[:-5]
-
-        # Load tracking data and remove json file
-        with open('temp/{self.game_id}.json'.format(self=self)) as data_file:
-            self.tracking_data = json.load(data_file)  # Load this json
-        os.remove('./temp/{self.game_id}.json'.format(self=self))
+        self.game_id, self.tracking_data = fetch_tracking_data(
+            self.tracking_id)
         return self
 
-    def _get_playbyplay_data(self):
+    def _get_playbyplay_data(self, parsed=None):
         """
         Helper function for retrieving play-by-play data.
         Play-by-play data is obtained via API call to NBA.com
         This service is likely to go down at any moment and ruin this
         whole project.
+
+        Args:
+            parsed (dict): Already loaded play-by-play result set.
+                If None, it is downloaded.
         """
-        os.system(curl_request)
-        # load play by play into pandas DataFrame
-        with open(("{cwd}/temp/pbp_{self.game_id}.json"
-                   .format(cwd=os.getcwd(), self=self))) as json_file:
-            parsed = json.load(json_file)['resultSets'][0]
-        os.remove(("{cwd}/temp/pbp_{self.game_id}.json"
-                   .format(cwd=os.getcwd(), self=self)))
+        if parsed is None:
+            parsed = fetch_playbyplay_data(self.game_id)
         self.pbp = pd.DataFrame(parsed['rowSet'])
         self.pbp.columns = parsed['headers']
 
@@ -195,15 +319,152 @@ class Game(object):
         self.moments = moments
         return self
 
-    def _draw_court(self, color="gray", lw=2, grid=False, zorder=0):
+    def _compact_moments(self):
+        """
+        Helper function to store moments in compact dtypes.
+        Positions move out of moments into blocks for the whole game
+        (float32 coordinates, int32 ids, see get_position_arrays()),
+        instead of one nested list per frame.  Clock columns are downcast
+        and universe_time is stored as int32 msec since
+        universe_time_start.
+        """
+        arrays = self.get_position_arrays()
+        self._positions = {
+            'xyz': arrays['xyz'].astype(np.float32),
+            'team_ids': arrays['team_ids'].astype(np.int32),
+            'player_ids': arrays['player_ids'].astype(np.int32),
+            'n_entities': arrays['n_entities'].astype(np.int8)}
+        self._position_arrays = None
+        moments = self.moments.drop('positions', axis=1)
+        universe_time = moments.universe_time.values.astype(np.int64)
+        if len(universe_time):
+            self.universe_time_start = int(universe_time[0])
+        moments['universe_time'] = (universe_time -
+                                    self.universe_time_start).astype(np.int32)
+        moments['quarter'] = moments.quarter.astype(np.int8)
+        for column in ['quarter_time', 'shot_clock', 'game_time']:
+            moments[column] = moments[column].astype(np.float32)
+        self.moments = moments
+        return self
+
+    def memory_usage(self):
+        """
+        Reports the approximate memory footprint of the game.
+
+        Returns:
+            dict: {attribute: bytes} for tracking_data, moments, pbp and
+                the positions of slim games, plus 'total'
+        """
+        usage = {'tracking_data': _deep_getsizeof(self.tracking_data),
+                 'moments': 0, 'pbp': 0, 'positions': 0}
+        positions = getattr(self, '_positions', None)
+        if positions is not None:
+            usage['positions'] = sum(array.nbytes
+                                     for array in positions.values())
+        for attribute in ['moments', 'pbp']:
+            df = getattr(self, attribute)
+            if df is None:
+                continue
+            usage[attribute] = int(df.memory_usage(index=True).sum())
+            # memory_usage(deep=True) does not follow nested lists
+            for column in df.columns[df.dtypes == object]:
+                usage[attribute] += sum(_deep_getsizeof(value)
+                                        for value in df[column])
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def get_position_arrays(self):
+        """
+        Positions of every player and the ball as arrays, one row per frame.
+        Frames with fewer entities than the widest frame are padded with
+        NaN coordinates and 0 ids.  Cached after the first call.  Slim
+        games return their stored blocks, in their compact dtypes, and
+        games read by compact.read_compact_game() decode theirs on every
+        call.
+
+        Returns: dict of arrays
+            xyz (np.ndarray): float64 (float32 if slim)
+                (frames, entities, 3) of x, y, z
+            team_ids (np.ndarray): int64 (int32 if slim)
+                (frames, entities), -1 for ball
+            player_ids (np.ndarray): int64 (int32 if slim)
+                (frames, entities), -1 for ball
+            n_entities (np.ndarray): int64 (int8 if slim) (frames,)
+                entities in frame
+        """
+        if getattr(self, '_position_arrays', None) is not None:
+            return self._position_arrays
+        positions = getattr(self, '_positions', None)
+        if positions is not None:
+            if positions['xyz'].dtype == np.int16:
+                # Read by compact.read_compact_game(): decoded on every
+                # call, so only the encoded positions stay in memory
+                import compact
+                return compact.decode_position_arrays(positions)
+            return positions
+        positions = self.moments.positions.values
+        n_entities = np.array([len(frame) for frame in positions],
+                              dtype=np.int64)
+        width = int(n_entities.max()) if len(n_entities) else 0
+        data = np.full((len(positions), width, 5), np.nan)
+        # Frames with the same number of entities are converted together
+        for count in np.unique(n_entities):
+            if count == 0:
+                continue
+            rows = np.where(n_entities == count)[0]
+            data[rows, :count, :] = np.array([positions[row][:count]
+                                              for row in rows],
+                                             dtype=np.float64)
+        ids = np.nan_to_num(data[:, :, :2]).astype(np.int64)
+        self._position_arrays = {'xyz': data[:, :, 2:],
+                                 'team_ids': ids[:, :, 0],
+                                 'player_ids': ids[:, :, 1],
+                                 'n_entities': n_entities}
+        return self._position_arrays
+
+    def _frame_positions(self, frame_number):
+        """
+        Helper function for the [team_id, player_id, x, y, z] rows of the
+        entities in a frame
+        """
+        positions = getattr(self, '_positions', None)
+        if positions is None:
+            return self.moments.positions.values[frame_number]
+        count = positions['n_entities'][frame_number]
+        xyz = positions['xyz'][frame_number, :count]
+        if xyz.dtype == np.int16:
+            import compact
+            xyz = compact.decode_xyz(xyz)
+        return np.column_stack((positions['team_ids'][frame_number, :count],
+                                positions['player_ids'][frame_number, :count],
+                                xyz))
+
+    def __getstate__(self):
+        """
+        Cached arrays are rebuilt on demand instead of being pickled.
+        """
+        state = self.__dict__.copy()
+        for attribute in self._cached_attributes:
+            state[attribute] = None
+        return state
+
+    def _draw_court(self, color="gray", lw=2, grid=False, zorder=0,
+                    ax=None):
         """
         Helper function to draw court.
         Modified from Savvas Tjortjoglou with contribution
             from Michael Wheelock
         S. Tjortjoglou: http://savvastjortjoglou.com/nba-shot-sharts.html
         M. Wheelock: https://www.linkedin.com/in/michael-s-wheelock-a5635a66
+
+        Args:
+            ax (matplotlib.axes.Axes): axes to draw on.
+                If None, the current axes.
         """
-        ax = plt.gca()
+        import matplotlib.pyplot as plt
+        from matplotlib.patches import Circle, Rectangle, Arc
+        if ax is None:
+            ax = plt.gca()
 
         # Create the court lines
         outer = Rectangle((0, -50), width=94, height=50, color=color,
@@ -299,6 +560,7 @@ class Game(object):
                                         game_time + length].index.values[0]
 
         # Make video of each frame
+        _make_directory('temp')
         for frame in range(starting_frame, ending_frame):
             self.plot_frame(frame, highlight_player=highlight_player,
                             commentary=commentary, show_spacing=show_spacing)
@@ -317,7 +579,8 @@ class Game(object):
 
         return self
 
-    def watch_player_actions(self, player_name, action, length=15, max_vids=5):
+    def watch_player_actions(self, player_name, action, length=15, max_vids=5,
+                             reel=False):
         """
         Method for viewing all plays a player in the game had of a
         specified type.
@@ -335,9 +598,17 @@ class Game(object):
                 max_vids=None if all videos are desired.  If max_vids
                 is less than the total number of actions in the game, the
                 earliest actions are made into videos.
+            reel (bool): If True, output a single video of all plays with
+                a chapter per play, rendered in one pass
+                (see highlights.build_highlight_reel())
 
         Returns: an instance of self, and outputs video file of plays
         """
+        if reel:
+            from highlights import build_highlight_reel
+            build_highlight_reel([self], player_name, action, length=length,
+                                 max_clips=max_vids)
+            return self
         player_action_times = self._get_player_actions(player_name, action)
         for index, time in enumerate(player_action_times):
             if index == max_vids:
@@ -454,7 +725,7 @@ class Game(object):
         universe_time = int(current_moment['universe_time'])
         x_pos, y_pos, colors, sizes, edges = [], [], [], [], []
         # Get player positions
-        for player in current_moment.positions:
+        for player in self._frame_positions(frame_number):
             x_pos.append(player[2])
             y_pos.append(player[3])
             colors.append(self.team_colors[player[0]])
@@ -511,6 +782,10 @@ class Game(object):
 
         TODO be able to call this method by game time instead of frame_number
         """
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        from matplotlib.patches import Polygon
+        from scipy.spatial import ConvexHull
         (game_time, x_pos, y_pos, colors, sizes,
          quarter, shot_clock, game_clock, edges,
          universe_time) = self._get_moment_details(frame_number,
@@ -568,6 +843,7 @@ class Game(object):
 
         else:
             # Save image to disk
+            _make_directory('temp')
             plt.savefig('temp/{frame_number}.png'
                         .format(frame_number=frame_number),
                         bbox_inches='tight')
@@ -608,6 +884,7 @@ class Game(object):
             away_area (float): convex hull area of away team
 
         """
+        from scipy.spatial import ConvexHull
         details = self._get_moment_details(frame_number)
         x_pos = np.array(details[1])
         y_pos = np.array(details[2])
@@ -628,11 +905,11 @@ class Game(object):
         Returns:
             str in ['home', 'away']
         """
+        if not quality.frame_is_valid(self, frame_number):
+            return None
         details = self._get_moment_details(frame_number)
         x_pos = np.array(details[1])
         quarter = details[5]
-        if len(x_pos) != 11:
-            return None
         if self.flip_direction:
             if (x_pos < 47).all() and quarter in [1, 2]:
                 return 'away'
@@ -734,12 +1011,15 @@ class Game(object):
         return (start_frame, end_frame)
 
     def animate_play(self, game_time, length, highlight_player=None,
-                     commentary=True, show_spacing=None):
+                     commentary=True, show_spacing=None, processes=1,
+                     preview=False, fps=20, speed=None, interpolate=False):
         """
         Method for animating plays in game.
         Outputs video file of play in {cwd}/temp.
         Individual frames are streamed directly to ffmpeg without writing them
-        to the disk, which is a great speed improvement over watch_play
+        to the disk, which is a great speed improvement over watch_play.
+        Frames are drawn by render.FrameRenderer, which reuses one figure
+        and only redraws what changes between frames.
 
         Args:
             game_time (int): time in game to start video
@@ -755,9 +1035,25 @@ class Game(object):
             show_spacing (str) in ['home', 'away']: show convex hull
                 spacing of home or away team.
                 If None, does not show spacing.
+            processes (int): number of processes rendering frames
+                (see render.render_frames())
+            preview (bool): If True, render quick, text-free frames with
+                preview.PreviewRenderer instead of matplotlib.
+                commentary and processes are ignored.
+            fps (float): frames per second of the video
+            speed (float): playback speed relative to real time, e.g. 8
+                for a quick overview of a quarter or 0.25 for slow motion.
+                Only the frames shown are rendered
+                (see render.playback_frames()).
+                If None, every tracking frame is shown once.
+            interpolate (bool): If True and speed is set, positions are
+                interpolated between tracking frames for smooth slow
+                motion.  Ignored when preview.
 
         Returns: an instance of self, and outputs video file of play
         """
+        from render import render_frames, prepare_frames, playback_frames
+        from preview import PreviewRenderer
         if type(game_time) == tuple:
             starting_frame = game_time[0]
             ending_frame = game_time[1]
@@ -769,24 +1065,39 @@ class Game(object):
                                         game_time + length].index.values[0]
 
         # Make video of each frame
+        _make_directory('temp')
         filename = "./temp/{game_time}.mp4".format(game_time=game_time)
-        if commentary:
-            size = (960, 960)
+        frames = range(starting_frame, ending_frame)
+        weights = None
+        if speed is not None:
+            frames, weights = playback_frames(self, starting_frame,
+                                              ending_frame, fps=fps,
+                                              speed=speed,
+                                              interpolate=interpolate)
+        if preview:
+            renderer = PreviewRenderer(self, highlight_player=highlight_player,
+                                       show_spacing=show_spacing)
+            size, pix_fmt = renderer.size, 'rgb24'
+            images = (renderer.render(frame).tobytes() for frame in frames)
         else:
-            size = (960, 480)
+            size = (960, 960) if commentary else (960, 480)
+            pix_fmt = 'rgba'  # Stream rgba data from matplotlib
+            images = render_frames(self, None, processes=processes,
+                                   state=prepare_frames(self, frames, weights),
+                                   highlight_player=highlight_player,
+                                   commentary=commentary,
+                                   show_spacing=show_spacing)
         cmdstring = ('ffmpeg',
-                     '-y', '-r', '20',  # fps
+                     '-y', '-r', str(fps),  # fps
                      '-s', '%dx%d' % size,  # size of image string
-                     '-pix_fmt', 'argb',  # Stream argb data from matplotlib
+                     '-pix_fmt', pix_fmt,
                      '-f', 'rawvideo',  '-i', '-',
                      '-vcodec', 'libx264', filename)
 
         # Stream plots to pipe
         pipe = Popen(cmdstring, stdin=PIPE)
-        for frame in range(starting_frame, ending_frame):
-            self.plot_frame(frame, highlight_player=highlight_player,
-                            commentary=commentary, show_spacing=show_spacing,
-                            pipe=pipe)
+        for image in images:
+            pipe.stdin.write(image)
         pipe.stdin.close()
         pipe.wait()
         return self
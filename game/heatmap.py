@@ -0,0 +1,250 @@
+"""
+Court-occupancy heatmaps accumulated across games.
+
+Positions of every frame with a team on offense are binned into fixed
+grids of the court, one grid per player, team and opponent on offense
+and on defense.  Courts are mirrored so the offense always attacks the
+left basket, which makes both halves of a game (and all games) add up.
+Grids are plain counts, so partial heatmaps from different games or
+processes merge by adding them, and no frames are kept:
+
+    heatmaps = Heatmaps()
+    for game in games:
+        heatmaps.add_game(game)
+    heatmaps.get('player', game.player_ids['Stephen Curry'], 'offense')
+
+Grid keys are (kind, id, side):
+    ('player', player_id, side)  where the player stands
+    ('team', team_id, side)      where the team's players stand
+    ('opponent', team_id, side)  where the team's opponents stand, e.g.
+                                 ('opponent', team_id, 'defense') shows
+                                 the zones the team's defense concedes
+"""
+
+import os
+import numpy as np
+import analytics
+from prefetch import run_season, load_game_data
+import instrument
+
+# Court size in feet
+COURT_LENGTH = 94
+COURT_WIDTH = 50
+
+KINDS = ['player', 'team', 'opponent']
+SIDES = ['offense', 'defense']
+
+
+class Heatmaps(object):
+    """
+    Counts of player positions in court grids, by (kind, id, side).
+    """
+
+    def __init__(self, bin_size=1.0):
+        """
+        Args:
+            bin_size (float): width and height of each bin in feet
+        """
+        self.bin_size = bin_size
+        self.shape = (int(np.ceil(COURT_LENGTH / bin_size)),
+                      int(np.ceil(COURT_WIDTH / bin_size)))
+        self.grids = {}
+        self.games = 0
+
+    def _bins(self, xy):
+        """
+        Helper function for the flat bin index of court positions.
+        Positions off the court are counted in the nearest edge bin.
+        """
+        x_bin = np.clip((xy[..., 0] / self.bin_size).astype(np.int64),
+                        0, self.shape[0] - 1)
+        y_bin = np.clip((xy[..., 1] / self.bin_size).astype(np.int64),
+                        0, self.shape[1] - 1)
+        return x_bin * self.shape[1] + y_bin
+
+    def _count(self, kind, ids, sides, bins):
+        """
+        Helper function to add bins of one kind, grouped by id and side,
+        to the grids with a single bincount
+        """
+        size = self.shape[0] * self.shape[1]
+        groups, group_index = np.unique(np.column_stack((ids, sides)),
+                                        axis=0, return_inverse=True)
+        group_index = group_index.ravel()
+        counts = np.bincount(group_index * size + bins,
+                             minlength=len(groups) * size)
+        for (group_id, side), grid in zip(groups,
+                                          counts.reshape(len(groups),
+                                                         *self.shape)):
+            key = (kind, int(group_id), SIDES[side])
+            if key in self.grids:
+                self.grids[key] += grid
+            else:
+                self.grids[key] = grid
+
+    def add_arrays(self, arrays, metadata):
+        """
+        Adds the frames of a game with a team on offense.
+
+        Args:
+            arrays (dict): game arrays (see analytics.game_arrays())
+            metadata (dict): see analytics.game_metadata()
+
+        Returns: an instance of self
+        """
+        offense = analytics.offensive_teams(arrays,
+                                            metadata['flip_direction'])
+        frames = np.where(offense != analytics.NO_OFFENSE)[0]
+        xy = arrays['xyz'][frames, 1:11, :2]
+        team_ids = arrays['team_ids'][frames, 1:11]
+        player_ids = arrays['player_ids'][frames, 1:11]
+
+        # Mirror frames played on the right half, so offense attacks left
+        right = (xy[:, :, 0] > COURT_LENGTH / 2.).all(axis=1)
+        xy = xy.copy()
+        xy[right] = [COURT_LENGTH, COURT_WIDTH] - xy[right]
+
+        offense_ids = np.where(offense[frames] == analytics.HOME_OFFENSE,
+                               metadata['home_id'], metadata['away_id'])
+        # 0 for offense, 1 for defense
+        sides = (team_ids != offense_ids[:, np.newaxis]).astype(np.int64)
+        opponent_ids = np.where(team_ids == metadata['home_id'],
+                                metadata['away_id'], metadata['home_id'])
+        bins = self._bins(xy).ravel()
+        sides = sides.ravel()
+        self._count('player', player_ids.ravel(), sides, bins)
+        self._count('team', team_ids.ravel(), sides, bins)
+        # Opponents see the other side of the same frame
+        self._count('opponent', opponent_ids.ravel(), 1 - sides, bins)
+        self.games += 1
+        return self
+
+    def add_game(self, game):
+        """
+        Adds the frames of a game with a team on offense.
+
+        Args:
+            game (Game): game to add
+
+        Returns: an instance of self
+        """
+        return self.add_arrays(analytics.game_arrays(game),
+                               analytics.game_metadata(game))
+
+    def merge(self, other):
+        """
+        Adds the counts of other heatmaps, e.g. from another process.
+
+        Args:
+            other (Heatmaps): heatmaps with the same bin_size
+
+        Returns: an instance of self
+        """
+        if other.shape != self.shape:
+            raise ValueError('Cannot merge heatmaps with bin sizes {0} and '
+                             '{1}'.format(self.bin_size, other.bin_size))
+        for key, grid in other.grids.items():
+            if key in self.grids:
+                self.grids[key] = self.grids[key] + grid
+            else:
+                self.grids[key] = grid.copy()
+        self.games += other.games
+        return self
+
+    def get(self, kind, id, side, normalize=False):
+        """
+        Grid of a player, team or opponent.
+
+        Args:
+            kind (str) {'player', 'team', 'opponent'}: kind of grid
+            id (int): player_id, or team_id for 'team' and 'opponent'
+            side (str) {'offense', 'defense'}: side of ball
+            normalize (bool): If True, fractions of time in each bin
+                instead of frame counts
+
+        Returns:
+            np.ndarray: (COURT_LENGTH / bin_size, COURT_WIDTH / bin_size)
+                grid indexed by [x_bin, y_bin].  All 0 if never seen.
+        """
+        grid = self.grids.get((kind, id, side))
+        if grid is None:
+            return np.zeros(self.shape)
+        if normalize:
+            return grid / float(grid.sum())
+        return grid
+
+    def save(self, filename):
+        """
+        Writes heatmaps to a .npz file
+        """
+        grids = {'{0}/{1}/{2}'.format(*key): grid
+                 for key, grid in self.grids.items()}
+        np.savez_compressed(filename, bin_size=self.bin_size,
+                            games=self.games, **grids)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads heatmaps written by save()
+
+        Returns: Heatmaps
+        """
+        with np.load(filename) as data:
+            heatmaps = cls(float(data['bin_size']))
+            heatmaps.games = int(data['games'])
+            for name in data.files:
+                if name in ['bin_size', 'games']:
+                    continue
+                kind, id, side = name.split('/')
+                heatmaps.grids[(kind, int(id), side)] = data[name]
+        return heatmaps
+
+
+def write_heatmaps(gamelist, filename='data/heatmaps.npz', bin_size=1.0,
+                   prefetch=2, loader=load_game_data):
+    """
+    Builds season heatmaps in one pass over the games and writes them.
+    Games that cannot be loaded are logged to errorlog.txt.
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+        filename (str): .npz file to write (see Heatmaps.save())
+        bin_size (float): width and height of each bin in feet
+        prefetch (int): number of games to download ahead
+            (see prefetch.prefetch_games())
+        loader (function): loads a game's data, e.g.
+            prefetch.load_local_game_data or synthetic.SyntheticLoader()
+
+    Returns: Heatmaps
+    """
+    heatmaps = Heatmaps(bin_size)
+
+    def analyze(game, game_data):
+        with instrument.span('add_game'):
+            heatmaps.add_game(game_data)
+
+    run_season(gamelist, analyze, 'heatmap', 'extract heatmaps',
+               prefetch=prefetch, loader=loader)
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    heatmaps.save(filename)
+    return heatmaps
+
+
+def merge_heatmaps(filenames):
+    """
+    Merges heatmaps written by several processes or nodes, e.g. the
+    per-game files of work_queue.heatmap_job()
+
+    Args:
+        filenames (list): .npz files written by Heatmaps.save()
+
+    Returns: Heatmaps
+    """
+    heatmaps = None
+    for filename in filenames:
+        partial = Heatmaps.load(filename)
+        heatmaps = partial if heatmaps is None else heatmaps.merge(partial)
+    return heatmaps
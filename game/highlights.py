@@ -0,0 +1,161 @@
+"""
+Highlight reels of a player's actions across one or more games.
+
+All of a player's action windows in a game are found in one pass over
+the play-by-play, overlapping windows are merged, and every clip is
+rendered through a single ffmpeg process into one video with a chapter
+per clip.
+
+    reel = build_highlight_reel([game1, game2], 'Stephen Curry', 'made_FG')
+"""
+
+import os
+from subprocess import Popen, PIPE, call
+import numpy as np
+from render import render_frames
+from game import _make_directory
+
+# Frames per second of reels
+FPS = 20
+
+
+def _first_frames(game):
+    """
+    Helper function for the first frame of every whole second of game time
+
+    Returns: tuple of (times, frames)
+        times (np.ndarray): sorted whole seconds present in game.moments
+        frames (np.ndarray): first frame at each of those seconds
+    """
+    rounded = game.moments.game_time.round().values
+    times, frames = np.unique(rounded, return_index=True)
+    return (times, frames)
+
+
+def action_windows(game, player_name, action, length=15):
+    """
+    Frame windows leading up to each of a player's actions in a game.
+    Overlapping windows are merged into one.
+
+    Args:
+        game (Game): game to search
+        player_name (str): name of player, as in game.player_ids
+        action (str) {'all_FG', 'made_FG', 'miss_FG', 'rebound'}:
+            Action type of interest
+        length (int): seconds of play before each action
+
+    Returns:
+        list: (starting_frame, ending_frame, game_time) for each window,
+            where game_time is the time of the first action in the window
+    """
+    if player_name not in game.player_ids:
+        return []
+    action_times = np.sort(game._get_player_actions(player_name, action))
+    times, frames = _first_frames(game)
+    if len(action_times) == 0 or len(times) == 0:
+        return []
+
+    # Like Game.get_frame(), use the latest second at or before each time
+    def lookup(targets):
+        index = np.searchsorted(times, targets, side='right') - 1
+        return frames[np.clip(index, 0, len(frames) - 1)]
+    starts = lookup(action_times - length)
+    ends = lookup(action_times)
+
+    windows = []
+    for start, end, time in zip(starts, ends, action_times):
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(end, windows[-1][1]),
+                           windows[-1][2])
+        elif end > start:
+            windows.append((int(start), int(end), int(time)))
+    return windows
+
+
+def _write_chapters(chapters, filename):
+    """
+    Helper function to write chapters in ffmpeg's metadata format
+
+    Args:
+        chapters (list): (start_msec, end_msec, title) for each chapter
+        filename (str): metadata file to write
+    """
+    with open(filename, 'w') as metadata:
+        metadata.write(';FFMETADATA1\n')
+        for start, end, title in chapters:
+            metadata.write('[CHAPTER]\nTIMEBASE=1/1000\n'
+                           'START={start}\nEND={end}\ntitle={title}\n'
+                           .format(start=start, end=end,
+                                   title=title.replace('=', r'\=')))
+
+
+def build_highlight_reel(games, player_name, action, length=15,
+                         max_clips=None, commentary=False, filename=None,
+                         processes=1):
+    """
+    Renders all of a player's actions in several games into one video.
+
+    Args:
+        games (iterable): Game instances.  Can be a generator, so games
+            are loaded one at a time for season-long reels.
+        player_name (str): Name of player.  Games the player did not
+            play in are skipped.
+        action (str) {'all_FG', 'made_FG', 'miss_FG', 'rebound'}:
+            Action type of interest
+        length (int): seconds of play before each action
+        max_clips (int): maximum number of clips.  If None, all clips.
+        commentary (bool): Whether to include play-by-play commentary
+        filename (str): video file to write.  If None,
+            temp/{player_name}_{action}.mp4
+        processes (int): number of processes rendering frames
+
+    Returns:
+        list: (game_id, starting_frame, ending_frame) of each clip, in
+            the order they appear in the video
+    """
+    if filename is None:
+        filename = 'temp/{player}_{action}.mp4'.format(
+            player=player_name.replace(' ', '_'), action=action)
+    _make_directory(os.path.dirname(filename))
+    size = (960, 960) if commentary else (960, 480)
+    video = filename + '.nochapters.mp4'
+    cmdstring = ('ffmpeg', '-y', '-r', str(FPS),
+                 '-s', '%dx%d' % size, '-pix_fmt', 'rgba',
+                 '-f', 'rawvideo', '-i', '-',
+                 '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', video)
+    pipe = Popen(cmdstring, stdin=PIPE)
+    clips, chapters = [], []
+    frames_written = 0
+    for game in games:
+        if max_clips is not None and len(clips) >= max_clips:
+            break
+        for start, end, time in action_windows(game, player_name, action,
+                                               length):
+            if max_clips is not None and len(clips) >= max_clips:
+                break
+            for image in render_frames(game, range(start, end),
+                                       processes=processes,
+                                       highlight_player=player_name,
+                                       commentary=commentary):
+                pipe.stdin.write(image)
+            quarter = int(game.moments.quarter.iloc[end])
+            clock = divmod(int(game.moments.quarter_time.iloc[end]), 60)
+            title = '{date} {away} at {home} Q{quarter} {clock}'.format(
+                date=game.date, away=game.away_team, home=game.home_team,
+                quarter=quarter, clock='%02d:%02d' % clock)
+            chapters.append((frames_written * 1000 // FPS,
+                             (frames_written + end - start) * 1000 // FPS,
+                             title))
+            clips.append((game.game_id, start, end))
+            frames_written += end - start
+    pipe.stdin.close()
+    pipe.wait()
+
+    # Add chapters without re-encoding
+    metadata = filename + '.chapters.txt'
+    _write_chapters(chapters, metadata)
+    call(['ffmpeg', '-y', '-i', video, '-i', metadata,
+          '-map_metadata', '1', '-codec', 'copy', filename])
+    os.remove(video)
+    os.remove(metadata)
+    return clips
@@ -0,0 +1,354 @@
+"""
+Low-overhead instrumentation of loading and analysis stages.
+
+Stages of Game and the season scripts (curl, 7za, json.load, building
+DataFrames, _determine_direction, the frame loops, ...) run inside named
+spans, and the scripts count frames processed and skipped.  Nothing is
+recorded unless instrumentation is enabled, and a disabled span is a
+single flag check:
+
+    import instrument
+    instrument.enable()
+    write_spacing(gamelist)
+    print(instrument.flame_summary())
+    instrument.write_json('data/instrument.json')
+
+Spans nest, so a span's path is the names of the open spans of its
+thread joined by ';', e.g. 'game;Game;determine_direction'.  Games loaded
+by prefetch threads have their own paths, e.g. 'load;json.load'.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.  Peak RSS is not recorded.
+    resource = None
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = None
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+# {path: [calls, total seconds, max seconds]}
+_spans = {}
+# {name: count}
+_counters = {}
+# One dict per game_span()
+_games = []
+
+
+class _NullSpan(object):
+    """
+    Span used while instrumentation is disabled
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable():
+    """
+    Starts recording spans, counters and games
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """
+    Stops recording.  Recorded data is kept until reset().
+    """
+    global _enabled
+    _enabled = False
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    """
+    Discards all recorded data
+    """
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        del _games[:]
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def _span(name):
+    stack = _stack()
+    stack.append(name)
+    path = ';'.join(stack)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            record = _spans.get(path)
+            if record is None:
+                _spans[path] = [1, elapsed, elapsed]
+            else:
+                record[0] += 1
+                record[1] += elapsed
+                record[2] = max(record[2], elapsed)
+
+
+def span(name):
+    """
+    Context manager timing a named stage.
+
+    Args:
+        name (str): name of stage.  Should not contain ';'.
+
+    Returns: context manager
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _span(name)
+
+
+def count(name, n=1):
+    """
+    Adds n to a named counter, e.g. frames processed.  Add totals once per
+    game rather than once per frame.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process so far in bytes, or None if
+    unknown
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _reset_peak_rss():
+    """
+    Helper function to restart the peak RSS of this process at its
+    current RSS (Linux 4.0 and later).  Returns whether it was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _peak_rss_since_reset():
+    """
+    Helper function for the peak RSS in bytes since _reset_peak_rss(),
+    from VmHWM of /proc/self/status, or None if unknown
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def current_rss():
+    """
+    Current resident set size of this process in bytes, from
+    /proc/self/statm, or None if unknown (e.g. not Linux)
+    """
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+@contextmanager
+def _game_span(game):
+    record = {'game': game, 'start_rss': current_rss()}
+    per_game = _reset_peak_rss()
+    start = time.perf_counter()
+    try:
+        with _span('game'):
+            yield
+        record['status'] = 'ok'
+    except Exception:
+        record['status'] = 'error'
+        raise
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        record['rss'] = current_rss()
+        record['peak_rss'] = _peak_rss_since_reset() if per_game else None
+        record['peak_rss_per_game'] = record['peak_rss'] is not None
+        if record['peak_rss'] is None:
+            record['peak_rss'] = peak_rss()
+        with _lock:
+            _games.append(record)
+
+
+def game_span(game):
+    """
+    Context manager around the analysis of one game of a season script.
+    Records the game's time, the RSS before and after it and the peak
+    RSS while it ran.  On Linux the peak is restarted when the game
+    starts, so it is the peak of this game (including prefetch threads
+    loading the next games); elsewhere it is the peak of the process so
+    far (ru_maxrss) and peak_rss_per_game is False.
+
+    Args:
+        game (list): [date, home_team, away_team]
+
+    Returns: context manager
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _game_span('{0}.{2}.at.{1}'.format(*game))
+
+
+def report():
+    """
+    Recorded data.
+
+    Returns: dict
+        spans (list): dicts of path, calls, seconds and max_seconds,
+            sorted by path
+        counters (dict): {name: count}
+        games (list): dicts of game, status, seconds, start_rss, rss,
+            peak_rss (bytes) and peak_rss_per_game (see game_span())
+    """
+    with _lock:
+        return {'spans': [{'path': path, 'calls': record[0],
+                           'seconds': record[1], 'max_seconds': record[2]}
+                          for path, record in sorted(_spans.items())],
+                'counters': dict(_counters),
+                'games': [dict(record) for record in _games]}
+
+
+def write_json(filename):
+    """
+    Writes report() to a JSON file
+    """
+    with open(filename, 'w') as json_file:
+        json.dump(report(), json_file, indent=2)
+
+
+def write_csv(filename):
+    """
+    Writes report() to a CSV file with one row per span, counter and game.
+    Columns: type, name, calls, seconds, max_seconds, value, where value
+    is the count of a counter or the peak RSS of a game (peak_rss).
+    """
+    data = report()
+    with open(filename, 'w') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['type', 'name', 'calls', 'seconds', 'max_seconds',
+                         'value'])
+        for record in data['spans']:
+            writer.writerow(['span', record['path'], record['calls'],
+                             record['seconds'], record['max_seconds'], ''])
+        for name, value in sorted(data['counters'].items()):
+            writer.writerow(['counter', name, '', '', '', value])
+        for record in data['games']:
+            writer.writerow(['game', record['game'], 1, record['seconds'],
+                             '', record['peak_rss']])
+
+
+def write_folded(filename):
+    """
+    Writes spans in the folded stack format of flame graph tools
+    (e.g. flamegraph.pl): one 'path microseconds' line per span, with the
+    span's own time, excluding its children.
+    """
+    with open(filename, 'w') as folded_file:
+        for path, seconds in sorted(_self_times().items()):
+            folded_file.write('{0} {1}\n'.format(path,
+                                                 int(round(seconds * 1e6))))
+
+
+def _self_times():
+    """
+    Helper function for the time of each span excluding its children
+    """
+    totals = {record['path']: record['seconds']
+              for record in report()['spans']}
+    self_times = dict(totals)
+    for path, seconds in totals.items():
+        parent = path.rpartition(';')[0]
+        if parent in self_times:
+            self_times[parent] -= seconds
+    return self_times
+
+
+def flame_summary(min_fraction=0.001):
+    """
+    Text summary of where the time went, as an indented tree of spans
+    with total time, share of the root span and calls, followed by the
+    counters and the largest peak RSS of a game.
+
+    Args:
+        min_fraction (float): leave out spans below this share of their
+            root span
+
+    Returns: str
+    """
+    data = report()
+    totals = {record['path']: record for record in data['spans']}
+    lines = []
+    for path in sorted(totals):
+        record = totals[path]
+        names = path.split(';')
+        root = totals.get(names[0], record)
+        fraction = record['seconds'] / max(root['seconds'], 1e-12)
+        if fraction < min_fraction:
+            continue
+        lines.append('{indent}{name:<{width}} {seconds:10.3f}s {fraction:6.1%}'
+                     ' {calls:8d} calls'.format(
+                         indent='  ' * (len(names) - 1), name=names[-1],
+                         width=max(40 - 2 * (len(names) - 1), 1),
+                         seconds=record['seconds'], fraction=fraction,
+                         calls=record['calls']))
+    for name, value in sorted(data['counters'].items()):
+        lines.append('{name:<40} {value:>11d}'.format(name=name, value=value))
+    peaks = [record['peak_rss'] for record in data['games']
+             if record['peak_rss'] is not None]
+    if peaks:
+        lines.append('{name:<40} {value:>9.1f}MB'.format(
+            name='largest game peak RSS', value=max(peaks) / 2. ** 20))
+    return '\n'.join(lines)
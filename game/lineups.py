@@ -0,0 +1,222 @@
+"""
+Lineup (five-man unit) statistics from tracking data.
+
+A stint is a contiguous range of frames in which the same five home
+players face the same five away players.  get_stints() builds the stints
+of a game from the player ids of its frames and caches them on the game.
+aggregate() reduces any per-frame metric (spacing, velocity, ...) to one
+row per lineup with a few bincounts, and merge_lineup_tables() adds the
+rows of many games into season totals.
+
+Tables hold sums rather than means, so they merge by addition:
+    team_id, lineup, side, metric, frames, total, total_sq
+where lineup is the sorted player ids joined by '-'.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import analytics
+import quality
+from prefetch import run_season, load_game_data
+import instrument
+
+TABLE_COLUMNS = ['team_id', 'lineup', 'side', 'metric', 'frames', 'total',
+                 'total_sq']
+
+
+def stint_index(arrays):
+    """
+    Splits frames into stints of unchanged home and away lineups.
+    Frames failing quality.valid_frames() are not in any stint.
+
+    Args:
+        arrays (dict): game arrays (see analytics.game_arrays())
+
+    Returns: dict of arrays
+        start (np.ndarray): int64 (stints,) first frame of each stint
+        end (np.ndarray): int64 (stints,) frame after each stint
+        frame_stint (np.ndarray): int64 (frames,) stint of each frame,
+            -1 for frames in no stint
+        home_lineups, away_lineups (np.ndarray): int64 (lineups, 5)
+            unique sorted lineups of each team
+        home_index, away_index (np.ndarray): int64 (stints,) lineup of
+            each stint in home_lineups and away_lineups
+    """
+    complete = quality.valid_frames(arrays)
+    home = np.sort(arrays['player_ids'][:, 1:6], axis=1)
+    away = np.sort(arrays['player_ids'][:, 6:11], axis=1)
+    home[~complete] = 0
+    away[~complete] = 0
+    lineups = np.hstack((home, away))
+    changed = np.ones(len(lineups), dtype=bool)
+    changed[1:] = (lineups[1:] != lineups[:-1]).any(axis=1)
+    starts = np.where(changed)[0]
+    ends = np.append(starts[1:], len(lineups))
+    keep = complete[starts]
+    # Runs of incomplete frames are not stints
+    segment_stint = np.full(len(starts), -1, dtype=np.int64)
+    segment_stint[keep] = np.arange(keep.sum())
+    frame_stint = segment_stint[np.cumsum(changed) - 1]
+    starts, ends = starts[keep], ends[keep]
+    stints = {'start': starts, 'end': ends, 'frame_stint': frame_stint}
+    for team, team_lineups in [('home', home), ('away', away)]:
+        unique, index = np.unique(team_lineups[starts].reshape(-1, 5),
+                                  axis=0, return_inverse=True)
+        stints[team + '_lineups'] = unique
+        stints[team + '_index'] = index.ravel()
+    return stints
+
+
+def get_stints(game):
+    """
+    Stints of a game (see stint_index()), cached on the game.
+
+    Args:
+        game (Game): game to get stints for
+
+    Returns: dict of arrays
+    """
+    if getattr(game, '_stints', None) is None:
+        game._stints = stint_index(analytics.game_arrays(game))
+    return game._stints
+
+
+def aggregate(stints, values, team, team_id, side='all', metric='value'):
+    """
+    Reduces a per-frame metric to one row per lineup of a team.
+
+    Args:
+        stints (dict): see stint_index()
+        values (np.ndarray): float (frames,) metric of each frame.
+            NaN frames are skipped, so NaN out frames to leave out
+            (e.g. frames where the team is on defense).
+        team (str) {'home', 'away'}: team whose lineups to group by
+        team_id (int): id of team, written to the table
+        side (str): label written to the table, e.g. 'offense'
+        metric (str): name of metric written to the table
+
+    Returns:
+        pd.DataFrame: table of TABLE_COLUMNS, one row per lineup with at
+            least one frame
+    """
+    values = np.asarray(values, dtype=np.float64)
+    frame_stint = stints['frame_stint']
+    valid = (frame_stint >= 0) & ~np.isnan(values)
+    groups = stints[team + '_index'][frame_stint[valid]]
+    lineups = stints[team + '_lineups']
+    frames = np.bincount(groups, minlength=len(lineups))
+    total = np.bincount(groups, weights=values[valid],
+                        minlength=len(lineups))
+    total_sq = np.bincount(groups, weights=values[valid] ** 2,
+                           minlength=len(lineups))
+    seen = frames > 0
+    return pd.DataFrame({'team_id': team_id,
+                         'lineup': ['-'.join(map(str, lineup))
+                                    for lineup in lineups[seen]],
+                         'side': side, 'metric': metric,
+                         'frames': frames[seen], 'total': total[seen],
+                         'total_sq': total_sq[seen]},
+                        columns=TABLE_COLUMNS)
+
+
+def merge_lineup_tables(tables):
+    """
+    Adds lineup tables, e.g. of every game in a season, and computes
+    means and standard deviations.
+
+    Args:
+        tables (iterable): DataFrames of TABLE_COLUMNS
+
+    Returns:
+        pd.DataFrame: TABLE_COLUMNS plus mean and std, one row per
+            (team_id, lineup, side, metric)
+    """
+    merged = (pd.concat(list(tables), ignore_index=True)
+              .groupby(['team_id', 'lineup', 'side', 'metric'],
+                       as_index=False)[['frames', 'total', 'total_sq']]
+              .sum())
+    merged['mean'] = merged.total / merged.frames
+    merged['std'] = np.sqrt(np.maximum(
+        merged.total_sq / merged.frames - merged['mean'] ** 2, 0))
+    return merged
+
+
+def lineup_statistics(game):
+    """
+    Spacing and velocity of every lineup in a game, split by offense and
+    defense.  Same frames as spacing_analysis.get_spacing_statistics()
+    and velocity_analysis.get_velocity_statistics().
+
+    Args:
+        game (Game): game to analyze
+
+    Returns:
+        pd.DataFrame: table of TABLE_COLUMNS with metrics 'spacing'
+            (convex hull area) and 'velocity' (sum of the five players'
+            speeds, ft/msec)
+    """
+    arrays = analytics.game_arrays(game)
+    stints = get_stints(game)
+    offense = analytics.offensive_teams(arrays, game.flip_direction)
+    areas = analytics.spacing_areas(
+        arrays, np.where(offense != analytics.NO_OFFENSE)[0])
+    velocities = analytics.team_velocities(arrays)
+    # As in velocity_statistics(), the first frame has no velocity
+    velocities[0] = np.nan
+    tables = []
+    for column, team, team_id, own_offense in [
+            (0, 'home', game.home_id, analytics.HOME_OFFENSE),
+            (1, 'away', game.away_id, analytics.AWAY_OFFENSE)]:
+        for side, frames in [('offense', offense == own_offense),
+                             ('defense', (offense != own_offense) &
+                              (offense != analytics.NO_OFFENSE))]:
+            for metric, values in [('spacing', areas[:, column]),
+                                   ('velocity', velocities[:, column])]:
+                tables.append(aggregate(stints,
+                                        np.where(frames, values, np.nan),
+                                        team, team_id, side, metric))
+    return pd.concat(tables, ignore_index=True)
+
+
+def write_lineups(gamelist, prefetch=2, loader=load_game_data):
+    """
+    Writes lineup statistics to data/lineup directory for each game
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+        prefetch (int): number of games to download ahead
+            (see prefetch.prefetch_games())
+        loader (function): loads a game's data, e.g.
+            prefetch.load_local_game_data or synthetic.SyntheticLoader()
+    """
+    if not os.path.exists('./data/lineup'):
+        os.makedirs('./data/lineup')
+    written = os.listdir('./data/lineup')
+    gamelist = [game for game in gamelist
+                if "{game[0]}-{game[2]}-{game[1]}.csv".format(game=game)
+                not in written]
+
+    def analyze(game, game_data):
+        with instrument.span('lineup_statistics'):
+            table = lineup_statistics(game_data)
+        table.to_csv("data/lineup/{game[0]}-{game[2]}-{game[1]}.csv"
+                     .format(game=game), index=False)
+
+    run_season(gamelist, analyze, 'lineup', 'extract lineup data',
+               prefetch=prefetch, loader=loader)
+
+
+def read_lineups(directory='data/lineup'):
+    """
+    Season lineup statistics from the files written by write_lineups()
+
+    Returns:
+        pd.DataFrame: see merge_lineup_tables()
+    """
+    return merge_lineup_tables(
+        pd.read_csv(os.path.join(directory, filename),
+                    dtype={'lineup': str})
+        for filename in sorted(os.listdir(directory))
+        if filename.endswith('.csv'))
@@ -0,0 +1,362 @@
+"""
+Defensive matchups (who guards whom) for every frame.
+
+For every frame with a team on offense, matchup_arrays() builds the 5x5
+cost matrix of each defender against each offensive player in one
+vectorized step.  The cost is the defender's distance from where a
+defender of that player usually stands: mostly between the player and
+the basket, shifted toward the ball (GUARD_WEIGHTS).  Costs are smoothed
+over a short window, the assignment with the lowest total cost is found
+for all frames at once by trying all 120 permutations as arrays, and
+assignments held for less than MIN_FRAMES are dropped, so help defense
+and screens do not flip matchups back and forth.
+
+defensive_table() reduces the matchups to per-player defensive metrics.
+Like lineup tables, tables hold sums and merge by addition:
+    team_id, player_id, frames, on_ball_frames, switches, total_distance,
+    total_distance_sq
+where distances are from the defender to the player they guard (ft).
+"""
+
+import os
+import itertools
+import numpy as np
+import pandas as pd
+import analytics
+from prefetch import run_season, load_game_data
+import instrument
+
+# Weights of the guarded player, the ball and the basket in the position
+# a defender usually takes
+GUARD_WEIGHTS = (0.62, 0.11, 0.27)
+
+LEFT_BASKET = np.array([5.35, 25.])
+RIGHT_BASKET = np.array([88.65, 25.])
+
+# Frames (centered) the costs are averaged over, and fewest frames an
+# assignment must be held
+WINDOW = 25
+MIN_FRAMES = 12
+
+# Offensive player closest to the ball and within this distance (ft) has
+# the ball
+BALL_DISTANCE = 4.
+
+# Every assignment of 5 defenders to 5 offensive players
+PERMUTATIONS = np.array(list(itertools.permutations(range(5))),
+                        dtype=np.int64)
+
+TABLE_COLUMNS = ['team_id', 'player_id', 'frames', 'on_ball_frames',
+                 'switches', 'total_distance', 'total_distance_sq']
+
+
+def _team_columns(offense):
+    """
+    Helper function for the entity columns of the offense and defense.
+
+    Returns: tuple of (offense_columns, defense_columns), int64
+        (frames, 5) columns of game arrays
+    """
+    home = np.arange(1, 6)
+    away = np.arange(6, 11)
+    home_offense = (offense == analytics.HOME_OFFENSE)[:, np.newaxis]
+    return (np.where(home_offense, home, away),
+            np.where(home_offense, away, home))
+
+
+def cost_matrices(xy, offense_columns, defense_columns):
+    """
+    Cost of each defender guarding each offensive player.
+
+    Args:
+        xy (np.ndarray): float (frames, 11, 2) positions of the ball and
+            players
+        offense_columns, defense_columns (np.ndarray): int64 (frames, 5)
+            columns of xy of each team (see _team_columns())
+
+    Returns:
+        np.ndarray: float64 (frames, 5, 5) distance (ft) of defender i
+            from where a defender of offensive player j stands
+    """
+    rows = np.arange(len(xy))[:, np.newaxis]
+    attackers = xy[rows, offense_columns]
+    defenders = xy[rows, defense_columns]
+    ball = xy[:, 0]
+    # The offense attacks the basket of the half they are in
+    left = attackers[:, :, 0].mean(axis=1) < 47
+    basket = np.where(left[:, np.newaxis], LEFT_BASKET, RIGHT_BASKET)
+    player_weight, ball_weight, basket_weight = GUARD_WEIGHTS
+    guard = (player_weight * attackers +
+             (ball_weight * ball + basket_weight * basket)[:, np.newaxis])
+    return np.linalg.norm(defenders[:, :, np.newaxis] -
+                          guard[:, np.newaxis], axis=3)
+
+
+def best_assignments(costs, chunk=8192):
+    """
+    Lowest total cost assignment of every frame.
+
+    Args:
+        costs (np.ndarray): float (frames, 5, 5), see cost_matrices()
+        chunk (int): frames solved at once, bounds memory use
+
+    Returns:
+        np.ndarray: int64 (frames,) row of PERMUTATIONS, where defender i
+            guards offensive player PERMUTATIONS[row, i]
+    """
+    defenders = np.arange(5)
+    assignments = np.zeros(len(costs), dtype=np.int64)
+    for start in range(0, len(costs), chunk):
+        block = costs[start:start + chunk]
+        totals = block[:, defenders, PERMUTATIONS].sum(axis=2)
+        assignments[start:start + chunk] = totals.argmin(axis=1)
+    return assignments
+
+
+def _smooth(values, segment_starts, segment_ends, window):
+    """
+    Helper function to average values over a centered window of frames
+    without crossing segments.
+    """
+    if window <= 1 or len(values) == 0:
+        return values
+    half = window // 2
+    segment = np.repeat(np.arange(len(segment_starts)),
+                        segment_ends - segment_starts)
+    position = np.arange(len(values))
+    low = np.maximum(position - half, segment_starts[segment])
+    high = np.minimum(position + half + 1, segment_ends[segment])
+    totals = np.concatenate((np.zeros((1,) + values.shape[1:]),
+                             np.cumsum(values, axis=0)))
+    shape = (-1,) + (1,) * (values.ndim - 1)
+    return ((totals[high] - totals[low]) /
+            (high - low).reshape(shape).astype(np.float64))
+
+
+def _hold(assignments, segment_starts, segment_ends, min_frames):
+    """
+    Helper function to replace assignments held for fewer than
+    min_frames by the assignment before them in the same segment.
+    """
+    if min_frames <= 1 or len(assignments) == 0:
+        return assignments
+    assignments = assignments.copy()
+    for segment_start, segment_end in zip(segment_starts, segment_ends):
+        values = assignments[segment_start:segment_end]
+        changed = np.flatnonzero(values[1:] != values[:-1]) + 1
+        starts = np.append(0, changed)
+        ends = np.append(changed, len(values))
+        for start, end in zip(starts[1:], ends[1:]):
+            if end - start < min_frames:
+                values[start:end] = values[start - 1]
+    return assignments
+
+
+def matchup_arrays(arrays, flip_direction=False, window=WINDOW,
+                   min_frames=MIN_FRAMES):
+    """
+    Defensive matchups of every frame.
+
+    Args:
+        arrays (dict): game arrays (see analytics.game_arrays())
+        flip_direction (bool): Game.flip_direction
+        window (int): frames the costs are averaged over.  1 to not smooth.
+        min_frames (int): fewest frames a matchup is held.  1 to keep
+            every change.
+
+    Returns: dict of arrays, one row per frame.  Frames without a team on
+        offense have ids 0, distance NaN and segment -1.
+        offense (np.ndarray): int8 (frames,) see
+            analytics.offensive_teams()
+        defender_ids (np.ndarray): int64 (frames, 5) defending players,
+            in the order of the positions
+        guarded_ids (np.ndarray): int64 (frames, 5) offensive player each
+            defender guards
+        distance (np.ndarray): float64 (frames, 5) distance (ft) of each
+            defender from the player they guard
+        on_ball (np.ndarray): bool (frames, 5) True if the player a
+            defender guards has the ball
+        segment (np.ndarray): int64 (frames,) id of each run of frames
+            with the same offense and players; matchups are smoothed
+            within segments
+    """
+    offense = analytics.offensive_teams(arrays, flip_direction)
+    n_frames = len(offense)
+    matchups = {'offense': offense,
+                'defender_ids': np.zeros((n_frames, 5), dtype=np.int64),
+                'guarded_ids': np.zeros((n_frames, 5), dtype=np.int64),
+                'distance': np.full((n_frames, 5), np.nan),
+                'on_ball': np.zeros((n_frames, 5), dtype=bool),
+                'segment': np.full(n_frames, -1, dtype=np.int64)}
+    frames = np.flatnonzero(offense != analytics.NO_OFFENSE)
+    if len(frames) == 0:
+        return matchups
+    xy = arrays['xyz'][frames, :11, :2]
+    player_ids = arrays['player_ids'][frames, :11]
+    offense_columns, defense_columns = _team_columns(offense[frames])
+
+    # Segments break at skipped frames, changes of offense and
+    # substitutions
+    boundary = np.ones(len(frames), dtype=bool)
+    boundary[1:] = ((np.diff(frames) != 1) |
+                    (offense[frames][1:] != offense[frames][:-1]) |
+                    (player_ids[1:] != player_ids[:-1]).any(axis=1))
+    segment_starts = np.flatnonzero(boundary)
+    segment_ends = np.append(segment_starts[1:], len(frames))
+
+    costs = _smooth(cost_matrices(xy, offense_columns, defense_columns),
+                    segment_starts, segment_ends, window)
+    assignments = _hold(best_assignments(costs), segment_starts,
+                        segment_ends, min_frames)
+
+    rows = np.arange(len(frames))[:, np.newaxis]
+    guarded_columns = offense_columns[rows, PERMUTATIONS[assignments]]
+    defenders = xy[rows, defense_columns]
+    guarded = xy[rows, guarded_columns]
+    ball_distance = np.linalg.norm(xy[rows, offense_columns] -
+                                   xy[:, np.newaxis, 0], axis=2)
+    handler = offense_columns[np.arange(len(frames)),
+                              ball_distance.argmin(axis=1)]
+    has_ball = ball_distance.min(axis=1) <= BALL_DISTANCE
+    matchups['defender_ids'][frames] = player_ids[rows, defense_columns]
+    matchups['guarded_ids'][frames] = player_ids[rows, guarded_columns]
+    matchups['distance'][frames] = np.linalg.norm(defenders - guarded,
+                                                  axis=2)
+    matchups['on_ball'][frames] = (has_ball[:, np.newaxis] &
+                                   (guarded_columns ==
+                                    handler[:, np.newaxis]))
+    matchups['segment'][frames] = np.cumsum(boundary) - 1
+    return matchups
+
+
+def get_matchups(game):
+    """
+    Matchups of a game (see matchup_arrays()), cached on the game.
+
+    Args:
+        game (Game): game to get matchups for
+
+    Returns: dict of arrays
+    """
+    if getattr(game, '_matchups', None) is None:
+        game._matchups = matchup_arrays(analytics.game_arrays(game),
+                                        game.flip_direction)
+    return game._matchups
+
+
+def defensive_table(game, matchups=None):
+    """
+    Defensive metrics of every player in a game.
+
+    Args:
+        game (Game): game to analyze
+        matchups (dict): see matchup_arrays().  If None, get_matchups().
+
+    Returns:
+        pd.DataFrame: table of TABLE_COLUMNS, one row per player who
+            defended.  switches counts changes of the player guarded
+            within a segment.
+    """
+    if matchups is None:
+        matchups = get_matchups(game)
+    frames = np.flatnonzero(matchups['segment'] >= 0)
+    defender_ids = matchups['defender_ids'][frames].ravel()
+    guarded_ids = matchups['guarded_ids'][frames]
+    distance = matchups['distance'][frames].ravel()
+    # A defender switches when they guard someone else in the next frame
+    # of the same segment
+    switched = np.zeros(guarded_ids.shape, dtype=bool)
+    segment = matchups['segment'][frames]
+    same = ((segment[1:] == segment[:-1]) &
+            (np.diff(frames) == 1))[:, np.newaxis]
+    switched[1:] = same & (guarded_ids[1:] != guarded_ids[:-1])
+    players, index = np.unique(defender_ids, return_inverse=True)
+    index = index.ravel()
+    offense = matchups['offense'][frames]
+    team_ids = np.repeat(np.where(offense == analytics.HOME_OFFENSE,
+                                  game.away_id, game.home_id), 5)
+    team_of_player = np.zeros(len(players), dtype=np.int64)
+    team_of_player[index] = team_ids
+
+    def total(weights=None):
+        return np.bincount(index, weights=weights, minlength=len(players))
+
+    return pd.DataFrame({'team_id': team_of_player, 'player_id': players,
+                         'frames': total(),
+                         'on_ball_frames': total(
+                             matchups['on_ball'][frames].ravel()
+                             .astype(np.float64)).astype(np.int64),
+                         'switches': total(
+                             switched.ravel().astype(np.float64))
+                         .astype(np.int64),
+                         'total_distance': total(distance),
+                         'total_distance_sq': total(distance ** 2)},
+                        columns=TABLE_COLUMNS)
+
+
+def merge_defensive_tables(tables):
+    """
+    Adds defensive tables, e.g. of every game in a season, and computes
+    per-player metrics.
+
+    Args:
+        tables (iterable): DataFrames of TABLE_COLUMNS
+
+    Returns:
+        pd.DataFrame: TABLE_COLUMNS plus mean_distance, std_distance,
+            on_ball_fraction and switches_per_minute (25 frames per
+            second), one row per (team_id, player_id)
+    """
+    merged = (pd.concat(list(tables), ignore_index=True)
+              .groupby(['team_id', 'player_id'], as_index=False)
+              [TABLE_COLUMNS[2:]].sum())
+    merged['mean_distance'] = merged.total_distance / merged.frames
+    merged['std_distance'] = np.sqrt(np.maximum(
+        merged.total_distance_sq / merged.frames -
+        merged.mean_distance ** 2, 0))
+    merged['on_ball_fraction'] = merged.on_ball_frames / merged.frames
+    merged['switches_per_minute'] = merged.switches / (merged.frames /
+                                                       (25. * 60))
+    return merged
+
+
+def write_matchups(gamelist, prefetch=2, loader=load_game_data):
+    """
+    Writes defensive tables to data/matchup directory for each game
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+        prefetch (int): number of games to download ahead
+            (see prefetch.prefetch_games())
+        loader (function): loads a game's data, e.g.
+            prefetch.load_local_game_data or synthetic.SyntheticLoader()
+    """
+    if not os.path.exists('./data/matchup'):
+        os.makedirs('./data/matchup')
+    written = os.listdir('./data/matchup')
+    gamelist = [game for game in gamelist
+                if "{game[0]}-{game[2]}-{game[1]}.csv".format(game=game)
+                not in written]
+
+    def analyze(game, game_data):
+        with instrument.span('defensive_table'):
+            table = defensive_table(game_data)
+        table.to_csv("data/matchup/{game[0]}-{game[2]}-{game[1]}.csv"
+                     .format(game=game), index=False)
+
+    run_season(gamelist, analyze, 'matchup', 'extract matchup data',
+               prefetch=prefetch, loader=loader)
+
+
+def read_matchups(directory='data/matchup'):
+    """
+    Season defensive metrics from the files written by write_matchups()
+
+    Returns:
+        pd.DataFrame: see merge_defensive_tables()
+    """
+    return merge_defensive_tables(
+        pd.read_csv(os.path.join(directory, filename))
+        for filename in sorted(os.listdir(directory))
+        if filename.endswith('.csv'))
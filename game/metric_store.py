@@ -0,0 +1,250 @@
+"""
+SQLite store of per-frame metrics for interactive queries.
+
+write_metrics() writes the spacing and velocity of each team for every
+frame with a team on offense, with game and team metadata, into one
+SQLite file.  Rows are indexed by team, side of ball, quarter and shot
+clock, and the indexes include the metrics, so questions about a whole
+season are a single query that reads only an index instead of a loop
+over pickles:
+
+    connection = connect('data/metrics.db')
+    # Defensive spacing of SAS with under 5 seconds on the shot clock
+    # in 4th quarters
+    query_metrics(connection, 'spacing', team='SAS', side='defense',
+                  quarter=4, shot_clock_below=5)
+
+Tables:
+    games(game_id, date, home_team, away_team, home_id, away_id,
+          home_score, away_score)
+    teams(team_id, abbreviation)
+    frame_metrics(game_id, frame, quarter, game_time, shot_clock,
+                  shot_clock_bucket, team_id, opponent_id, side, spacing,
+                  velocity)
+where shot_clock_bucket is the whole seconds on the shot clock (NULL when
+it is off) and side is 'offense' or 'defense'.
+"""
+
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import analytics
+from prefetch import run_season, load_game_data
+import instrument
+
+METRICS = ['spacing', 'velocity']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT PRIMARY KEY, date TEXT, home_team TEXT, away_team TEXT,
+    home_id INTEGER, away_id INTEGER, home_score INTEGER,
+    away_score INTEGER);
+CREATE TABLE IF NOT EXISTS teams (
+    team_id INTEGER PRIMARY KEY, abbreviation TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS frame_metrics (
+    game_id TEXT, frame INTEGER, quarter INTEGER, game_time REAL,
+    shot_clock REAL, shot_clock_bucket INTEGER, team_id INTEGER,
+    opponent_id INTEGER, side TEXT, spacing REAL, velocity REAL);
+DROP INDEX IF EXISTS frame_metrics_team;
+DROP INDEX IF EXISTS frame_metrics_quarter;
+CREATE INDEX IF NOT EXISTS frame_metrics_team_metrics ON frame_metrics
+    (team_id, side, quarter, shot_clock_bucket, spacing, velocity);
+CREATE INDEX IF NOT EXISTS frame_metrics_game ON frame_metrics
+    (game_id, frame);
+CREATE INDEX IF NOT EXISTS frame_metrics_quarter_metrics ON frame_metrics
+    (quarter, shot_clock_bucket, spacing, velocity);
+"""
+
+_COLUMNS = ['game_id', 'frame', 'quarter', 'game_time', 'shot_clock',
+            'shot_clock_bucket', 'team_id', 'opponent_id', 'side',
+            'spacing', 'velocity']
+
+
+def connect(filename='data/metrics.db'):
+    """
+    Opens a metric store, creating its tables and indexes if needed.
+
+    Args:
+        filename (str): SQLite file
+
+    Returns:
+        sqlite3.Connection
+    """
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    connection = sqlite3.connect(filename)
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def frame_metrics(game):
+    """
+    Per-frame metrics of a game as rows of the frame_metrics table.
+    Same frames and values as lineups.lineup_statistics().
+
+    Args:
+        game (Game): game to export
+
+    Returns:
+        pd.DataFrame: columns of frame_metrics, two rows (one per team)
+            for each frame with a team on offense.  Missing values are
+            NaN, which SQLite stores as NULL.
+    """
+    arrays = analytics.game_arrays(game)
+    offense = analytics.offensive_teams(arrays, game.flip_direction)
+    frames = np.where(offense != analytics.NO_OFFENSE)[0]
+    areas = analytics.spacing_areas(arrays, frames)
+    velocities = analytics.team_velocities(arrays)
+    # As in velocity_statistics(), the first frame has no velocity
+    velocities[0] = np.nan
+    shot_clock = np.asarray(arrays['shot_clock'], dtype=np.float64)[frames]
+    home_offense = offense[frames] == analytics.HOME_OFFENSE
+    tables = []
+    for column, team_id, opponent_id, sides in [
+            (0, game.home_id, game.away_id, home_offense),
+            (1, game.away_id, game.home_id, ~home_offense)]:
+        tables.append(pd.DataFrame({
+            'game_id': game.game_id, 'frame': frames,
+            'quarter': arrays['quarter'][frames],
+            'game_time': arrays['game_time'][frames],
+            'shot_clock': shot_clock,
+            'shot_clock_bucket': np.floor(shot_clock),
+            'team_id': team_id, 'opponent_id': opponent_id,
+            'side': np.where(sides, 'offense', 'defense'),
+            'spacing': areas[frames, column],
+            'velocity': velocities[frames, column]}, columns=_COLUMNS))
+    return pd.concat(tables, ignore_index=True)
+
+
+def write_game_metrics(connection, game):
+    """
+    Writes a game and its per-frame metrics, replacing earlier rows of
+    the same game.
+
+    Args:
+        connection (sqlite3.Connection): see connect()
+        game (Game): game to export
+    """
+    score = str(game.pbp['SCORE'].iloc[-1]).split('-')
+    table = frame_metrics(game)
+    with connection:
+        connection.execute('DELETE FROM frame_metrics WHERE game_id = ?',
+                           (game.game_id,))
+        connection.execute(
+            'INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (game.game_id, game.date, game.home_team, game.away_team,
+             int(game.home_id), int(game.away_id), int(score[1]),
+             int(score[0])))
+        connection.executemany('INSERT OR REPLACE INTO teams VALUES (?, ?)',
+                               [(int(game.home_id), game.home_team),
+                                (int(game.away_id), game.away_team)])
+        # Python values, since sqlite3 cannot bind numpy scalars
+        connection.executemany(
+            'INSERT INTO frame_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, '
+            '?, ?)', zip(*[table[column].tolist() for column in _COLUMNS]))
+
+
+def write_metrics(gamelist, filename='data/metrics.db', prefetch=2,
+                  loader=load_game_data):
+    """
+    Writes per-frame metrics of each game to a metric store.  Games
+    already in the store are skipped, and games that cannot be loaded
+    are logged to errorlog.txt.
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+        filename (str): SQLite file (see connect())
+        prefetch (int): number of games to download ahead
+            (see prefetch.prefetch_games())
+        loader (function): loads a game's data, e.g.
+            prefetch.load_local_game_data or synthetic.SyntheticLoader()
+    """
+    connection = connect(filename)
+    written = set(row[0] for row in connection.execute(
+        'SELECT date || home_team || away_team FROM games'))
+    gamelist = [game for game in gamelist if ''.join(game) not in written]
+
+    def analyze(game, game_data):
+        with instrument.span('write_game_metrics'):
+            write_game_metrics(connection, game_data)
+
+    try:
+        run_season(gamelist, analyze, 'metric_store', 'write metrics',
+                   prefetch=prefetch, loader=loader)
+    finally:
+        connection.close()
+
+
+def query_metrics(connection, metric='spacing', team=None, side=None,
+                  quarter=None, shot_clock_below=None,
+                  shot_clock_at_least=None, game_id=None, group_by=None):
+    """
+    Mean and count of a metric over the frames matching every filter.
+
+    Args:
+        connection (sqlite3.Connection): see connect()
+        metric (str) {'spacing', 'velocity'}: metric to summarize
+        team (str or int): team abbreviation, e.g. 'SAS', or team_id
+        side (str) {'offense', 'defense'}: side of ball of team
+        quarter (int or list): quarter(s), 5 and up are overtimes
+        shot_clock_below (float): only frames with less on the shot clock
+            (whole seconds, e.g. 5 for under 5 seconds)
+        shot_clock_at_least (float): only frames with at least this on
+            the shot clock (whole seconds)
+        game_id (str): only frames of this game
+        group_by (str or list): columns of frame_metrics to group by,
+            e.g. 'team_id' or ['quarter', 'side'].  If None, one row.
+
+    Returns:
+        pd.DataFrame: group_by columns plus frames, mean and std
+    """
+    if metric not in METRICS:
+        raise ValueError('Unknown metric {0}, use one of {1}'
+                         .format(metric, METRICS))
+    conditions, parameters = ['{0} IS NOT NULL'.format(metric)], []
+    if team is not None:
+        if isinstance(team, str):
+            conditions.append('team_id = (SELECT team_id FROM teams '
+                              'WHERE abbreviation = ?)')
+        else:
+            conditions.append('team_id = ?')
+            team = int(team)
+        parameters.append(team)
+    if side is not None:
+        conditions.append('side = ?')
+        parameters.append(side)
+    if quarter is not None:
+        quarters = [int(value) for value in np.atleast_1d(quarter)]
+        conditions.append('quarter IN ({0})'.format(
+            ', '.join('?' * len(quarters))))
+        parameters.extend(quarters)
+    # Buckets are whole seconds, so whole-second limits use the index
+    if shot_clock_below is not None:
+        conditions.append('shot_clock_bucket < ?')
+        parameters.append(int(np.ceil(shot_clock_below)))
+    if shot_clock_at_least is not None:
+        conditions.append('shot_clock_bucket >= ?')
+        parameters.append(int(np.floor(shot_clock_at_least)))
+    if game_id is not None:
+        conditions.append('game_id = ?')
+        parameters.append(game_id)
+    groups = [] if group_by is None else list(np.atleast_1d(group_by))
+    for column in groups:
+        if column not in _COLUMNS:
+            raise ValueError('Cannot group by {0}'.format(column))
+    select = groups + ['COUNT(*) AS frames',
+                       'AVG({0}) AS mean'.format(metric),
+                       'AVG({0} * {0}) AS mean_sq'.format(metric)]
+    sql = 'SELECT {0} FROM frame_metrics WHERE {1}'.format(
+        ', '.join(select), ' AND '.join(conditions))
+    if groups:
+        sql += ' GROUP BY {0}'.format(', '.join(groups))
+    result = pd.read_sql_query(sql, connection, params=parameters)
+    # AVG of no rows is NULL
+    result[['mean', 'mean_sq']] = result[['mean', 'mean_sq']].astype(float)
+    result['std'] = np.sqrt(np.maximum(
+        result.mean_sq - result['mean'] ** 2, 0))
+    return result.drop('mean_sq', axis=1)
@@ -0,0 +1,362 @@
+"""
+Similarity search over the possessions of many games.
+
+Each half-court possession (a run of frames with one team on offense, see
+analytics.offensive_teams()) becomes a fixed-length descriptor: the ball
+and the ten players sampled at SAMPLES evenly spaced times, with the
+court rotated so the offense always attacks the left basket and each
+team's players in order of their average position across the court.
+Descriptors are projected onto their main directions (PCA) and stored in
+a scipy cKDTree, so finding the closest plays of a season takes a few
+milliseconds:
+
+    index = build_play_index(gamelist, filename='data/plays.p')
+    index = PlayIndex.load('data/plays.p')
+    plays = index.similar(game, starting_frame, ending_frame, k=10)
+
+Candidates found in the tree are re-ranked by their distance in the full
+descriptor space.  Each result row holds the game and the frame range of
+the play, ready for Game.animate_play((start_frame, end_frame), None)
+once that game is loaded.
+"""
+
+import pickle
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+import analytics
+import quality
+from prefetch import run_season, load_game_data
+import instrument
+
+# Times each possession is sampled at
+SAMPLES = 16
+
+# Shortest possession indexed (seconds), and longest break in the offense
+# (frames) that does not end a possession, e.g. a player stepping over
+# half court
+MIN_SECONDS = 3
+MAX_BREAK = 25
+
+COURT_LENGTH = 94.
+COURT_WIDTH = 50.
+
+RESULT_COLUMNS = ['date', 'home_team', 'away_team', 'game_id', 'quarter',
+                  'game_time', 'start_frame', 'end_frame', 'offense_team',
+                  'distance']
+
+
+def _runs(values):
+    """
+    Helper function for the runs of equal values.
+
+    Returns: tuple of (starts, ends, run_values), ends exclusive
+    """
+    changed = np.ones(len(values), dtype=bool)
+    changed[1:] = values[1:] != values[:-1]
+    starts = np.flatnonzero(changed)
+    ends = np.append(starts[1:], len(values))
+    return starts, ends, values[starts]
+
+
+def possessions(arrays, flip_direction=False, min_seconds=MIN_SECONDS,
+                max_break=MAX_BREAK):
+    """
+    Splits a game into half-court possessions.
+
+    Args:
+        arrays (dict): game arrays (see analytics.game_arrays())
+        flip_direction (bool): Game.flip_direction
+        min_seconds (float): shortest possession kept
+        max_break (int): longest run of frames without an offense
+            between frames of the same offense that does not end a
+            possession
+
+    Returns:
+        np.ndarray: int64 (possessions, 3) of (start_frame, end_frame,
+            offense) with end_frame exclusive and offense HOME_OFFENSE or
+            AWAY_OFFENSE
+    """
+    offense = analytics.offensive_teams(arrays, flip_direction)
+    if len(offense) == 0:
+        return np.zeros((0, 3), dtype=np.int64)
+    quarter = np.asarray(arrays['quarter'], dtype=np.int64)
+    # A possession never spans quarters
+    key = quarter * 4 + offense
+    starts, ends, values = _runs(key)
+    codes = values % 4
+    short_break = ((codes == analytics.NO_OFFENSE) &
+                   (ends - starts <= max_break))
+    short_break[[0, -1]] = False
+    bridged = short_break.copy()
+    bridged[1:-1] &= values[:-2] == values[2:]
+    for run in np.flatnonzero(bridged):
+        key[starts[run]:ends[run]] = values[run - 1]
+    starts, ends, values = _runs(key)
+    codes = values % 4
+    universe_time = np.asarray(arrays['universe_time'], dtype=np.int64)
+    seconds = (universe_time[ends - 1] - universe_time[starts]) / 1000.
+    keep = (codes != analytics.NO_OFFENSE) & (seconds >= min_seconds)
+    return np.column_stack((starts[keep], ends[keep],
+                            codes[keep])).astype(np.int64)
+
+
+def play_descriptor(arrays, start_frame, end_frame, offense,
+                    samples=SAMPLES):
+    """
+    Fixed-length descriptor of the trajectories of a play.
+
+    Args:
+        arrays (dict): game arrays (see analytics.game_arrays())
+        start_frame (int): first frame of play
+        end_frame (int): frame after play
+        offense (int) {HOME_OFFENSE, AWAY_OFFENSE}: team on offense
+        samples (int): times the play is sampled at
+
+    Returns:
+        np.ndarray: float32 (samples * 22,) x and y of the ball, the
+            offense and the defense at each sample, scaled to 0 to 1 by
+            the court size.  None if the play has no frame with all 10
+            players and the ball.
+    """
+    frames = np.arange(start_frame, end_frame)
+    frames = frames[quality.valid_frames(arrays)[frames]]
+    if len(frames) == 0:
+        return None
+    sampled = frames[np.round(np.linspace(0, len(frames) - 1,
+                                          samples)).astype(np.int64)]
+    xy = arrays['xyz'][sampled, :11, :2].copy()
+    if offense == analytics.AWAY_OFFENSE:
+        xy = xy[:, [0, 6, 7, 8, 9, 10, 1, 2, 3, 4, 5]]
+    # Rotate the court so the offense attacks the left basket
+    if np.nanmean(xy[:, 1:6, 0]) > COURT_LENGTH / 2:
+        xy[:, :, 0] = COURT_LENGTH - xy[:, :, 0]
+        xy[:, :, 1] = COURT_WIDTH - xy[:, :, 1]
+    # Order each team's players across the court, so the same action
+    # matches whichever player runs it
+    for team in [slice(1, 6), slice(6, 11)]:
+        players = xy[:, team]
+        xy[:, team] = players[:, np.argsort(players[:, :, 1].mean(axis=0))]
+    xy /= [COURT_LENGTH, COURT_WIDTH]
+    return xy.ravel().astype(np.float32)
+
+
+class PlayIndex(object):
+    """
+    Nearest neighbor index of possession descriptors.
+    """
+
+    def __init__(self, samples=SAMPLES, dimensions=16):
+        """
+        Args:
+            samples (int): times each possession is sampled at
+                (see play_descriptor())
+            dimensions (int): dimensions of the tree after projection
+        """
+        self.samples = samples
+        self.dimensions = dimensions
+        # (date, home_team, away_team, game_id) of each game
+        self.games = []
+        # One row per possession of (game, start_frame, end_frame,
+        # quarter, game_time, offense) with offense as in possessions()
+        self.plays = np.zeros((0, 6))
+        self.descriptors = np.zeros((0, samples * 22), dtype=np.float32)
+        self._tree = None
+
+    def add_game(self, game, arrays=None):
+        """
+        Adds the possessions of a game.
+
+        Args:
+            game (Game): game to add
+            arrays (dict): game arrays of game, if already computed
+
+        Returns: an instance of self
+        """
+        if arrays is None:
+            arrays = analytics.game_arrays(game)
+        number = len(self.games)
+        self.games.append((game.date, game.home_team, game.away_team,
+                           game.game_id))
+        plays, descriptors = [], []
+        for start, end, offense in possessions(arrays, game.flip_direction):
+            descriptor = play_descriptor(arrays, start, end, offense,
+                                         self.samples)
+            if descriptor is None:
+                continue
+            plays.append((number, start, end, arrays['quarter'][start],
+                          arrays['game_time'][start], offense))
+            descriptors.append(descriptor)
+        if plays:
+            self.plays = np.vstack((self.plays, plays))
+            self.descriptors = np.vstack((self.descriptors, descriptors))
+            self._tree = None
+        return self
+
+    def merge(self, other):
+        """
+        Adds the games of another index, e.g. built by another process.
+
+        Returns: an instance of self
+        """
+        if other.samples != self.samples:
+            raise ValueError('Cannot merge indexes of {0} and {1} samples'
+                             .format(self.samples, other.samples))
+        plays = other.plays.copy()
+        plays[:, 0] += len(self.games)
+        self.games.extend(other.games)
+        self.plays = np.vstack((self.plays, plays))
+        self.descriptors = np.vstack((self.descriptors, other.descriptors))
+        self._tree = None
+        return self
+
+    def _build_tree(self):
+        """
+        Helper function to project the descriptors and build the tree.
+        """
+        descriptors = self.descriptors.astype(np.float64)
+        self._mean = descriptors.mean(axis=0)
+        centered = descriptors - self._mean
+        # Eigenvectors of the small covariance matrix, largest first
+        _, vectors = np.linalg.eigh(np.dot(centered.T, centered))
+        self._components = vectors[:, ::-1][:, :self.dimensions]
+        self._tree = cKDTree(np.dot(centered, self._components))
+
+    def query(self, descriptor, k=10, oversample=20, exclude=None):
+        """
+        Plays closest to a descriptor.
+
+        Args:
+            descriptor (np.ndarray): see play_descriptor()
+            k (int): number of plays
+            oversample (int): candidates taken from the tree per play
+                returned, re-ranked by their full descriptor distance
+            exclude (list): rows of self.plays to leave out
+
+        Returns:
+            pd.DataFrame: RESULT_COLUMNS, closest play first
+        """
+        if len(self.descriptors) == 0:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        if self._tree is None:
+            self._build_tree()
+        descriptor = np.asarray(descriptor, dtype=np.float64)
+        exclude = set() if exclude is None else set(exclude)
+        n_candidates = min(len(self.descriptors),
+                           (k + len(exclude)) * oversample)
+        _, candidates = self._tree.query(
+            np.dot(descriptor - self._mean, self._components),
+            k=n_candidates)
+        candidates = np.atleast_1d(candidates)
+        candidates = candidates[[candidate not in exclude
+                                 for candidate in candidates]]
+        distances = np.linalg.norm(self.descriptors[candidates] - descriptor,
+                                   axis=1)
+        order = np.argsort(distances, kind='stable')[:k]
+        rows = []
+        for candidate, distance in zip(candidates[order], distances[order]):
+            game, start, end, quarter, game_time, offense = \
+                self.plays[candidate]
+            date, home_team, away_team, game_id = self.games[int(game)]
+            team = (home_team if offense == analytics.HOME_OFFENSE
+                    else away_team)
+            rows.append((date, home_team, away_team, game_id, int(quarter),
+                         game_time, int(start), int(end), team, distance))
+        return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+    def similar(self, game, start_frame, end_frame, k=10, **options):
+        """
+        Plays that look like a play of a loaded game.  The play itself
+        is left out if the game is indexed.
+
+        Args:
+            game (Game): game of play
+            start_frame (int): first frame of play
+            end_frame (int): frame after play
+            k (int): number of plays
+            options: passed to query()
+
+        Returns:
+            pd.DataFrame: RESULT_COLUMNS, closest play first
+
+        Raises:
+            ValueError: if no team is on offense or no frame of the play
+                has all 10 players and the ball
+        """
+        arrays = analytics.game_arrays(game)
+        play = dict((key, arrays[key][start_frame:end_frame])
+                    for key in ['xyz', 'n_entities', 'quarter', 'quality'])
+        offense = analytics.offensive_teams(play, game.flip_direction)
+        offense = offense[offense != analytics.NO_OFFENSE]
+        descriptor = None
+        if len(offense):
+            descriptor = play_descriptor(arrays, start_frame, end_frame,
+                                         np.bincount(offense).argmax(),
+                                         self.samples)
+        if descriptor is None:
+            raise ValueError('No team on offense in frames {0} to {1}'
+                             .format(start_frame, end_frame))
+        exclude = []
+        for number, indexed in enumerate(self.games):
+            if indexed[3] == game.game_id:
+                plays = self.plays
+                exclude = np.flatnonzero((plays[:, 0] == number) &
+                                         (plays[:, 1] < end_frame) &
+                                         (plays[:, 2] > start_frame))
+        options.setdefault('exclude', exclude)
+        return self.query(descriptor, k=k, **options)
+
+    def save(self, filename):
+        """
+        Writes the index, including its tree, to a pickle file
+        """
+        if self._tree is None and len(self.descriptors):
+            self._build_tree()
+        with open(filename, 'wb') as index_file:
+            pickle.dump(self.__dict__, index_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads an index written by save()
+
+        Returns: PlayIndex
+        """
+        with open(filename, 'rb') as index_file:
+            state = pickle.load(index_file)
+        index = cls()
+        index.__dict__.update(state)
+        return index
+
+
+def build_play_index(gamelist, filename=None, samples=SAMPLES,
+                     prefetch=2, loader=load_game_data):
+    """
+    Indexes the possessions of every game.  Games that cannot be loaded
+    are logged to errorlog.txt.
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+        filename (str): If not None, the index is saved to this file
+            (see PlayIndex.save())
+        samples (int): times each possession is sampled at
+        prefetch (int): number of games to download ahead
+            (see prefetch.prefetch_games())
+        loader (function): loads a game's data, e.g.
+            prefetch.load_local_game_data or synthetic.SyntheticLoader()
+
+    Returns: PlayIndex
+    """
+    index = PlayIndex(samples=samples)
+
+    def analyze(game, game_data):
+        with instrument.span('add_game'):
+            index.add_game(game_data)
+
+    run_season(gamelist, analyze, 'play_index', 'index plays',
+               prefetch=prefetch, loader=loader)
+    if filename is not None:
+        index.save(filename)
+    return index
@@ -0,0 +1,242 @@
+"""
+Prefetching pipeline for season-wide analysis.
+
+Downloading (curl), extracting (7za) and parsing (json.load) a game is
+mostly waiting on the network and disk.  prefetch_games() does this work
+for the next few games in background threads while the current game is
+being analyzed.  Games stored locally (e.g. synthetic games, see
+synthetic.py) are read with load_local_game_data() instead.
+
+load_game_data() keeps each game's play-by-play response in
+PLAYBYPLAY_DIRECTORY, so season analyses that only need play-by-play
+(e.g. action_index.build_action_index()) read it with
+load_playbyplay_data() instead of downloading tracking archives again.
+
+run_season() is the season loop of the write_* and build_* functions:
+it prefetches each game, builds it and passes it to an analysis, logging
+the games that fail.
+"""
+
+import os
+import json
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import instrument
+from game import Game, fetch_tracking_data, fetch_playbyplay_data
+
+# Play-by-play responses kept by load_game_data()
+PLAYBYPLAY_DIRECTORY = 'data/playbyplay'
+
+
+def load_game_data(date, home_team, away_team, directory='temp/prefetch',
+                   playbyplay_directory=PLAYBYPLAY_DIRECTORY):
+    """
+    Downloads, extracts and parses all data needed to build a Game.
+
+    Args:
+        date (str): date of game in form 'MM.DD.YYYY'.  Example: '01.01.2016'
+        home_team (str): home team in form 'XXX'. Example: 'TOR'
+        away_team (str): away team in form 'XXX'. Example: 'CHI'
+        directory (str): parent directory for scratch files.  Each game
+            is fetched into its own subdirectory, which is removed
+            once the data is loaded.
+        playbyplay_directory (str): directory the play-by-play response
+            is kept in, read by load_playbyplay_data().  If None, it is
+            not kept.
+
+    Returns: tuple of data (tracking_data, playbyplay_data)
+        Pass these to Game(date, home_team, away_team, tracking_data,
+        playbyplay_data) to skip downloading.
+    """
+    tracking_id = '{date}.{away_team}.at.{home_team}'.format(
+        date=date, away_team=away_team, home_team=home_team)
+    game_directory = os.path.join(directory, tracking_id)
+    try:
+        game_id, tracking_data = fetch_tracking_data(tracking_id,
+                                                     game_directory)
+        playbyplay_data = fetch_playbyplay_data(game_id, game_directory)
+    finally:
+        shutil.rmtree(game_directory, ignore_errors=True)
+    if playbyplay_directory is not None:
+        _keep_playbyplay_data(os.path.join(playbyplay_directory,
+                                           tracking_id + '.pbp.json'),
+                              game_id, playbyplay_data)
+    return (tracking_data, playbyplay_data)
+
+
+def _keep_playbyplay_data(path, game_id, playbyplay_data):
+    """
+    Helper function to write a play-by-play result set in the layout of
+    a play-by-play response, as read by load_local_playbyplay_data()
+    """
+    # Games are loaded in several threads at once
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    response = {'resource': 'playbyplay', 'parameters': {'GameID': game_id},
+                'resultSets': [playbyplay_data]}
+    # Write then rename, so an interrupted write leaves no partial file
+    with open(path + '.tmp', 'w') as data_file:
+        json.dump(response, data_file)
+    os.replace(path + '.tmp', path)
+
+
+def load_local_game_data(date, home_team, away_team,
+                         directory='data/synthetic'):
+    """
+    Reads all data needed to build a Game from local files:
+        {directory}/MM.DD.YYYY.AWAY.at.HOME.json      tracking data
+        {directory}/MM.DD.YYYY.AWAY.at.HOME.pbp.json  play-by-play response
+    Use functools.partial to set directory for prefetch_games().
+
+    Args:
+        date (str): date of game in form 'MM.DD.YYYY'.  Example: '01.01.2016'
+        home_team (str): home team in form 'XXX'. Example: 'TOR'
+        away_team (str): away team in form 'XXX'. Example: 'CHI'
+        directory (str): directory of game files
+
+    Returns: tuple of data (tracking_data, playbyplay_data)
+        Same as load_game_data()
+    """
+    tracking_id = '{date}.{away_team}.at.{home_team}'.format(
+        date=date, away_team=away_team, home_team=home_team)
+    path = os.path.join(directory, tracking_id)
+    with open(path + '.json') as data_file, instrument.span('json.load'):
+        tracking_data = json.load(data_file)
+    return (tracking_data, load_local_playbyplay_data(date, home_team,
+                                                      away_team, directory))
+
+
+def load_local_playbyplay_data(date, home_team, away_team,
+                               directory='data/synthetic'):
+    """
+    Reads only the play-by-play data of a game stored locally
+    (see load_local_game_data()), without its tracking data.
+
+    Returns:
+        dict: play-by-play result set with 'headers' and 'rowSet'
+    """
+    path = os.path.join(directory, '{date}.{away_team}.at.{home_team}'
+                        .format(date=date, away_team=away_team,
+                                home_team=home_team))
+    with open(path + '.pbp.json') as data_file, instrument.span('json.load'):
+        return json.load(data_file)['resultSets'][0]
+
+
+def load_playbyplay_data(date, home_team, away_team,
+                         directory=PLAYBYPLAY_DIRECTORY):
+    """
+    Reads only the play-by-play data of a game kept by load_game_data(),
+    without its tracking data.
+
+    Args:
+        date (str): date of game in form 'MM.DD.YYYY'.  Example: '01.01.2016'
+        home_team (str): home team in form 'XXX'. Example: 'TOR'
+        away_team (str): away team in form 'XXX'. Example: 'CHI'
+        directory (str): directory the play-by-play was kept in
+
+    Returns:
+        dict: play-by-play result set with 'headers' and 'rowSet'
+
+    Raises:
+        IOError: if the game's play-by-play was never kept
+    """
+    return load_local_playbyplay_data(date, home_team, away_team, directory)
+
+
+def _load(loader, date, home_team, away_team):
+    """
+    Helper function to load a game in a 'load' span
+    """
+    with instrument.span('load'):
+        return loader(date, home_team, away_team)
+
+
+def prefetch_games(gamelist, depth=2, workers=2, loader=load_game_data):
+    """
+    Generator that loads games ahead of the consumer.
+
+    At most depth games are loaded (or loading) beyond the one currently
+    yielded.  A new download only starts once the consumer asks for the
+    next game, so memory stays bounded at depth + 1 raw games
+    (roughly 100-200MB each) no matter how slow the analysis is.
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+            example element: ['01.01.2016', 'TOR', 'CHI']
+        depth (int): number of games to load ahead.  Must be at least 1.
+        workers (int): number of games downloaded at the same time
+        loader (function): called as loader(date, home_team, away_team),
+            returns (tracking_data, playbyplay_data)
+
+    Yields: tuple of (game, future)
+        game (list): element of gamelist
+        future (concurrent.futures.Future): future.result() returns
+            (tracking_data, playbyplay_data), or raises the error
+            encountered while loading the game.
+    """
+    depth = max(depth, 1)
+    games = iter(gamelist)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit_next():
+        for game in games:
+            pending.append((game, executor.submit(_load, loader, game[0],
+                                                  game[1], game[2])))
+            return
+
+    try:
+        for _ in range(depth):
+            submit_next()
+        while pending:
+            game, future = pending.popleft()
+            submit_next()
+            yield (game, future)
+            # Release the consumed game's data before loading further
+            del future
+    finally:
+        for game, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def run_season(gamelist, analyze, name, description, prefetch=2,
+               loader=load_game_data, build_game=True,
+               errorlog='errorlog.txt'):
+    """
+    Runs an analysis on each game, loading games ahead of the analysis
+    (see prefetch_games()).  Games that cannot be loaded or analyzed are
+    counted as '{name}.games_failed' (see instrument.count()) and logged
+    to errorlog, and the season goes on with the next game.
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+        analyze (function): called as analyze(game, data) for each
+            element game of gamelist.  data is a slim Game, or the tuple
+            (tracking_data, playbyplay_data) if not build_game.
+        name (str): name of the analysis, e.g. 'lineup'
+        description (str): logged as '{game} Could not {description}'
+        prefetch (int): number of games to download ahead
+        loader (function): loads a game's data, e.g.
+            load_local_game_data or synthetic.SyntheticLoader()
+        build_game (bool): If True, analyze gets a Game(slim=True)
+        errorlog (str): file failed games are appended to
+    """
+    for game, future in prefetch_games(gamelist, depth=prefetch,
+                                       loader=loader):
+        try:
+            with instrument.game_span(game):
+                with instrument.span('wait_for_load'):
+                    data = future.result()
+                if build_game:
+                    with instrument.span('Game'):
+                        data = Game(game[0], game[1], game[2], data[0],
+                                    data[1], slim=True)
+                analyze(game, data)
+        except Exception:
+            instrument.count(name + '.games_failed')
+            with open(errorlog, 'a') as myfile:
+                myfile.write("{game} Could not {description}\n"
+                             .format(game=game, description=description))
@@ -0,0 +1,163 @@
+"""
+Per-frame data quality checks.
+
+quality_mask() runs every check on all frames of a game at once and
+returns one bitmask per frame, so pipelines filter frames with a single
+array operation instead of checking frames one at a time:
+
+    frames = np.where(valid_frames(game))[0]
+
+The mask is computed once per game, cached on the game like its position
+arrays and included in analytics.game_arrays() as 'quality'.  Every
+analysis (analytics.py and the modules built on it,
+Game.get_offensive_team(), velocity_analysis.calculate_velocities())
+uses the frames passing REQUIRED: the ball and all 10 players.
+
+Frames repeating the universe_time of an earlier frame (overlapping
+events) are dropped when a Game is loaded, so there is no check for them.
+"""
+
+import numpy as np
+
+# Bits of the mask
+MISSING_BALL = 1      # first entity is not the ball, or ball has no position
+ENTITY_COUNT = 2      # not exactly the ball and 10 players
+OUT_OF_BOUNDS = 8     # an entity far outside the court
+CLOCK_ANOMALY = 16    # time or clocks out of range or running backwards
+
+CHECKS = [('missing_ball', MISSING_BALL), ('entity_count', ENTITY_COUNT),
+          ('out_of_bounds', OUT_OF_BOUNDS), ('clock_anomaly', CLOCK_ANOMALY)]
+
+# Frames analyses can use
+REQUIRED = MISSING_BALL | ENTITY_COUNT
+
+# Court size and allowed distance outside it in feet
+COURT_LENGTH = 94
+COURT_WIDTH = 50
+BOUNDS_MARGIN = 10
+
+# Game clock running backwards by more than this (seconds) is an anomaly
+CLOCK_TOLERANCE = 0.5
+
+
+def quality_mask(arrays):
+    """
+    Checks every frame of a game.
+
+    Args:
+        arrays (dict): game arrays (see analytics.game_arrays())
+
+    Returns:
+        np.ndarray: uint8 (frames,) bitwise or of the failed checks,
+            0 for clean frames
+    """
+    n_frames = len(arrays['n_entities'])
+    mask = np.zeros(n_frames, dtype=np.uint8)
+    if n_frames == 0:
+        return mask
+    xyz = arrays['xyz']
+    n_entities = arrays['n_entities']
+    if xyz.shape[1] == 0:
+        # No frame has any entity
+        mask[:] = MISSING_BALL | ENTITY_COUNT
+    else:
+        ball = ((n_entities > 0) & (arrays['team_ids'][:, 0] == -1) &
+                ~np.isnan(xyz[:, 0, :2]).any(axis=1))
+        mask[~ball] |= MISSING_BALL
+        mask[n_entities != 11] |= ENTITY_COUNT
+
+    # NaN padding is not out of bounds
+    with np.errstate(invalid='ignore'):
+        outside = ((xyz[:, :, 0] < -BOUNDS_MARGIN) |
+                   (xyz[:, :, 0] > COURT_LENGTH + BOUNDS_MARGIN) |
+                   (xyz[:, :, 1] < -BOUNDS_MARGIN) |
+                   (xyz[:, :, 1] > COURT_WIDTH + BOUNDS_MARGIN))
+    mask[outside.any(axis=1)] |= OUT_OF_BOUNDS
+
+    quarter = arrays['quarter']
+    universe_time = arrays['universe_time']
+    quarter_time = np.asarray(arrays['quarter_time'], dtype=np.float64)
+    shot_clock = np.asarray(arrays['shot_clock'], dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        # The shot clock is off (NaN) at the end of quarters
+        clock = ((quarter < 1) | (quarter_time < 0) | (quarter_time > 720) |
+                 (shot_clock < 0) | (shot_clock > 24))
+    same_quarter = quarter[1:] == quarter[:-1]
+    clock[1:] |= same_quarter & ((np.diff(universe_time) < 0) |
+                                 (np.diff(quarter_time) > CLOCK_TOLERANCE))
+    mask[clock] |= CLOCK_ANOMALY
+    return mask
+
+
+def get_quality_mask(game):
+    """
+    Quality mask of a game (see quality_mask()), cached on the game.
+
+    Args:
+        game (Game): game to check
+
+    Returns:
+        np.ndarray: uint8 (frames,)
+    """
+    if getattr(game, '_quality_mask', None) is not None:
+        return game._quality_mask
+    # Not imported at the top: analytics builds on this module
+    import analytics
+    return analytics.game_arrays(game)['quality']
+
+
+def valid_frames(data, checks=REQUIRED):
+    """
+    Frames of a game that pass checks.
+
+    Args:
+        data (Game or dict): game, or game arrays (see
+            analytics.game_arrays()).  The mask of arrays without
+            'quality' (e.g. resampled arrays) is computed and stored in
+            data['quality'].
+        checks (int): bitwise or of the checks frames must pass
+
+    Returns:
+        np.ndarray: bool (frames,)
+    """
+    if isinstance(data, dict):
+        if data.get('quality') is None:
+            data['quality'] = quality_mask(data)
+        mask = data['quality']
+    else:
+        mask = get_quality_mask(data)
+    return (mask & checks) == 0
+
+
+def frame_is_valid(game, frame, checks=REQUIRED):
+    """
+    Whether one frame of a game passes checks, without building a mask
+    of every frame on each call (see valid_frames()).
+
+    Args:
+        game (Game): game to check
+        frame (int): number of frame
+        checks (int): bitwise or of the checks the frame must pass
+
+    Returns:
+        bool
+    """
+    return not get_quality_mask(game)[frame] & checks
+
+
+def quality_report(mask):
+    """
+    Summary of a quality mask.
+
+    Args:
+        mask (np.ndarray): see quality_mask()
+
+    Returns:
+        dict: frames, clean (frames passing every check), usable (frames
+            passing REQUIRED) and the number of frames failing each check
+    """
+    report = {'frames': len(mask), 'clean': int((mask == 0).sum()),
+              'usable': int(((mask & REQUIRED) == 0).sum())}
+    for name, bit in CHECKS:
+        report[name] = int(((mask & bit) != 0).sum())
+    return report
@@ -0,0 +1,452 @@
+"""
+Fast frame rendering for Game.animate_play()
+
+Game.plot_frame() builds a new figure, redraws the court and closes the
+figure for every frame.  FrameRenderer sets up the figure, court and text
+once, then for each frame only updates the players, ball, clock text and
+convex hull and blits them over a saved background.  The court itself is
+rasterized once per process (see court_background()).  Everything drawn
+for a range of frames (positions, colors, sizes, clocks, commentary and
+both teams' convex hulls) is prepared up front as arrays by
+prepare_frames(), so drawing a frame is only indexing.  playback_frames()
+picks (and interpolates between) frames for other frame rates and playback
+speeds.  render_frames() spreads the frames over several processes.
+"""
+
+import multiprocessing
+from collections import deque
+import numpy as np
+import seaborn as sns
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.patches import Polygon
+from matplotlib.colors import to_rgba
+from scipy.spatial import ConvexHull
+
+# Figures are 12 x 6 inches at DPI, so frames are 960 x 480 pixels
+FIGSIZE = (12, 6)
+DPI = 80
+
+
+# Longest gap in tracking (msec) played back in real time by
+# playback_frames().  Longer gaps (stoppages, missing data) are skipped.
+MAX_FRAME_GAP = 200
+
+# Rendered backgrounds, see court_background()
+_court_cache = {}
+
+
+def court_background(game, highlight_player=None, style='dark'):
+    """
+    Image of everything in a frame that does not change: the court,
+    team color indicators and the highlighted player's name.
+    Images are cached by size, style and labels, so they are drawn once
+    per process and reused across clips and games.
+
+    Args:
+        game (Game): game whose team colors are used
+        highlight_player (str): name of highlighted player, or None
+        style (str): seaborn axes style
+
+    Returns:
+        np.ndarray: uint8 (height, width, 4) RGBA image
+    """
+    away_color = game.team_colors[game.away_id]
+    home_color = game.team_colors[game.home_id]
+    key = (FIGSIZE, DPI, style, away_color, home_color, highlight_player)
+    if key in _court_cache:
+        return _court_cache[key]
+    with sns.axes_style(style):
+        fig = Figure(figsize=FIGSIZE, dpi=DPI)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+    game._draw_court(ax=ax)
+    ax.get_xaxis().set_ticks([])
+    ax.get_yaxis().set_ticks([])
+    ax.set_xlim(-5, 100)
+    ax.set_ylim(-55, 5)
+    if highlight_player:
+        fig.text(0.17, 0.85, highlight_player, size=18)
+    # Add team color indicators to top of frame
+    ax.scatter([30, 67], [2.5, 2.5], s=100, c=[away_color, home_color])
+    canvas.draw()
+    _court_cache[key] = np.asarray(canvas.buffer_rgba()).copy()
+    return _court_cache[key]
+
+
+def _hull_vertices(points):
+    """
+    Helper function for the convex hull vertices of points, padded with
+    NaN to 5 rows.  All NaN if points are missing.
+    """
+    vertices = np.full((5, 2), np.nan)
+    if len(points) < 3 or np.isnan(points).any():
+        return vertices
+    hull = ConvexHull(points)
+    vertices[:len(hull.vertices)] = points[hull.vertices]
+    return vertices
+
+
+def playback_frames(game, starting_frame, ending_frame, fps=20, speed=1.0,
+                    interpolate=False):
+    """
+    Source frames to show for playback at a frame rate and speed.
+    Output frames are evenly spaced in tracking time, so a fast overview
+    skips source frames and slow motion repeats or interpolates them.
+    Gaps in tracking longer than MAX_FRAME_GAP are skipped.
+
+    Args:
+        game (Game): game to play back
+        starting_frame (int): first frame
+        ending_frame (int): frame to stop at (not shown)
+        fps (float): frames per second of the video
+        speed (float): playback speed relative to real time
+            e.g. 4 for a quick overview, 0.25 for slow motion
+        interpolate (bool): if True, positions between source frames are
+            interpolated (see prepare_frames()).  If False, the nearest
+            source frame is shown.
+
+    Returns: tuple of (frames, weights)
+        frames (np.ndarray): int64 source frame of each output frame
+        weights (np.ndarray): float64 weight of the following source
+            frame, for interpolation.  All 0 if not interpolate.
+    """
+    universe_time = game.moments.universe_time.values[starting_frame:
+                                                      ending_frame + 1]
+    if len(universe_time) < 2:
+        count = max(ending_frame - starting_frame, 0)
+        return (np.arange(starting_frame, starting_frame + count),
+                np.zeros(count))
+    gaps = np.diff(universe_time).astype(np.float64)
+    elapsed = np.concatenate(([0.], np.cumsum(np.clip(gaps, 0,
+                                                      MAX_FRAME_GAP))))
+    times = np.arange(0, elapsed[-1], 1000. * speed / fps)
+    index = np.searchsorted(elapsed, times, side='right') - 1
+    span = elapsed[index + 1] - elapsed[index]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(span > 0, (times - elapsed[index]) / span, 0)
+    # Skipped gaps are not interpolated across
+    weights[gaps[index] > MAX_FRAME_GAP] = 0
+    if not interpolate:
+        index = np.where(weights >= 0.5, index + 1, index)
+        index = np.minimum(index, ending_frame - starting_frame - 1)
+        weights = np.zeros(len(index))
+    return (starting_frame + index, weights)
+
+
+def prepare_frames(game, frames, weights=None):
+    """
+    Prepares everything FrameRenderer draws for a range of frames.
+    Same values as Game._get_moment_details() and Game._get_commentary(),
+    computed once per frame (commentary once per second) as arrays.
+    Styling (highlighted player, commentary panel, which hull is shown)
+    is applied when drawing, so the same state can be rendered again
+    with different options.
+
+    Args:
+        game (Game): game to prepare
+        frames (iterable): frame numbers to prepare
+        weights (np.ndarray): for interpolated playback, the weight of the
+            following frame's positions in each frame (see
+            playback_frames()).  Only frames with the same players as the
+            following frame are interpolated.  Texts are not interpolated.
+            If None, frames are not interpolated.
+
+    Returns: dict
+        frames (np.ndarray): int64 (n,) frame numbers
+        rows (dict): {frame_number: row} into the arrays below, for
+            frames that are not interpolated
+        n_entities (np.ndarray): int64 (n,) entities in frame
+        xy (np.ndarray): float64 (n, entities, 2) plot coordinates
+            (y is shifted below the x axis, as plotted)
+        player_ids (np.ndarray): int64 (n, entities), -1 for ball
+        colors (np.ndarray): float64 (n, entities, 4) RGBA face colors
+        sizes (np.ndarray): float64 (n, entities) marker sizes
+        hulls (np.ndarray): float64 (n, 2, 5, 2) convex hull vertices of
+            (home, away), NaN padded.  NaN if frame is missing players.
+        quarter, shot_clock, game_clock (list): clock texts
+        commentary (list): commentary script of each frame
+        score (list): score text of each frame
+    """
+    frames = np.asarray(list(frames), dtype=np.int64)
+    arrays = game.get_position_arrays()
+    n_entities = arrays['n_entities'][frames]
+    xyz = arrays['xyz'][frames]
+    team_ids = arrays['team_ids'][frames]
+    player_ids = arrays['player_ids'][frames]
+    interpolated = np.zeros(len(frames), dtype=bool)
+    if weights is not None:
+        moving = np.where(np.asarray(weights) > 0)[0]
+        following = frames[moving] + 1
+        same = ((n_entities[moving] == arrays['n_entities'][following]) &
+                (player_ids[moving] ==
+                 arrays['player_ids'][following]).all(axis=1))
+        moving, following = moving[same], following[same]
+        weight = np.asarray(weights)[moving][:, np.newaxis, np.newaxis]
+        xyz[moving] = (xyz[moving] * (1 - weight) +
+                       arrays['xyz'][following] * weight)
+        interpolated[moving] = True
+    xy = xyz[:, :, :2] - [0, 50]
+
+    colors = np.zeros(team_ids.shape + (4,))
+    for team_id, color in game.team_colors.items():
+        colors[team_ids == team_id] = to_rgba(color)
+    # Use ball height for size, as in Game._get_moment_details()
+    sizes = np.where(team_ids == -1,
+                     np.maximum(150 - 2 * (xyz[:, :, 2] - 5) ** 2, 10), 200)
+
+    hulls = np.full((len(frames), 2, 5, 2), np.nan)
+    for row in np.where(n_entities == 11)[0]:
+        hulls[row, 0] = _hull_vertices(xy[row, 1:6])
+        hulls[row, 1] = _hull_vertices(xy[row, 6:11])
+
+    moments = game.moments.iloc[frames]
+    shot_clocks = moments.shot_clock.fillna(24.00).values
+    quarters = moments.quarter.values
+    quarter_times = moments.quarter_time.values
+    game_times = np.round(moments.game_time.values).astype(np.int64)
+    scripts = {game_time: game._get_commentary(int(game_time))
+               for game_time in np.unique(game_times)}
+    return {'frames': frames,
+            'rows': {frame: row for row, frame
+                     in reversed(list(enumerate(frames.tolist())))
+                     if not interpolated[row]},
+            'n_entities': n_entities, 'xy': xy, 'player_ids': player_ids,
+            'colors': colors, 'sizes': sizes, 'hulls': hulls,
+            'quarter': ['Q' + str(quarter) for quarter in quarters],
+            'shot_clock': [str(shot_clock).split('.')[0]
+                           for shot_clock in shot_clocks],
+            'game_clock': ['%02d:%02d' % divmod(quarter_time, 60)
+                           for quarter_time in quarter_times],
+            'commentary': [scripts[game_time][0] for game_time in game_times],
+            'score': [scripts[game_time][1] for game_time in game_times]}
+
+
+class FrameRenderer(object):
+    """
+    Renders frames of a game into RGBA buffers, reusing one figure.
+    """
+
+    def __init__(self, game, highlight_player=None, commentary=True,
+                 show_spacing=None, state=None):
+        """
+        Args:
+            game (Game): game to render
+            highlight_player (str): Name of player to highlight
+                (by making their outline thicker).
+                if None, no player is highlighted
+            commentary (bool): if True, each frame is followed by a
+                panel of play-by-play commentary, doubling its height
+            show_spacing (str in ['home', 'away']): show convex hull
+                of home or away team
+                if None, does not display any convex hull
+            state (dict): frames prepared by prepare_frames().
+                Frames not in state are prepared one at a time.
+        """
+        self.game = game
+        self.highlight_player = highlight_player
+        self.highlight_id = (game.player_ids[highlight_player]
+                             if highlight_player else None)
+        self.commentary = commentary
+        self.show_spacing = show_spacing
+        self.state = state
+        self.size = (FIGSIZE[0] * DPI,
+                     FIGSIZE[1] * DPI * (2 if commentary else 1))
+
+        # Court, labels and team indicators come from the cached image
+        self.fig = Figure(figsize=FIGSIZE, dpi=DPI)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.fig.figimage(court_background(game, highlight_player))
+        ax = self.fig.add_subplot(111)
+        ax.set_axis_off()
+        ax.set_xlim(-5, 100)
+        ax.set_ylim(-55, 5)
+
+        # Artists that change every frame
+        self.players = ax.scatter([], [], alpha=0.85)
+        self.shot_clock = self.fig.text(0.43, 0.125, '', size=18)
+        self.quarter = self.fig.text(0.5, 0.125, '', size=18)
+        self.game_clock = self.fig.text(0.57, 0.125, '', size=18)
+        self.score = self.fig.text(0.43, .85, '', size=18)
+        self.hull = Polygon(np.zeros((3, 2)), alpha=0.3, color='gray')
+        ax.add_patch(self.hull)
+        self.hull.set_visible(bool(show_spacing))
+        self.dynamic_artists = [self.players, self.hull, self.shot_clock,
+                                self.quarter, self.game_clock, self.score]
+        for artist in self.dynamic_artists:
+            artist.set_animated(True)
+
+        # Draw the background image once and keep it for blitting
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+        self.commentary_fig = None
+        self.commentary_script = None
+        self.commentary_buffer = None
+        if commentary:
+            self.commentary_fig = Figure(figsize=FIGSIZE, dpi=DPI)
+            FigureCanvasAgg(self.commentary_fig)
+            self.commentary_text = self.commentary_fig.text(.2, .4, '',
+                                                            size=20)
+
+    def _update(self, state, row):
+        """
+        Helper function to update dynamic artists for a row of state
+
+        Returns:
+            str: commentary script for the frame
+        """
+        count = state['n_entities'][row]
+        self.players.set_offsets(state['xy'][row, :count])
+        self.players.set_sizes(state['sizes'][row, :count])
+        self.players.set_facecolor(state['colors'][row, :count])
+        self.players.set_linewidths(
+            np.where(state['player_ids'][row, :count] == self.highlight_id,
+                     5, 0.5))
+        self.shot_clock.set_text(state['shot_clock'][row])
+        self.quarter.set_text(state['quarter'][row])
+        self.game_clock.set_text(state['game_clock'][row])
+        self.score.set_text(self.game.away_team + "  " + state['score'][row] +
+                            "  " + self.game.home_team)
+        if self.show_spacing:
+            team = 0 if self.show_spacing == 'home' else 1
+            hull = state['hulls'][row, team]
+            hull = hull[~np.isnan(hull[:, 0])]
+            self.hull.set_visible(len(hull) > 0)
+            if len(hull):
+                self.hull.set_xy(hull)
+        return state['commentary'][row]
+
+    def _render_commentary(self, commentary_script):
+        """
+        Helper function for the commentary panel.  Commentary changes only
+        every few seconds, so the panel is redrawn only when it changes.
+        """
+        if commentary_script != self.commentary_script:
+            self.commentary_text.set_text(commentary_script)
+            self.commentary_fig.canvas.draw()
+            self.commentary_buffer = bytes(
+                self.commentary_fig.canvas.buffer_rgba())
+            self.commentary_script = commentary_script
+        return self.commentary_buffer
+
+    def render(self, frame_number):
+        """
+        Renders a frame.
+
+        Args:
+            frame_number (int): number of frame in game to render
+
+        Returns:
+            bytes: RGBA pixels of the frame, self.size in size
+        """
+        state = self.state
+        if state is None or frame_number not in state['rows']:
+            state = prepare_frames(self.game, [frame_number])
+        return self._draw(state, state['rows'][frame_number])
+
+    def render_row(self, row):
+        """
+        Renders a row of the prepared state, which may be an interpolated
+        frame (see playback_frames()).
+
+        Args:
+            row (int): row of self.state to render
+
+        Returns:
+            bytes: RGBA pixels of the frame, self.size in size
+        """
+        return self._draw(self.state, row)
+
+    def _draw(self, state, row):
+        """
+        Helper function to draw a row of state
+        """
+        commentary_script = self._update(state, row)
+        self.canvas.restore_region(self.background)
+        for artist in self.dynamic_artists:
+            self.fig.draw_artist(artist)
+        image = bytes(self.canvas.buffer_rgba())
+        if self.commentary:
+            image += self._render_commentary(commentary_script)
+        return image
+
+
+# Renderer of each worker process in render_frames()
+_worker_renderer = None
+
+
+def _init_worker(game, options):
+    """
+    Helper function to set up a renderer in a worker process
+    """
+    global _worker_renderer
+    _worker_renderer = FrameRenderer(game, **options)
+
+
+def _render_chunk(rows):
+    """
+    Helper function to render consecutive rows in a worker process
+    """
+    return b''.join(_worker_renderer.render_row(row) for row in rows)
+
+
+def render_frames(game, frames, processes=1, chunk_size=25, state=None,
+                  **options):
+    """
+    Generator of rendered frames, in order.
+    With several processes, consecutive chunks of frames are rendered by
+    a pool of workers, each with its own renderer, and reassembled in
+    order.  At most 2 chunks per process are rendered ahead of the
+    consumer, so memory stays bounded when the consumer (ffmpeg) is slow.
+
+    Args:
+        game (Game): game to render.  It is copied to each worker once,
+            so slim games (Game(..., slim=True)) start faster.
+        frames (iterable): frame numbers to render.
+            If None, every row of state is rendered.
+        processes (int): number of worker processes.
+            If 1, frames are rendered in this process.
+        chunk_size (int): number of frames per task
+        state (dict): frames prepared by prepare_frames(), for example to
+            render the same frames again with other options, or to render
+            interpolated frames.  frames must be in state.
+            If None, frames are prepared here.
+        **options: passed to FrameRenderer
+
+    Yields:
+        bytes: RGBA pixels of one or more consecutive frames
+    """
+    if state is None:
+        state = prepare_frames(game, frames)
+        rows = list(range(len(state['frames'])))
+    elif frames is None:
+        rows = list(range(len(state['frames'])))
+    else:
+        rows = [state['rows'][frame] for frame in frames]
+    options = dict(options, state=state)
+    if processes <= 1:
+        renderer = FrameRenderer(game, **options)
+        for row in rows:
+            yield renderer.render_row(row)
+        return
+    chunks = [rows[start:start + chunk_size]
+              for start in range(0, len(rows), chunk_size)]
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(game, options))
+    try:
+        pending = deque()
+        chunks = iter(chunks)
+        for chunk in chunks:
+            pending.append(pool.apply_async(_render_chunk, (chunk,)))
+            if len(pending) == 2 * processes:
+                break
+        while pending:
+            result = pending.popleft()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_render_chunk, (chunk,)))
+                break
+            yield result.get()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,187 @@
+"""
+Uniform 25Hz timeline of a game.
+
+SportVU frames nominally come every 40 msec of universe_time, but frames
+are dropped, overlapping events repeat frames (Game drops repeated
+universe_time rows at load, which can leave frames out of order), and
+time jumps between quarters and at stoppages.  resample_arrays() puts
+each period on a strict grid of FRAME_MSEC steps:
+
+    - grid points between two frames of the same lineup less than
+      MAX_GAP_MSEC apart are linearly interpolated (flag interpolated)
+    - grid points on a substitution take the nearest frame
+    - grid points in longer gaps are explicit gaps: NaN positions,
+      n_entities 0, segment -1, and listed in gaps
+
+The result has the keys of analytics.game_arrays(), so the functions of
+analytics.py run on it unchanged.  Derived metrics can use fixed strides
+(one row is always FRAME_MSEC).  Segments also break where the players
+change or an entity moves faster than MAX_PLAYER_SPEED (MAX_BALL_SPEED
+for the ball), e.g. positions that jump across a stoppage, and
+velocities are never taken across segments (see
+analytics.entity_speeds()).  Every speed is therefore within those
+bounds and needs no outlier filtering.
+"""
+
+import numpy as np
+import analytics
+
+# Grid step in msec (25Hz)
+FRAME_MSEC = 40
+
+# Longest gap in tracking (msec) interpolated across.  Grid points in
+# longer gaps are marked as gaps.
+MAX_GAP_MSEC = 200
+
+# Fastest plausible speeds (ft/msec), about 27 mph for players and 68 mph
+# for the ball.  Faster movement between two grid points is a jump in the
+# data and starts a new segment.
+MAX_PLAYER_SPEED = 0.04
+MAX_BALL_SPEED = 0.1
+
+# Sorts frames by (quarter, universe_time) with a single key
+_QUARTER_KEY = 10 ** 13
+
+
+def _grid(quarter, universe_time, frame_msec):
+    """
+    Helper function for the grid times of every period.
+
+    Returns: tuple of (grid_quarter, grid_time, period_start)
+        grid_quarter, grid_time (np.ndarray): int64 quarter and
+            universe_time of each grid point
+        period_start (np.ndarray): bool, True on the first grid point of
+            each period
+    """
+    starts = np.flatnonzero(np.diff(quarter, prepend=quarter[0] - 1))
+    ends = np.append(starts[1:], len(quarter)) - 1
+    first = universe_time[starts]
+    lengths = (universe_time[ends] - first) // frame_msec + 1
+    period = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) -
+                                                   lengths, lengths)
+    period_start = offsets == 0
+    return (quarter[starts][period], first[period] + offsets * frame_msec,
+            period_start)
+
+
+def resample_arrays(arrays, frame_msec=FRAME_MSEC, max_gap=MAX_GAP_MSEC):
+    """
+    Resamples game arrays to a uniform time grid per period.
+
+    Args:
+        arrays (dict): game arrays (see analytics.game_arrays())
+        frame_msec (int): grid step in msec
+        max_gap (int): longest gap between frames (msec) interpolated
+            across
+
+    Returns: dict of arrays, one row per grid point
+        xyz, team_ids, player_ids, n_entities, quarter, universe_time,
+            quarter_time, shot_clock, game_time: as in game arrays.
+            Clocks are interpolated like positions.
+        source_frame (np.ndarray): int64 nearest frame of game.moments,
+            e.g. for Game.animate_play()
+        interpolated (np.ndarray): bool, True where positions are
+            interpolated between two frames
+        gap (np.ndarray): bool, True in gaps longer than max_gap
+        segment (np.ndarray): int64 id of each run of grid points without
+            a gap, new at every period, lineup change and jump faster
+            than MAX_PLAYER_SPEED or MAX_BALL_SPEED; -1 in gaps
+        gaps (np.ndarray): int64 (gaps, 2) first and last + 1 grid point
+            of each gap
+    """
+    quarter = np.asarray(arrays['quarter'], dtype=np.int64)
+    universe_time = np.asarray(arrays['universe_time'], dtype=np.int64)
+    order = np.argsort(quarter * _QUARTER_KEY + universe_time,
+                       kind='stable')
+    quarter, universe_time = quarter[order], universe_time[order]
+    grid_quarter, grid_time, period_start = _grid(quarter, universe_time,
+                                                  frame_msec)
+
+    # Frames at or before (previous) and after (next) each grid point,
+    # within the same period
+    keys = quarter * _QUARTER_KEY + universe_time
+    grid_keys = grid_quarter * _QUARTER_KEY + grid_time
+    previous = np.searchsorted(keys, grid_keys, side='right') - 1
+    following = np.minimum(previous + 1, len(keys) - 1)
+    following = np.where(quarter[following] == grid_quarter, following,
+                         previous)
+    span = (universe_time[following] - universe_time[previous]).astype(
+        np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(span > 0, (grid_time - universe_time[previous]) /
+                           span, 0.)
+    exact = weights == 0
+    gap = ~exact & (span > max_gap)
+
+    # Only interpolate between frames of the same players
+    player_ids = arrays['player_ids'][order]
+    n_entities = arrays['n_entities'][order]
+    same = ((player_ids[previous] == player_ids[following]).all(axis=1) &
+            (n_entities[previous] == n_entities[following]))
+    interpolated = ~exact & ~gap & same
+    nearest = np.where(weights >= 0.5, following, previous)
+    source = np.where(interpolated, previous, nearest)
+    weights = np.where(interpolated, weights, 0.)
+
+    def blend(values):
+        values = np.asarray(values, dtype=np.float64)[order]
+        shape = (-1,) + (1,) * (values.ndim - 1)
+        start = values[source]
+        return start + weights.reshape(shape) * (values[following] - start)
+
+    resampled = {'xyz': blend(arrays['xyz']),
+                 'team_ids': arrays['team_ids'][order][source],
+                 'player_ids': player_ids[source],
+                 'n_entities': n_entities[source],
+                 'quarter': grid_quarter,
+                 'universe_time': grid_time,
+                 'quarter_time': blend(arrays['quarter_time']),
+                 'shot_clock': blend(arrays['shot_clock']),
+                 'source_frame': order[source],
+                 'interpolated': interpolated,
+                 'gap': gap}
+    resampled['game_time'] = ((grid_quarter - 1) * 720 +
+                              (720 - resampled['quarter_time']))
+    resampled['xyz'][gap] = np.nan
+    resampled['team_ids'][gap] = 0
+    resampled['player_ids'][gap] = 0
+    resampled['n_entities'][gap] = 0
+
+    # Runs of grid points split at periods, gap boundaries, lineup
+    # changes and jumps
+    xy = resampled['xyz'][:, :, :2]
+    limits = np.full(xy.shape[1], MAX_PLAYER_SPEED * frame_msec)
+    limits[:1] = MAX_BALL_SPEED * frame_msec
+    with np.errstate(invalid='ignore'):
+        jump = (np.linalg.norm(xy[1:] - xy[:-1], axis=2) > limits).any(axis=1)
+    changed = (resampled['player_ids'][1:] !=
+               resampled['player_ids'][:-1]).any(axis=1)
+    boundary = period_start.copy()
+    boundary[1:] |= (gap[1:] != gap[:-1]) | ((jump | changed) & ~gap[1:])
+    run_starts = np.flatnonzero(boundary)
+    run_ends = np.append(run_starts[1:], len(gap))
+    run_gap = gap[run_starts]
+    run_segment = np.cumsum(~run_gap) - 1
+    segment = run_segment[np.cumsum(boundary) - 1]
+    segment[gap] = -1
+    resampled['segment'] = segment
+    resampled['gaps'] = np.column_stack((run_starts[run_gap],
+                                         run_ends[run_gap]))
+    return resampled
+
+
+def resample(game, frame_msec=FRAME_MSEC, max_gap=MAX_GAP_MSEC):
+    """
+    Uniform timeline of a game (see resample_arrays()).
+
+    Args:
+        game (Game): game to resample
+        frame_msec (int): grid step in msec
+        max_gap (int): longest gap between frames (msec) interpolated
+            across
+
+    Returns: dict of arrays
+    """
+    return resample_arrays(analytics.game_arrays(game), frame_msec,
+                           max_gap)
@@ -0,0 +1,168 @@
+"""
+Zero-copy hand-off of game arrays to worker processes.
+
+Pickling a Game for every worker copies its DataFrames.  SharedGame
+instead copies the game arrays (see analytics.game_arrays()) once into a
+named shared-memory block.  Workers receive a small handle and map the
+same memory as read-only numpy arrays.
+
+    with SharedGame(game) as shared:
+        spacing, velocity = run_analyses(shared.handle,
+                                         [analytics.spacing_statistics,
+                                          analytics.velocity_statistics])
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from analytics import game_arrays, game_metadata
+
+# Offsets of arrays in a block are aligned to this many bytes
+ALIGNMENT = 64
+
+
+class SharedGameHandle(object):
+    """
+    Picklable description of a shared game: the block name and the
+    location of each array in it.
+    """
+
+    def __init__(self, name, layout, metadata):
+        """
+        Args:
+            name (str): name of shared-memory block
+            layout (dict): {key: (offset, shape, dtype string)}
+            metadata (dict): see analytics.game_metadata()
+        """
+        self.name = name
+        self.layout = layout
+        self.metadata = metadata
+
+
+class SharedGame(object):
+    """
+    Owner of a shared-memory block holding a game's arrays.
+    The block is removed by close(), or on leaving a with block.
+    """
+
+    def __init__(self, game, arrays=None):
+        """
+        Args:
+            game (Game): game to share
+            arrays (dict): extra arrays to share, such as masks.
+                Each has one row per frame.
+        """
+        arrays_to_share = game_arrays(game)
+        if arrays:
+            arrays_to_share.update(arrays)
+        layout = {}
+        size = 0
+        for key, array in arrays_to_share.items():
+            array = np.ascontiguousarray(array)
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            layout[key] = (size, array.shape, array.dtype.str)
+            size += array.nbytes
+        self.block = shared_memory.SharedMemory(create=True,
+                                                size=max(size, 1))
+        for key, array in arrays_to_share.items():
+            view = _view(self.block, layout[key])
+            view[...] = array
+        self.handle = SharedGameHandle(self.block.name, layout,
+                                       game_metadata(game))
+
+    def close(self):
+        """
+        Releases and removes the shared-memory block.
+        Workers must not use the arrays afterwards.
+        """
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _view(block, location):
+    """
+    Helper function for a numpy array backed by a shared-memory block
+    """
+    offset, shape, dtype = location
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf,
+                      offset=offset)
+
+
+def _attach_block(name):
+    """
+    Helper function to open an existing shared-memory block without
+    taking ownership of it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, attaching registers the block with the
+        # resource tracker, and a spawned worker's own tracker would
+        # remove the block when the worker exits.
+        block = shared_memory.SharedMemory(name=name)
+        if multiprocessing.get_start_method() != 'fork':
+            resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+def attach_game(handle):
+    """
+    Maps a shared game's arrays without copying them.
+
+    Args:
+        handle (SharedGameHandle): SharedGame.handle
+
+    Returns: tuple of (arrays, block)
+        arrays (dict): read-only game arrays
+        block (SharedMemory): keep a reference while using arrays and
+            call block.close() when done
+    """
+    block = _attach_block(handle.name)
+    arrays = {}
+    for key, location in handle.layout.items():
+        arrays[key] = _view(block, location)
+        arrays[key].flags.writeable = False
+    return (arrays, block)
+
+
+def _run_analysis(args):
+    """
+    Helper function to run one analysis in a worker process
+    """
+    analysis, handle = args
+    arrays, block = attach_game(handle)
+    try:
+        return analysis(arrays, handle.metadata)
+    finally:
+        # Results must not reference shared memory after close
+        del arrays
+        block.close()
+
+
+def run_analyses(handle, analyses, processes=None):
+    """
+    Runs several analyses of one shared game in parallel.
+
+    Args:
+        handle (SharedGameHandle): SharedGame.handle
+        analyses (list): functions called as analysis(arrays, metadata),
+            see analytics.spacing_statistics() for an example.
+            Must be importable by worker processes.
+        processes (int): number of worker processes.
+            If None, one per analysis.
+
+    Returns:
+        list: result of each analysis, in order
+    """
+    processes = processes or len(analyses)
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_run_analysis, [(analysis, handle)
+                                        for analysis in analyses])
@@ -8,16 +8,20 @@ import os
 import pickle
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
-from sklearn import linear_model
-from game import Game
+from game import Game, _make_directory
+from prefetch import run_season, load_game_data
+import instrument
+from compact import write_compact_game
 
 
-def extract_games():
+def extract_games(filename='allgames.txt'):
     """
     Extract games from allgames.txt
 
+    Args:
+        filename (str): list of games, one archive name per line
+            (see scrape_games.py and synthetic.write_allgames())
+
     Returns:
         list: list of games.  Each element is list is
             [date, home_team, away_team]
@@ -25,7 +29,7 @@ def extract_games():
     """
 
     games = []
-    with open('allgames.txt', 'r') as game_file:
+    with open(filename, 'r') as game_file:
         for line in game_file:
             game = line.split('.')
             date = "{game[0]}.{game[1]}.{game[2]}".format(game=game)
@@ -36,7 +40,9 @@ def extract_games():
 
 
 def get_spacing_statistics(date, home_team, away_team, write_file=False,
-                           write_score=False, write_game=False):
+                           write_score=False, write_game=False,
+                           tracking_data=None, playbyplay_data=None,
+                           compact=False):
     """
     Calculates spacing statistics for each frame in game
 
@@ -51,6 +57,13 @@ def get_spacing_statistics(date, home_team, away_team, write_file=False,
         write_game (bool): If True, write pickle file of tracking data
             into data/game directory
             Note: This file is ~100MB.
+        tracking_data (dict): Already loaded tracking data.
+            If None, it is downloaded.
+        playbyplay_data (dict): Already loaded play-by-play data.
+            If None, it is downloaded.
+        compact (bool): If True, write_game writes a compact .pz file
+            instead (see compact.read_compact_game()), about 12x smaller
+            on disk, with positions kept encoded in memory once read
 
     Returns:
         tuple: tuple of data (home_offense_areas, home_defense_areas,
@@ -65,23 +78,32 @@ def get_spacing_statistics(date, home_team, away_team, write_file=False,
     # Do not recalculate spacing data if already saved to disk
     if filename in os.listdir('./data/spacing'):
         return
-    game = Game(date, home_team, away_team)
+    with instrument.span('Game'):
+        game = Game(date, home_team, away_team, tracking_data,
+                    playbyplay_data, slim=True)
     # Write game data to disk
     if write_game:
-        pickle.dump(game, open('data/game/' + filename, "wb"))
+        if compact:
+            write_compact_game(game, 'data/game/' + filename + 'z')
+        else:
+            pickle.dump(game, open('data/game/' + filename, "wb"))
     home_offense_areas, home_defense_areas = [], []
     away_offense_areas, away_defense_areas = [], []
     print(date, home_team, away_team)
-    for frame in range(len(game.moments)):
-        offensive_team = game.get_offensive_team(frame)
-        if offensive_team:
-            home_area, away_area = game.get_spacing_area(frame)
-            if offensive_team == 'home':
-                home_offense_areas.append(home_area)
-                away_defense_areas.append(away_area)
-            if offensive_team == 'away':
-                home_defense_areas.append(home_area)
-                away_offense_areas.append(away_area)
+    with instrument.span('frames'):
+        for frame in range(len(game.moments)):
+            offensive_team = game.get_offensive_team(frame)
+            if offensive_team:
+                home_area, away_area = game.get_spacing_area(frame)
+                if offensive_team == 'home':
+                    home_offense_areas.append(home_area)
+                    away_defense_areas.append(away_area)
+                if offensive_team == 'away':
+                    home_defense_areas.append(home_area)
+                    away_offense_areas.append(away_area)
+    processed = len(home_offense_areas) + len(away_offense_areas)
+    instrument.count('spacing.frames', processed)
+    instrument.count('spacing.frames_skipped', len(game.moments) - processed)
     results = (home_offense_areas, home_defense_areas,
                away_offense_areas, away_defense_areas)
     # Write spacing data to disk
@@ -100,18 +122,31 @@ def get_spacing_statistics(date, home_team, away_team, write_file=False,
            away_offense_areas, away_defense_areas)
 
 
-def write_spacing(gamelist):
+def write_spacing(gamelist, prefetch=2, loader=load_game_data):
     """
     Writes all spacing statistics to data/spacing directory for each game
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+        prefetch (int): number of games to download ahead while the
+            current game is analyzed (see prefetch.prefetch_games())
+        loader (function): loads a game's data, e.g.
+            prefetch.load_local_game_data or synthetic.SyntheticLoader()
     """
-    for game in gamelist:
-        try:
-            get_spacing_statistics(game[0], game[1], game[2],
-                                   write_file=True, write_score=True)
-        except:
-            with open('errorlog.txt', 'a') as myfile:
-                myfile.write("{game} Could not extract spacing data\n"
-                             .format(game=game))
+    # Skip games already written, so they are not downloaded
+    written = os.listdir('./data/spacing')
+    gamelist = [game for game in gamelist
+                if "{game[0]}-{game[2]}-{game[1]}.p".format(game=game)
+                not in written]
+
+    def analyze(game, data):
+        get_spacing_statistics(game[0], game[1], game[2], write_file=True,
+                               write_score=True, tracking_data=data[0],
+                               playbyplay_data=data[1])
+
+    run_season(gamelist, analyze, 'spacing', 'extract spacing data',
+               prefetch=prefetch, loader=loader, build_game=False)
 
 
 def plot_spacing(date, home_team, away_team, defense=True, save_plot=False):
@@ -130,6 +165,7 @@ def plot_spacing(date, home_team, away_team, defense=True, save_plot=False):
         Also, shows plt.hist of team spacing during game
 
     """
+    import matplotlib.pyplot as plt
     plt.plot()
     filename = ("{date}-{away_team}-"
                 "{home_team}").format(date=date, away_team=away_team,
@@ -149,6 +185,7 @@ def plot_spacing(date, home_team, away_team, defense=True, save_plot=False):
     plt.legend(loc='upper right')
     plt.show()
     if save_plot:
+        _make_directory('temp')
         plt.savefig('temp/spacing{date}.png'.format(date=date))
     return None
 
@@ -236,6 +273,8 @@ def plot_offense_vs_defense_spacing(spacing_data):
     Returns None
         Also, shows plot.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     sns.regplot(spacing_data.away_offense_areas,
                 spacing_data.home_defense_areas,
                 fit_reg=True, color=sns.color_palette()[0],
@@ -248,6 +287,7 @@ def plot_offense_vs_defense_spacing(spacing_data):
     plt.ylabel('Average Defensive Spacing (sq ft)', fontsize=16)
     plt.title('Offensive spacing robustly induces defensive spacing',
               fontsize=16)
+    _make_directory('temp')
     plt.savefig('temp/OffenseVsDefense.png')
     plt.close()
     return None
@@ -266,6 +306,8 @@ def plot_defense_spacing_vs_score(spacing_data):
     Returns None
         Also, shows plot.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     y = spacing_data.home_points - spacing_data.away_points
     x = spacing_data.away_defense_areas - spacing_data.home_defense_areas
     sns.regplot(x, y, ci=False)
@@ -274,6 +316,7 @@ def plot_defense_spacing_vs_score(spacing_data):
     plt.ylabel('Home Team Score Differential (pts)', fontsize=16)
     plt.title('Spacing the defense correlates with outscoring opponents',
               fontsize=16)
+    _make_directory('temp')
     plt.savefig('temp/SpacingVsScore.png')
     plt.close()
 
@@ -291,6 +334,9 @@ def plot_defense_spacing_vs_wins(spacing_datae):
     Returns None
         Also, shows plot.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from sklearn import linear_model
     clf = linear_model.LogisticRegression(C=1)
     X = np.array(spacing_data.space_dif)
     X = X[:, np.newaxis]
@@ -312,6 +358,7 @@ def plot_defense_spacing_vs_wins(spacing_datae):
     plt.xlabel('Home Team Defensive Spacing Differential (sq ft)', fontsize=16)
     plt.ylabel('Home Team Win', fontsize=16)
     plt.title('Spacing the Defense Correlates with winning', fontsize=16)
+    _make_directory('temp')
     plt.savefig('temp/SpacingVsWins.png')
     plt.close()
 
@@ -329,6 +376,8 @@ def plot_team_defensive_spacing(spacing_data):
     Returns None
         Also, shows plot.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     df = pd.DataFrame()
     df['home'] = spacing_data.groupby('home_team')['away_defense_areas'].sum()
     df['home_count'] = spacing_data.groupby('home_team')['away_defense_areas'].count()
@@ -340,6 +389,7 @@ def plot_team_defensive_spacing(spacing_data):
     plt.ylabel("Opponent's Defensive Spacing (sq ft)", fontsize=16)
     plt.ylim(60, 70)
     plt.title("Team's ability to space the defense", fontsize=18)
+    _make_directory('temp')
     plt.savefig('temp/DefensiveSpacing.png')
     plt.close()
 
@@ -358,6 +408,8 @@ def plot_teams_ability_to_space_defense(spacing_data):
     Returns None
         Also saves plot to temp dir
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     df = spacing_data.groupby('home_team').count()
     df['home'] = spacing_data.groupby('home_team')['away_defense_areas'].sum()
     df['home_count'] = spacing_data.groupby('home_team')['away_defense_areas'].count()
@@ -385,6 +437,7 @@ def plot_teams_ability_to_space_defense(spacing_data):
     plt.xlabel('Average Offensive Spacing (sq ft)', fontsize=16)
     plt.ylabel("Average Opponent's Defensive Spacing (sq ft)", fontsize=16)
     plt.title("Team's ability to space opponent's defense", fontsize=16)
+    _make_directory('temp')
     plt.savefig('temp/Spacing_scatter.png')
     plt.close()
 
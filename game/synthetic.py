@@ -0,0 +1,636 @@
+"""
+Synthetic SportVU tracking and play-by-play data for offline testing.
+
+generate_game() simulates a game possession by possession: players run
+into a half-court set, the ball is dribbled and passed, each possession
+ends in a made or missed shot and a rebound, and fouls and timeouts stop
+the clock for substitutions.  The output has the same layout as the real
+data, so Game, the loaders and the season scripts all accept it:
+
+    tracking_data, playbyplay_data = generate_game('01.01.2016', 'TOR', 'CHI')
+    game = Game('01.01.2016', 'TOR', 'CHI', tracking_data, playbyplay_data)
+
+generate_season() writes a season of games plus a matching allgames.txt.
+Seasons too large for the disk can be generated while they are analyzed
+instead, with SyntheticLoader as the loader of prefetch.prefetch_games()
+or the write_* season scripts.  Games are deterministic: the same seed,
+date and teams always give the same game.
+"""
+
+import os
+import json
+import zlib
+import datetime
+import numpy as np
+from scipy.signal import lfilter
+
+TEAMS = {'ATL': 1610612737, 'BOS': 1610612738, 'CLE': 1610612739,
+         'NOP': 1610612740, 'CHI': 1610612741, 'DAL': 1610612742,
+         'DEN': 1610612743, 'GSW': 1610612744, 'HOU': 1610612745,
+         'LAC': 1610612746, 'LAL': 1610612747, 'MIA': 1610612748,
+         'MIL': 1610612749, 'MIN': 1610612750, 'BKN': 1610612751,
+         'NYK': 1610612752, 'ORL': 1610612753, 'IND': 1610612754,
+         'PHI': 1610612755, 'PHX': 1610612756, 'POR': 1610612757,
+         'SAC': 1610612758, 'SAS': 1610612759, 'OKC': 1610612760,
+         'TOR': 1610612761, 'UTA': 1610612762, 'MEM': 1610612763,
+         'WAS': 1610612764, 'DET': 1610612765, 'CHA': 1610612766}
+
+# Columns of the NBA.com play-by-play result set
+PBP_HEADERS = ['GAME_ID', 'EVENTNUM', 'EVENTMSGTYPE', 'EVENTMSGACTIONTYPE',
+               'PERIOD', 'WCTIMESTRING', 'PCTIMESTRING', 'HOMEDESCRIPTION',
+               'NEUTRALDESCRIPTION', 'VISITORDESCRIPTION', 'SCORE',
+               'SCOREMARGIN']
+for _player in ['1', '2', '3']:
+    PBP_HEADERS += [column.format(_player) for column in
+                    ['PERSON{0}TYPE', 'PLAYER{0}_ID', 'PLAYER{0}_NAME',
+                     'PLAYER{0}_TEAM_ID', 'PLAYER{0}_TEAM_CITY',
+                     'PLAYER{0}_TEAM_NICKNAME',
+                     'PLAYER{0}_TEAM_ABBREVIATION']]
+
+FIRST_NAMES = ['James', 'Kevin', 'Chris', 'Anthony', 'Marcus', 'Derrick',
+               'Jordan', 'Tyler', 'Kyle', 'Brandon', 'Andre', 'Jamal',
+               'Eric', 'Paul', 'Jeff', 'Danny', 'Tony', 'Isaiah', 'Zach',
+               'Dwight']
+LAST_NAMES = ['Johnson', 'Williams', 'Brown', 'Jones', 'Miller', 'Davis',
+              'Wilson', 'Anderson', 'Thomas', 'Jackson', 'White', 'Harris',
+              'Martin', 'Thompson', 'Robinson', 'Clark', 'Lewis', 'Walker',
+              'Allen', 'Young', 'Hill', 'Green', 'Adams', 'Baker']
+
+FRAME_MSEC = 40  # 25 frames per second
+LEFT_BASKET = np.array([5.25, 25.])
+RIGHT_BASKET = np.array([88.75, 25.])
+# Smoothness of player movement, see _wander()
+DECAY = 0.98
+
+
+def team_roster(team, size=13):
+    """
+    Players of a synthetic team.  Ids and names only depend on the team.
+
+    Args:
+        team (str): team abbreviation, a key of TEAMS
+        size (int): number of players
+
+    Returns:
+        list: dicts of lastname, firstname, playerid, jersey and position,
+            as in the 'players' of SportVU events
+    """
+    first_id = 201000 + sorted(TEAMS).index(team) * 100
+    roster = []
+    for index in range(size):
+        rng = np.random.RandomState(first_id + index)
+        roster.append({'lastname': LAST_NAMES[rng.randint(len(LAST_NAMES))],
+                       'firstname':
+                           FIRST_NAMES[rng.randint(len(FIRST_NAMES))],
+                       'playerid': first_id + index,
+                       'jersey': str(index * 3 % 50),
+                       'position': ['G', 'G', 'F', 'F', 'C'][index % 5]})
+    return roster
+
+
+def game_seed(date, home_team, away_team, seed=0):
+    """
+    Seed of a game, so every game of a season is different but the same
+    game is generated every time.  The seed is also the game's game_id,
+    so season_schedule() leaves out games whose seeds collide.
+    """
+    key = '{seed}:{date}.{away_team}.at.{home_team}'.format(
+        seed=seed, date=date, away_team=away_team, home_team=home_team)
+    return zlib.crc32(key.encode('utf-8')) & 0xffffffff
+
+
+class _Simulation(object):
+    """
+    State of a game being generated, see generate_game()
+    """
+
+    def __init__(self, date, home_team, away_team, seed, quarters,
+                 quarter_length, substitution_rate, stoppage_rate):
+        self.rng = np.random.RandomState(seed)
+        # All 32 bits of the seed, so game ids of a season are unique
+        self.game_id = '{0:010d}'.format(seed)
+        self.teams = [home_team, away_team]
+        self.team_ids = [TEAMS[home_team], TEAMS[away_team]]
+        self.rosters = [team_roster(home_team), team_roster(away_team)]
+        self.quarters = quarters
+        self.quarter_length = quarter_length
+        self.substitution_rate = substitution_rate
+        self.stoppage_rate = stoppage_rate
+        # Starters are the first five of each roster
+        self.lineups = [list(range(5)), list(range(5))]
+        self.positions = np.column_stack((
+            np.concatenate((self.rng.uniform(30, 46, 5),
+                            self.rng.uniform(48, 64, 5))),
+            self.rng.uniform(5, 45, 10)))
+        self.ball = np.array([47., 25., 5.])
+        self.score = [0, 0]
+        self.clock = float(quarter_length)
+        self.quarter = 1
+        self.segments = []
+        self.rows = []
+        month, day, year = [int(part) for part in date.split('.')]
+        self.start_time = datetime.datetime(year, month, day, 19, 0)
+        self.universe_time = int((self.start_time -
+                                  datetime.datetime(1970, 1, 1))
+                                 .total_seconds() * 1000)
+        self.first_universe_time = self.universe_time
+
+    # Play-by-play
+
+    def _player(self, team, index):
+        return self.rosters[team][self.lineups[team][index]]
+
+    def _add_row(self, event_type, description=None, team=None, players=(),
+                 action_type=0, score_changed=False):
+        """
+        Helper function to add a play-by-play row at the current clock.
+        players are (team, roster index) pairs.
+        """
+        minutes, seconds = divmod(int(np.ceil(self.clock)), 60)
+        wall_clock = self.start_time + datetime.timedelta(
+            seconds=(self.universe_time - self.first_universe_time) / 1000.)
+        row = dict.fromkeys(PBP_HEADERS)
+        row.update({'GAME_ID': self.game_id,
+                    'EVENTNUM': len(self.rows) + 1,
+                    'EVENTMSGTYPE': event_type,
+                    'EVENTMSGACTIONTYPE': action_type,
+                    'PERIOD': self.quarter,
+                    'WCTIMESTRING': wall_clock.strftime('%I:%M %p'),
+                    'PCTIMESTRING': '{0}:{1:02d}'.format(minutes, seconds)})
+        if team is None:
+            row['NEUTRALDESCRIPTION'] = description
+        elif team == 0:
+            row['HOMEDESCRIPTION'] = description
+        else:
+            row['VISITORDESCRIPTION'] = description
+        if score_changed:
+            row['SCORE'] = '{0} - {1}'.format(self.score[1], self.score[0])
+            margin = self.score[0] - self.score[1]
+            row['SCOREMARGIN'] = str(margin) if margin else 'TIE'
+        for number, (player_team, player) in enumerate(players):
+            roster_entry = self.rosters[player_team][player]
+            prefix = 'PLAYER{0}_'.format(number + 1)
+            row.update({'PERSON{0}TYPE'.format(number + 1):
+                            4 + player_team,
+                        prefix + 'ID': roster_entry['playerid'],
+                        prefix + 'NAME': '{firstname} {lastname}'.format(
+                            **roster_entry),
+                        prefix + 'TEAM_ID': self.team_ids[player_team],
+                        prefix + 'TEAM_CITY': self.teams[player_team],
+                        prefix + 'TEAM_NICKNAME': self.teams[player_team],
+                        prefix + 'TEAM_ABBREVIATION':
+                            self.teams[player_team]})
+        for number in range(len(players), 3):
+            row['PERSON{0}TYPE'.format(number + 1)] = 0
+            row['PLAYER{0}_ID'.format(number + 1)] = 0
+        self.rows.append([row[column] for column in PBP_HEADERS])
+
+    # Movement
+
+    def _progress(self, n, ease):
+        """
+        Helper function for (n, 1, 1) smooth progress from 0 to 1 over
+        ease frames
+        """
+        progress = np.minimum(np.arange(1, n + 1) / float(max(ease, 1)), 1)
+        return (progress * progress * (3 - 2 * progress))[:, None, None]
+
+    def _noise(self, n, wander):
+        """
+        Helper function for smooth random offsets (n, 10, 2) of about
+        wander feet
+        """
+        scale = wander * np.sqrt((1 + DECAY) / (1 - DECAY))
+        return lfilter([1 - DECAY], [1, -DECAY],
+                       self.rng.normal(0, scale, (n, 10, 2)), axis=0)
+
+    def _wander(self, n, targets, ease, wander):
+        """
+        Helper function for player paths (n, 10, 2) that move smoothly
+        from the current positions to targets over ease frames, then
+        wander around the targets by about wander feet.
+        """
+        progress = self._progress(n, ease)
+        paths = self.positions + (targets - self.positions) * progress
+        return paths + self._noise(n, wander) * progress
+
+    def _add_segment(self, players, ball, clocks, shot_clocks):
+        """
+        Helper function to record frames of the current lineups
+        """
+        n = len(players)
+        self.segments.append({
+            'quarter': self.quarter,
+            'universe_time': self.universe_time +
+            FRAME_MSEC * np.arange(n, dtype=np.int64),
+            'quarter_time': clocks, 'shot_clock': shot_clocks,
+            'ball': ball, 'players': players,
+            'ids': [self.rosters[team][index]['playerid']
+                    for team in [0, 1] for index in self.lineups[team]]})
+        self.universe_time += FRAME_MSEC * n
+        self.positions = players[-1]
+        self.ball = ball[-1]
+
+    def _attacking_half(self, offense):
+        """
+        Helper function for the half (0 left, 1 right) a team attacks.
+        The home team attacks the left basket in the first half.
+        """
+        second_half = self.quarter > 2
+        return int(offense == 1) ^ int(second_half)
+
+    def _possession(self, offense, shot_clock):
+        """
+        Helper function to simulate one possession ending in a shot
+
+        Returns:
+            int: team with the next possession
+        """
+        rng = self.rng
+        defense = 1 - offense
+        half = self._attacking_half(offense)
+        basket = LEFT_BASKET if half == 0 else RIGHT_BASKET
+        direction = 1 if half == 0 else -1
+        seconds = min(rng.uniform(6, shot_clock - 0.5), self.clock)
+        n = max(int(seconds * 1000 / FRAME_MSEC), 2)
+
+        # Offense spreads around the arc, defenders stay between their
+        # man and the basket
+        angles = np.radians(np.array([-75, -35, 0, 35, 75]) +
+                            rng.normal(0, 10, 5))
+        distances = rng.uniform(12, 25, 5)
+        spots = basket + np.column_stack((direction * distances *
+                                          np.cos(angles),
+                                          distances * np.sin(angles)))
+        offense_rows = slice(0, 5) if offense == 0 else slice(5, 10)
+        defense_rows = slice(5, 10) if offense == 0 else slice(0, 5)
+        ease = min(75, n // 2)
+        progress = self._progress(n, ease)
+        noise = self._noise(n, 1.5) * progress
+        paths = np.empty((n, 10, 2))
+        current = self.positions
+        paths[:, offense_rows] = (current[offense_rows] +
+                                  (spots - current[offense_rows]) *
+                                  progress + noise[:, :5])
+        shadows = 0.7 * paths[:, offense_rows] + 0.3 * basket
+        paths[:, defense_rows] = (current[defense_rows] * (1 - progress) +
+                                  shadows * progress + 0.5 * noise[:, 5:])
+        # Once set up, everyone stays in the half court
+        paths = np.clip(paths, 1, [93, 49])
+        low, high = ([1, 1], [46, 49]) if half == 0 else ([48, 1], [93, 49])
+        paths[ease:] = np.clip(paths[ease:], low, high)
+
+        # Ball is dribbled by a handler and passed between players
+        shot_frames = min(30, n // 3)
+        handlers = []
+        frame = 0
+        handler = rng.randint(5)
+        while frame < n - shot_frames:
+            length = min(rng.randint(40, 100), n - shot_frames - frame)
+            handlers += [handler] * length
+            frame += length
+            handler = (handler + rng.randint(1, 5)) % 5
+        handlers = np.array(handlers, dtype=np.int64)
+        held = np.arange(len(handlers))
+        offense_paths = paths[:, offense_rows]
+        ball = np.empty((n, 3))
+        ball[:len(handlers), :2] = offense_paths[held, handlers] + 0.5
+        ball[:len(handlers), 2] = 2 + 1.5 * np.abs(np.sin(held * np.pi / 12))
+        # Passes fly for 12 frames from the previous handler
+        for start in np.where(np.diff(handlers) != 0)[0] + 1:
+            flight = np.arange(min(12, len(handlers) - start))
+            origin = ball[start - 1, :2]
+            weight = ((flight + 1) / 12.)[:, None]
+            ball[start + flight, :2] = (origin * (1 - weight) +
+                                        ball[start + flight, :2] * weight)
+            ball[start + flight, 2] = 5 + 2 * np.sin(weight[:, 0] * np.pi)
+        shooter = handlers[-1]
+        # Shot arcs from the shooter to the rim
+        release = ball[len(handlers) - 1, :2]
+        flight = (np.arange(shot_frames) + 1) / float(shot_frames)
+        ball[len(handlers):, :2] = (release * (1 - flight[:, None]) +
+                                    basket * flight[:, None])
+        ball[len(handlers):, 2] = 7 + 3 * flight + 28 * flight * (1 - flight)
+
+        clocks = self.clock - np.arange(n) * FRAME_MSEC / 1000.
+        shot_clocks = shot_clock - np.arange(n) * FRAME_MSEC / 1000.
+        self._add_segment(paths, ball, clocks, shot_clocks)
+        self.clock = max(self.clock - n * FRAME_MSEC / 1000., 0)
+
+        # Shot and rebound
+        distance = np.linalg.norm(release - basket)
+        points = 3 if distance > 22 else 2
+        player = self._player(offense, shooter)
+        # Threes are marked '3PT' as in NBA descriptions
+        shot = '3PT Jump Shot' if points == 3 else 'Jump Shot'
+        if rng.uniform() < (0.36 if points == 3 else 0.48):
+            self.score[offense] += points
+            self._add_row(1, "{0} {1}' {2} ({3} PTS)".format(
+                player['lastname'], int(distance), shot, points), offense,
+                [(offense, self.lineups[offense][shooter])], 1,
+                score_changed=True)
+            return defense
+        self._add_row(2, "MISS {0} {1}' {2}".format(
+            player['lastname'], int(distance), shot), offense,
+            [(offense, self.lineups[offense][shooter])], 1)
+        rebounding = offense if rng.uniform() < 0.25 else defense
+        rebounder = rng.randint(5)
+        self._add_row(4, '{0} REBOUND'.format(
+            self._player(rebounding, rebounder)['lastname']), rebounding,
+            [(rebounding, self.lineups[rebounding][rebounder])])
+        return rebounding
+
+    def _stoppage(self, offense):
+        """
+        Helper function for a foul or timeout: the clock stops, players
+        stand around and substitutions are made.
+        """
+        rng = self.rng
+        defense = 1 - offense
+        if rng.uniform() < 0.7:
+            fouler = rng.randint(5)
+            self._add_row(6, '{0} P.FOUL'.format(
+                self._player(defense, fouler)['lastname']), defense,
+                [(defense, self.lineups[defense][fouler])], 1)
+        else:
+            self._add_row(9, '{0} Timeout: Regular'.format(
+                self.teams[offense]), offense, [], 1)
+        for team in [0, 1]:
+            if rng.uniform() >= self.substitution_rate:
+                continue
+            bench = [index for index in range(len(self.rosters[team]))
+                     if index not in self.lineups[team]]
+            out = rng.randint(5)
+            player_in = bench[rng.randint(len(bench))]
+            player_out = self.lineups[team][out]
+            self._add_row(8, 'SUB: {0} FOR {1}'.format(
+                self.rosters[team][player_in]['lastname'],
+                self.rosters[team][player_out]['lastname']), team,
+                [(team, player_out), (team, player_in)])
+            self.lineups[team][out] = player_in
+        n = int(rng.uniform(5, 30) * 1000 / FRAME_MSEC)
+        targets = self.positions + rng.normal(0, 3, (10, 2))
+        paths = np.clip(self._wander(n, targets, 50, 0.5), 1, [93, 49])
+        ball = np.repeat(self.ball[None, :], n, axis=0)
+        ball[:, 2] = 4
+        self._add_segment(paths, ball, np.full(n, self.clock),
+                          np.full(n, np.nan))
+
+    def _quarter(self, offense):
+        """
+        Helper function to simulate a quarter
+        """
+        self.clock = float(self.quarter_length)
+        self._add_row(12, 'Start of {0} Period'.format(self.quarter))
+        if self.quarter == 1:
+            self._add_row(10, 'Jump Ball', 0, [(0, self.lineups[0][4]),
+                                               (1, self.lineups[1][4]),
+                                               (offense,
+                                                self.lineups[offense][0])])
+        shot_clock = 24.
+        while self.clock > 0:
+            next_offense = self._possession(offense, shot_clock)
+            shot_clock = 14. if next_offense == offense else 24.
+            offense = next_offense
+            if self.clock > 0 and self.rng.uniform() < self.stoppage_rate:
+                self._stoppage(offense)
+                shot_clock = 24.
+        self._add_row(13, 'End of {0} Period'.format(self.quarter))
+
+    def run(self):
+        """
+        Simulates the game.  Returns self.
+        """
+        for quarter in range(1, self.quarters + 1):
+            self.quarter = quarter
+            if quarter == 3:
+                self.lineups = [list(range(5)), list(range(5))]
+            self._quarter((quarter + 1) % 2)
+            # Break between quarters, halftime is longer
+            self.universe_time += (900000 if quarter == 2 else 130000)
+        return self
+
+
+def _drop_frames(n, drop_rate, rng):
+    """
+    Helper function for a mask of frames to keep.  Frames are dropped in
+    runs of about 10, like tracking outages.
+    """
+    keep = np.ones(n, dtype=bool)
+    runs = rng.poisson(drop_rate * n / 10.)
+    for start, length in zip(rng.randint(0, max(n, 1), runs),
+                             rng.geometric(0.1, runs)):
+        keep[start:start + length] = False
+    return keep
+
+
+def _moments(segment, keep):
+    """
+    Helper function to convert a simulated segment into SportVU moments
+    """
+    players = np.round(segment['players'], 5).tolist()
+    ball = np.round(segment['ball'], 5).tolist()
+    clocks = np.round(segment['quarter_time'], 2).tolist()
+    shot_clocks = [None if np.isnan(value) else round(value, 2)
+                   for value in segment['shot_clock'].tolist()]
+    universe_times = segment['universe_time'].tolist()
+    ids = segment['ids']
+    team_ids = [segment['team_ids'][0]] * 5 + [segment['team_ids'][1]] * 5
+    moments = []
+    for frame in np.where(keep)[0].tolist():
+        positions = [[-1, -1] + ball[frame]]
+        positions += [[team_id, player_id, x, y, 0.0] for
+                      team_id, player_id, (x, y) in
+                      zip(team_ids, ids, players[frame])]
+        moments.append([segment['quarter'], universe_times[frame],
+                        clocks[frame], shot_clocks[frame], None,
+                        positions])
+    return moments
+
+
+def generate_game(date, home_team, away_team, seed=0, quarters=4,
+                  quarter_length=720, substitution_rate=0.5,
+                  stoppage_rate=0.2, drop_rate=0.0, response=False):
+    """
+    Generates tracking and play-by-play data of a game.
+
+    Args:
+        date (str): date of game in form 'MM.DD.YYYY'
+        home_team (str): home team in form 'XXX', a key of TEAMS
+        away_team (str): away team in form 'XXX', a key of TEAMS
+        seed (int): season seed, see game_seed()
+        quarters (int): number of quarters (more than 4 for overtime)
+        quarter_length (int): seconds per quarter.  Game assumes 720,
+            shorter quarters make smaller games for quick tests.
+        substitution_rate (float): chance of each team substituting a
+            player at every foul or timeout
+        stoppage_rate (float): chance of a foul or timeout after each
+            possession
+        drop_rate (float): fraction of frames missing from tracking
+        response (bool): If True, return the whole play-by-play response
+            (as written to disk) instead of its result set
+
+    Returns: tuple of data (tracking_data, playbyplay_data)
+        Same as prefetch.load_game_data()
+    """
+    simulation = _Simulation(date, home_team, away_team,
+                             game_seed(date, home_team, away_team, seed),
+                             quarters, quarter_length, substitution_rate,
+                             stoppage_rate).run()
+    rng = simulation.rng
+    teams = []
+    for team, key in [(0, 'home'), (1, 'visitor')]:
+        teams.append((key, {'name': simulation.teams[team],
+                            'teamid': simulation.team_ids[team],
+                            'abbreviation': simulation.teams[team],
+                            'players': simulation.rosters[team]}))
+    events = []
+    previous = []
+    for number, segment in enumerate(simulation.segments):
+        segment['team_ids'] = simulation.team_ids
+        keep = _drop_frames(len(segment['players']), drop_rate, rng)
+        moments = _moments(segment, keep)
+        event = {'eventId': str(number + 1), 'moments': previous + moments}
+        event.update(teams)
+        events.append(event)
+        # Like SportVU, events overlap by a second
+        previous = moments[-25:]
+    month, day, year = date.split('.')
+    tracking_data = {'gameid': simulation.game_id,
+                     'gamedate': '{0}-{1}-{2}'.format(year, month, day),
+                     'events': events}
+    playbyplay_data = {'name': 'PlayByPlay', 'headers': PBP_HEADERS,
+                       'rowSet': simulation.rows}
+    if response:
+        playbyplay_data = {'resource': 'playbyplay',
+                           'parameters': {'GameID': simulation.game_id,
+                                          'StartPeriod': 0, 'EndPeriod': 0},
+                           'resultSets': [playbyplay_data]}
+    return (tracking_data, playbyplay_data)
+
+
+def write_game(date, home_team, away_team, directory='data/synthetic',
+               **options):
+    """
+    Writes a generated game in the layout read by
+    prefetch.load_local_game_data():
+        {directory}/MM.DD.YYYY.AWAY.at.HOME.json      tracking data
+        {directory}/MM.DD.YYYY.AWAY.at.HOME.pbp.json  play-by-play response
+
+    Args:
+        date, home_team, away_team: see generate_game()
+        directory (str): directory to write into
+        **options: passed to generate_game()
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    tracking_data, playbyplay_data = generate_game(
+        date, home_team, away_team, response=True, **options)
+    tracking_id = '{date}.{away_team}.at.{home_team}'.format(
+        date=date, away_team=away_team, home_team=home_team)
+    with open(os.path.join(directory, tracking_id + '.json'), 'w') as f:
+        json.dump(tracking_data, f)
+    with open(os.path.join(directory, tracking_id + '.pbp.json'), 'w') as f:
+        json.dump(playbyplay_data, f)
+
+
+def season_schedule(n_games=1230, start_date='10.27.2015',
+                    games_per_day=8, seed=0):
+    """
+    Random schedule of games between TEAMS.  A team plays at most once a
+    day, and no two games have the same game_id (see game_seed()).
+
+    Args:
+        n_games (int): number of games.  A real season has 1230, use
+            more for scale tests.
+        start_date (str): date of first games in form 'MM.DD.YYYY'
+        games_per_day (int): number of games each day, at most 15
+        seed (int): random seed, and season seed of the games
+
+    Returns:
+        list: list of games where each element [date, home_team,
+            away_team], the same as spacing_analysis.extract_games()
+    """
+    rng = np.random.RandomState(seed)
+    day = datetime.datetime.strptime(start_date, '%m.%d.%Y')
+    teams = sorted(TEAMS)
+    games = []
+    seeds = set()
+    while len(games) < n_games:
+        order = rng.permutation(teams)
+        date = day.strftime('%m.%d.%Y')
+        added = 0
+        for index in range(len(teams) // 2):
+            if added == games_per_day or len(games) == n_games:
+                break
+            game = [date, order[2 * index], order[2 * index + 1]]
+            game_id = game_seed(game[0], game[1], game[2], seed)
+            # Rare, but two games with one game_id would overwrite each
+            # other in anything keyed on game_id
+            if game_id in seeds:
+                continue
+            seeds.add(game_id)
+            games.append(game)
+            added += 1
+        day += datetime.timedelta(days=1)
+    return games
+
+
+def write_allgames(gamelist, filename='allgames.txt'):
+    """
+    Writes games in the format of allgames.txt (see scrape_games.py)
+    """
+    with open(filename, 'w') as game_file:
+        for date, home_team, away_team in gamelist:
+            game_file.write('{date}.{away_team}.at.{home_team}.7z\n'.format(
+                date=date, away_team=away_team, home_team=home_team))
+
+
+def generate_season(directory='data/synthetic', n_games=1230, seed=0,
+                    write_games=True, allgames='allgames.txt',
+                    **options):
+    """
+    Generates a season: a schedule, its allgames.txt and every game.
+
+    Args:
+        directory (str): directory games are written into
+        n_games (int): number of games, see season_schedule()
+        seed (int): seed of the schedule and of every game
+        write_games (bool): If False, only the schedule is written and
+            games are generated when loaded (see SyntheticLoader)
+        allgames (str): file the schedule is written to
+        **options: passed to generate_game()
+
+    Returns:
+        list: the schedule, see season_schedule()
+    """
+    gamelist = season_schedule(n_games, seed=seed)
+    write_allgames(gamelist, allgames)
+    if write_games:
+        for date, home_team, away_team in gamelist:
+            write_game(date, home_team, away_team, directory, seed=seed,
+                       **options)
+    return gamelist
+
+
+class SyntheticLoader(object):
+    """
+    Loader for prefetch.prefetch_games() and the write_* season scripts
+    that generates games instead of downloading them.  Gives the same
+    games as generate_season() with the same seed and options.
+
+        write_spacing(extract_games(), loader=SyntheticLoader(seed=0))
+    """
+
+    def __init__(self, seed=0, **options):
+        """
+        Args:
+            seed (int): season seed
+            **options: passed to generate_game()
+        """
+        self.seed = seed
+        self.options = options
+
+    def __call__(self, date, home_team, away_team):
+        return generate_game(date, home_team, away_team, seed=self.seed,
+                             **self.options)
@@ -4,20 +4,29 @@ Analysis of NBA player velocities.
 
 import os
 import pickle
+from subprocess import Popen, PIPE
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import pandas as pd
-from game import Game
+import analytics
+import quality
+from game import Game, _make_directory
+from prefetch import run_season, load_game_data
+import instrument
+from compact import write_compact_game
 
-# Initialize Project
-os.chdir('~/Desktop/Personal/SportVU/NBA-player-movement')
+# Top of the velocity plot (ft/msec) when a clip has no velocities, about
+# a player's sprint
+DEFAULT_MAX_VELOCITY = 0.03
 
 
-def extract_games():
+def extract_games(filename='allgames.txt'):
     """
     Extract games from allgames.txt
 
+    Args:
+        filename (str): list of games, one archive name per line
+            (see scrape_games.py and synthetic.write_allgames())
+
     Returns:
         list: list of games.  Each element is list is tuple
             (date, home_team, away_team)
@@ -25,7 +34,7 @@ def extract_games():
     """
 
     games = []
-    with open('allgames.txt', 'r') as game_file:
+    with open(filename, 'r') as game_file:
         for line in game_file:
             game = line.split('.')
             date = "{game[0]}.{game[1]}.{game[2]}".format(game=game)
@@ -70,10 +79,8 @@ def calculate_velocities(game, frame, highlight_player=None):
         return (game_time, 0, 0)
 
     # If not all the players are on the court, there is an error in the data
-    if len(details[1]) != 11 or \
-       len(details[2]) != 11 or \
-       len(previous_details[1]) != 11 or \
-       len(previous_details[2]) != 11:
+    if not (quality.frame_is_valid(game, frame) and
+            quality.frame_is_valid(game, frame - 1)):
         return (game_time, 0, 0)
 
     delta_x = np.array(details[1]) - np.array(previous_details[1])
@@ -108,6 +115,8 @@ def plot_velocity_frame(game, frame_number, ax, highlight_player=None):
     Returns: plt.fig of frame from game with subplot of velocity.
         see README.md for example
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     (game_time, x_pos, y_pos, colors, sizes,
      quarter, shot_clock, game_clock, edges,
      universe_time) = game._get_moment_details(frame_number,
@@ -139,6 +148,9 @@ def watch_play_velocities(game, game_time, length, highlight_player=None):
     """
     Creates an movie of a play which includes a plot of the
         real-time velocities.
+    Frames are streamed to ffmpeg.  The figure is set up once, and each
+    frame only draws the newest segment of the velocity lines onto the
+    saved background, so render time grows linearly with clip length.
 
     Args:
         game (Game): Game instance to get data from
@@ -151,72 +163,128 @@ def watch_play_velocities(game, game_time, length, highlight_player=None):
     Returns: None and outputs video file of play with
         velocity plot. See README.md for example
     """
+    import seaborn as sns
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
     starting_frames = game.moments[game.moments.game_time.round() ==
                                    game_time]
     starting_frame = starting_frames.index.values[0]
     ending_frames = game.moments[game.moments.game_time.round() ==
                                  game_time + length]
     ending_frame = ending_frames.index.values[0]
+    frames = range(starting_frame, ending_frame)
 
-    indices = list(range(ending_frame - starting_frame))
-
+    # Precompute velocities of the clip
+    arrays = analytics.game_arrays(game)
     if highlight_player:
-        player_velocities = [calculate_velocities(game, frame,
-                                                  highlight_player=highlight_player)[1]
-                             for frame in range(starting_frame, ending_frame)]
-        max_velocity = max(player_velocities)
+        player_id = game.player_ids[highlight_player]
+        series = [(analytics.player_velocities(arrays, player_id)
+                   [starting_frame:ending_frame], 'black', highlight_player)]
     else:
-        home_velocities = [calculate_velocities(game, frame)[1]
-                           for frame in range(starting_frame, ending_frame)]
-        away_velocities = [calculate_velocities(game, frame)[2]
-                           for frame in range(starting_frame, ending_frame)]
-        all_velocities = home_velocities + away_velocities
-        max_velocity = max(all_velocities)
-
-    # Plot each frame
-    for index, frame in enumerate(range(starting_frame, ending_frame)):
-        f, (ax1, ax2) = plt.subplots(2, figsize=(12, 12))
-        plot_velocity_frame(game, frame, ax=ax2,
-                            highlight_player=highlight_player)
-        ax1.set_xlim([0, len(indices)])
-        ax1.set_ylim([0, max_velocity * 1.2])
-        if highlight_player:
-            ax1.plot(indices[:index+1], player_velocities[:index+1],
-                     c='black', label=highlight_player)
-        else:
-            ax1.plot(indices[:index+1], home_velocities[:index+1],
-                     c=game.team_colors[game.home_id], label=game.home_team)
-            ax1.plot(indices[:index+1], away_velocities[:index+1],
-                     c=game.team_colors[game.away_id], label=game.away_team)
-        ax1.set_yticklabels([])
-        ax1.set_xticklabels([])
-        ax1.set_ylabel('Velocity', fontsize=22)
-        if highlight_player:
-            ax1.set_title(highlight_player, fontsize=24)
-        else:
-            ax1.legend(fontsize=18)
-        plt.savefig('temp/' + str(index) + '.png')
-        plt.close()
-
-    # Make video of each frame
-    command = ('ffmpeg -framerate 20 -start_number 0 -i %d.png -c:v '
-               'libx264 -r 30 -pix_fmt yuv420p -vf '
-               '"scale=trunc(iw/2)*2:trunc(ih/2)*2" {starting_frame}'
-               '.mp4').format(starting_frame=starting_frame)
-    os.chdir('temp')
-    os.system(command)
-    os.chdir('..')
-
-    # Delete images
-    for file in os.listdir('./temp'):
-        if os.path.splitext(file)[1] == '.png':
-            os.remove('./temp/{file}'.format(file=file))
-
+        velocities = analytics.team_velocities(arrays)
+        series = [(velocities[starting_frame:ending_frame, 0],
+                   game.team_colors[game.home_id], game.home_team),
+                  (velocities[starting_frame:ending_frame, 1],
+                   game.team_colors[game.away_id], game.away_team)]
+    plotted = np.concatenate([values for values, _, _ in series])
+    plotted = plotted[np.isfinite(plotted)]
+    # The highlighted player may not be on the court during the clip
+    max_velocity = (plotted.max() if len(plotted) and plotted.max() > 0
+                    else DEFAULT_MAX_VELOCITY)
+
+    # Score at each frame: last play-by-play score up to the second after
+    # the frame, as in Game._get_commentary()
+    frame_times = np.round(game.moments.game_time.values[
+        starting_frame:ending_frame]).astype(np.int64)
+    pbp_times = game.pbp.game_time.values
+    order = np.argsort(pbp_times, kind='stable')
+    latest = np.searchsorted(pbp_times[order], frame_times + 1,
+                             side='right') - 1
+    pbp_scores = game.pbp.SCORE.values[order].astype(str)
+    scores = np.where(latest >= 0, pbp_scores[np.maximum(latest, 0)],
+                      '0 - 0')
+
+    # Static parts of the figure
+    with sns.axes_style('dark'):
+        fig = Figure(figsize=(12, 12), dpi=80)
+        canvas = FigureCanvasAgg(fig)
+        ax1, ax2 = fig.subplots(2)
+    ax1.set_xlim([0, len(frames)])
+    ax1.set_ylim([0, max_velocity * 1.2])
+    lines = [ax1.plot([], [], c=color, label=label)[0]
+             for _, color, label in series]
+    ax1.set_yticklabels([])
+    ax1.set_xticklabels([])
+    ax1.set_ylabel('Velocity', fontsize=22)
+    if highlight_player:
+        ax1.set_title(highlight_player, fontsize=24)
+    else:
+        ax1.legend(fontsize=18)
+    game._draw_court(ax=ax2)
+    ax2.get_xaxis().set_ticks([])
+    ax2.get_yaxis().set_ticks([])
+    ax2.set_xlim(-5, 100)
+    ax2.set_ylim(-55, 5)
+    # Add team color indicators to top of frame
+    ax2.scatter([30, 67], [2.5, 2.5], s=100,
+                c=[game.team_colors[game.away_id],
+                   game.team_colors[game.home_id]])
+
+    # Parts that change every frame
+    players = ax2.scatter([], [], alpha=0.85)
+    shot_clock_text = fig.text(0.43, 0.105, '', size=18)
+    quarter_text = fig.text(0.5, 0.105, '', size=18)
+    game_clock_text = fig.text(0.57, 0.105, '', size=18)
+    score_text = fig.text(0.43, .442, '', size=18)
+    court_artists = [players, shot_clock_text, quarter_text,
+                     game_clock_text, score_text]
+    for artist in lines + court_artists:
+        artist.set_animated(True)
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+
+    _make_directory('temp')
+    filename = './temp/{starting_frame}.mp4'.format(
+        starting_frame=starting_frame)
+    cmdstring = ('ffmpeg', '-y', '-r', '20',
+                 '-s', '%dx%d' % canvas.get_width_height(),
+                 '-pix_fmt', 'rgba', '-f', 'rawvideo', '-i', '-',
+                 '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', filename)
+    pipe = Popen(cmdstring, stdin=PIPE)
+    for index, frame in enumerate(frames):
+        # Add the newest line segments to the background
+        canvas.restore_region(background)
+        for line, (values, _, _) in zip(lines, series):
+            start = max(index - 1, 0)
+            line.set_data(range(start, index + 1), values[start:index + 1])
+            fig.draw_artist(line)
+        background = canvas.copy_from_bbox(fig.bbox)
+
+        (frame_time, x_pos, y_pos, colors, sizes,
+         quarter, shot_clock, game_clock, edges,
+         universe_time) = game._get_moment_details(
+             frame, highlight_player=highlight_player)
+        players.set_offsets(np.column_stack((x_pos, y_pos)))
+        players.set_sizes(sizes)
+        players.set_facecolor(colors)
+        players.set_linewidths(edges)
+        shot_clock_text.set_text(shot_clock)
+        quarter_text.set_text('Q' + str(quarter))
+        game_clock_text.set_text(str(game_clock))
+        score_text.set_text(game.away_team + "  " + scores[index] + "  " +
+                            game.home_team)
+        for artist in court_artists:
+            fig.draw_artist(artist)
+        pipe.stdin.write(bytes(canvas.buffer_rgba()))
+    pipe.stdin.close()
+    pipe.wait()
     return
 
 
 def get_velocity_statistics(date, home_team, away_team, write_file=False,
-                            write_score=False, write_game=False):
+                            write_score=False, write_game=False,
+                            tracking_data=None, playbyplay_data=None,
+                            compact=False):
     """
     Calculates velocity statistics for each frame in game
 
@@ -231,6 +299,13 @@ def get_velocity_statistics(date, home_team, away_team, write_file=False,
         write_game (bool): If True, write pickle file of tracking data
             into data/game directory
             Note: This file is ~100MB.
+        tracking_data (dict): Already loaded tracking data.
+            If None, it is downloaded.
+        playbyplay_data (dict): Already loaded play-by-play data.
+            If None, it is downloaded.
+        compact (bool): If True, write_game writes a compact .pz file
+            instead (see compact.read_compact_game()), about 12x smaller
+            on disk, with positions kept encoded in memory once read
 
     Returns:
         tuple: tuple of data (home_offense_velocities, home_defense_velocities,
@@ -244,28 +319,38 @@ def get_velocity_statistics(date, home_team, away_team, write_file=False,
     # Do not recalculate spacing data if already saved to disk
     if filename in os.listdir('./data/velocity/'):
         return
-    game = Game(date, home_team, away_team)
+    with instrument.span('Game'):
+        game = Game(date, home_team, away_team, tracking_data,
+                    playbyplay_data, slim=True)
     # Write game data to disk
     if write_game:
-        pickle.dump(game, open('data/game/' + filename, "wb"))
+        if compact:
+            write_compact_game(game, 'data/game/' + filename + 'z')
+        else:
+            pickle.dump(game, open('data/game/' + filename, "wb"))
     home_offense_velocities, home_defense_velocities = [], []
     away_offense_velocities, away_defense_velocities = [], []
     print(date, home_team, away_team)
-    for frame in range(1, len(game.moments)):
-        offensive_team = game.get_offensive_team(frame)
-        if offensive_team:
-            (game_time, home_velocity,
-             away_velocity) = calculate_velocities(game, frame)
-            if offensive_team == 'home':
-                home_offense_velocities.append((frame, game_time,
-                                                home_velocity))
-                away_defense_velocities.append((frame, game_time,
-                                                away_velocity))
-            if offensive_team == 'away':
-                home_defense_velocities.append((frame, game_time,
-                                                home_velocity))
-                away_offense_velocities.append((frame, game_time,
-                                                away_velocity))
+    with instrument.span('frames'):
+        for frame in range(1, len(game.moments)):
+            offensive_team = game.get_offensive_team(frame)
+            if offensive_team:
+                (game_time, home_velocity,
+                 away_velocity) = calculate_velocities(game, frame)
+                if offensive_team == 'home':
+                    home_offense_velocities.append((frame, game_time,
+                                                    home_velocity))
+                    away_defense_velocities.append((frame, game_time,
+                                                    away_velocity))
+                if offensive_team == 'away':
+                    home_defense_velocities.append((frame, game_time,
+                                                    home_velocity))
+                    away_offense_velocities.append((frame, game_time,
+                                                    away_velocity))
+    processed = len(home_offense_velocities) + len(away_offense_velocities)
+    instrument.count('velocity.frames', processed)
+    instrument.count('velocity.frames_skipped',
+                     len(game.moments) - 1 - processed)
     results = (home_offense_velocities, home_defense_velocities,
                away_offense_velocities, away_defense_velocities)
     # Write velocity data to disk
@@ -284,18 +369,32 @@ def get_velocity_statistics(date, home_team, away_team, write_file=False,
             away_offense_velocities, away_defense_velocities)
 
 
-def write_velocity(gamelist):
+def write_velocity(gamelist, prefetch=2, loader=load_game_data):
     """
-    Writes all spacing statistics to data/spacing directory for each game
+    Writes all velocity statistics to data/velocity directory for each game
+
+    Args:
+        gamelist (list): list of games where each element
+            [date, home_team, away_team]
+        prefetch (int): number of games to download ahead while the
+            current game is analyzed (see prefetch.prefetch_games())
+        loader (function): loads a game's data, e.g.
+            prefetch.load_local_game_data or synthetic.SyntheticLoader()
     """
-    for game in gamelist:
-        try:
-            get_velocity_statistics(game[0], game[1], game[2],
-                                    write_file=True, write_score=True)
-        except:
-            with open('errorlog_velocity.txt', 'a') as myfile:
-                myfile.write("{game} Could not extract velocity data\n"
-                             .format(game=game))
+    # Skip games already written, so they are not downloaded
+    written = os.listdir('./data/velocity')
+    gamelist = [game for game in gamelist
+                if "{game[0]}-{game[2]}-{game[1]}.p".format(game=game)
+                not in written]
+
+    def analyze(game, data):
+        get_velocity_statistics(game[0], game[1], game[2], write_file=True,
+                                write_score=True, tracking_data=data[0],
+                                playbyplay_data=data[1])
+
+    run_season(gamelist, analyze, 'velocity', 'extract velocity data',
+               prefetch=prefetch, loader=loader, build_game=False,
+               errorlog='errorlog_velocity.txt')
 
 
 def extract_velocity(gamelist):
@@ -462,6 +561,8 @@ def velocity_plots(df):
         None
         Saves plots to examples/
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
     # Organize velocity data
     home = df[[0, 2, 5, 7]]
@@ -514,6 +615,8 @@ def fatigue_plots(df):
         None
         Saves plots to examples/
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     plt.figure()
     sns.swarmplot(x='variable', y='value',
                   data=df[df.Pos == 'Off'][df.Tm == 'IND'])
@@ -558,6 +661,7 @@ def set_plot_params(size):
     """
     Sets font size on plots.  16-22 is a good range.
     """
+    import matplotlib.pyplot as plt
     SIZE = size
     plt.rc('font', size=SIZE)
     plt.rc('axes', titlesize=SIZE)
@@ -568,6 +672,9 @@ def set_plot_params(size):
 
 
 if __name__ == "__main__":
+    # Initialize Project
+    os.chdir(os.path.expanduser(
+        '~/Desktop/Personal/SportVU/NBA-player-movement'))
     set_plot_params(16)
     all_games = extract_games()
     write_velocity(all_games)
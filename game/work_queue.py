@@ -0,0 +1,469 @@
+"""
+Filesystem work queue for sharding season jobs across machines.
+
+Every machine points at the same queue directory on a shared (NFS) mount.
+Workers claim a game by exclusively creating its lock file, renew the
+lease by touching the lock while the job runs and mark the game done when
+it finishes.  A game whose lease is not renewed for lease_timeout seconds
+(the worker crashed or lost its node) is claimed by the next worker, and
+idle workers keep polling for lease_timeout so that happens even when
+every other worker has finished.  No broker is needed.
+
+Layout of the queue directory:
+    games/KEY      game to process, contains [date, home_team, away_team]
+    locks/KEY      lease of the worker processing the game
+    done/KEY       game finished
+    attempts/KEY   one line per claim, so games that crash their worker
+                   also run out of attempts
+    errors/KEY     one line per failed attempt
+    clock/WORKER   touched to read the file server's clock
+
+Populate once, then start workers on any number of nodes:
+    python work_queue.py QUEUE_DIR populate
+    python work_queue.py QUEUE_DIR spacing
+Or try it locally with processes standing in for nodes:
+    run_local_workers(QUEUE_DIR, spacing_job, processes=4)
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def game_key(game):
+    """
+    Name of a game in the queue: 'MM.DD.YYYY-AWAY-HOME', the same name
+    the season scripts use for their output files.
+    """
+    return "{game[0]}-{game[2]}-{game[1]}".format(game=game)
+
+
+class WorkQueue(object):
+    """
+    Queue of games stored in a shared directory.
+    """
+
+    def __init__(self, directory, lease_timeout=600, max_attempts=3):
+        """
+        Args:
+            directory (str): queue directory, shared between all nodes
+            lease_timeout (float): seconds without a heartbeat after which
+                a claimed game is given to another worker
+            max_attempts (int): number of claims after which a game that
+                is not done is no longer handed out.  Claims count whether
+                the job failed, crashed its worker or lost its lease.
+        """
+        self.directory = directory
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        for subdirectory in ['games', 'locks', 'done', 'attempts', 'errors',
+                             'clock']:
+            path = os.path.join(directory, subdirectory)
+            if not os.path.exists(path):
+                os.makedirs(path, exist_ok=True)
+
+    def _path(self, subdirectory, key):
+        return os.path.join(self.directory, subdirectory, key)
+
+    def populate(self, gamelist):
+        """
+        Adds games to the queue.  Games already queued are left alone.
+
+        Args:
+            gamelist (list): list of games where each element
+                [date, home_team, away_team]
+
+        Returns:
+            int: number of games added
+        """
+        added = 0
+        for game in gamelist:
+            path = self._path('games', game_key(game))
+            if os.path.exists(path):
+                continue
+            with open(path + '.tmp', 'w') as game_file:
+                json.dump(list(game), game_file)
+            os.rename(path + '.tmp', path)
+            added += 1
+        return added
+
+    def _now(self, worker_id):
+        """
+        Helper function for the file server's current time, so lease ages
+        are not affected by clock differences between nodes.
+        """
+        path = self._path('clock', worker_id)
+        with open(path, 'a'):
+            os.utime(path, None)
+        return os.stat(path).st_mtime
+
+    def _lines(self, subdirectory, key):
+        path = self._path(subdirectory, key)
+        if not os.path.exists(path):
+            return 0
+        with open(path) as lines_file:
+            return sum(1 for line in lines_file)
+
+    def _attempts(self, key):
+        # Queues made before attempts/ only recorded failed attempts
+        return max(self._lines('attempts', key), self._lines('errors', key))
+
+    def _break_stale_lease(self, key, worker_id):
+        """
+        Helper function to remove a lock whose lease expired.
+        Renaming is atomic, so only one worker breaks a given lease.
+        If the lock was renewed or re-created between the check and the
+        rename, it is put back.  If the owner was only slow, it loses the
+        lease at its next heartbeat and stops its job.
+        """
+        lock = self._path('locks', key)
+        try:
+            checked = os.stat(lock)
+        except FileNotFoundError:
+            return True
+        if self._now(worker_id) - checked.st_mtime < self.lease_timeout:
+            return False
+        stale = '{lock}.stale.{worker_id}'.format(lock=lock,
+                                                  worker_id=worker_id)
+        try:
+            os.rename(lock, stale)
+        except FileNotFoundError:
+            return False
+        renamed = os.stat(stale)
+        if (renamed.st_ino, renamed.st_mtime) != (checked.st_ino,
+                                                  checked.st_mtime):
+            # Not the lock that expired: restore it unless the game was
+            # claimed again in the meantime
+            try:
+                os.link(stale, lock)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        return True
+
+    def claim(self, worker_id):
+        """
+        Claims the next available game.
+
+        Args:
+            worker_id (str): unique name of the claiming worker
+
+        Returns:
+            tuple of (key, game), or None if no game is available
+                key (str): name of game in queue
+                game (list): [date, home_team, away_team]
+        """
+        for key in sorted(os.listdir(os.path.join(self.directory,
+                                                  'games'))):
+            if key.endswith('.tmp') or \
+                    os.path.exists(self._path('done', key)) or \
+                    self._attempts(key) >= self.max_attempts:
+                continue
+            lock = self._path('locks', key)
+            if os.path.exists(lock) and \
+                    not self._break_stale_lease(key, worker_id):
+                continue
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, 'w') as lock_file:
+                json.dump({'worker': worker_id,
+                           'host': socket.gethostname(),
+                           'pid': os.getpid()}, lock_file)
+            # The game may have finished between the check and the claim
+            if os.path.exists(self._path('done', key)):
+                os.remove(lock)
+                continue
+            # Counted now rather than when the job fails, since a job that
+            # kills its worker never gets to fail
+            with open(self._path('attempts', key), 'a') as attempts_file:
+                attempts_file.write(worker_id + '\n')
+            with open(self._path('games', key)) as game_file:
+                return (key, json.load(game_file))
+        return None
+
+    def owns(self, key, worker_id):
+        """
+        Returns True if worker_id still holds the lease on key
+        """
+        try:
+            with open(self._path('locks', key)) as lock_file:
+                return json.load(lock_file)['worker'] == worker_id
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def heartbeat(self, key, worker_id):
+        """
+        Renews the lease on a claimed game.
+
+        Returns:
+            bool: False if the lease was lost to another worker
+        """
+        if not self.owns(key, worker_id):
+            # The lock may be missing while another worker puts back a
+            # lease it found renewed (see _break_stale_lease())
+            time.sleep(1)
+            if not self.owns(key, worker_id):
+                return False
+        try:
+            os.utime(self._path('locks', key), None)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, key, worker_id):
+        """
+        Marks a claimed game as done and releases it.
+        """
+        with open(self._path('done', key), 'w') as done_file:
+            done_file.write(worker_id + '\n')
+        self.release(key, worker_id)
+
+    def fail(self, key, worker_id, error):
+        """
+        Records a failed attempt and releases the game for a retry.
+
+        Args:
+            error (Exception or str): error, or its description
+        """
+        if not isinstance(error, str):
+            error = repr(error)
+        with open(self._path('errors', key), 'a') as error_file:
+            error_file.write('{worker_id}: {error}\n'.format(
+                worker_id=worker_id, error=error.replace('\n', ' ')))
+        self.release(key, worker_id)
+
+    def release(self, key, worker_id):
+        """
+        Gives up the lease on a game without marking it done.
+        The lock is renamed before its owner is checked, so a lease that
+        was broken and claimed by another worker in the meantime is put
+        back instead of removed (see _break_stale_lease()).
+        """
+        lock = self._path('locks', key)
+        released = '{lock}.release.{worker_id}'.format(lock=lock,
+                                                       worker_id=worker_id)
+        try:
+            os.rename(lock, released)
+        except FileNotFoundError:
+            return
+        try:
+            with open(released) as lock_file:
+                owner = json.load(lock_file)['worker']
+        except ValueError:
+            owner = None
+        if owner != worker_id:
+            try:
+                os.link(released, lock)
+            except FileExistsError:
+                pass
+        os.remove(released)
+
+    def status(self):
+        """
+        Returns:
+            dict: number of games that are queued, claimed, done and
+                failed (out of attempts and not claimed)
+        """
+        keys = [key for key in os.listdir(os.path.join(self.directory,
+                                                       'games'))
+                if not key.endswith('.tmp')]
+        done = set(os.listdir(os.path.join(self.directory, 'done')))
+        locks = set(os.listdir(os.path.join(self.directory, 'locks')))
+        failed = set(key for key in keys if key not in done and
+                     key not in locks and
+                     self._attempts(key) >= self.max_attempts)
+        return {'queued': len(keys), 'done': len(done & set(keys)),
+                'claimed': len((locks - done) & set(keys)),
+                'failed': len(failed)}
+
+
+def _run_job(job, game, connection):
+    """
+    Helper function run in the job's process: runs job(game) and sends
+    None, or the description of the error it raised.
+    """
+    try:
+        job(game)
+    except Exception as error:
+        connection.send(repr(error))
+    else:
+        connection.send(None)
+    connection.close()
+
+
+def run_worker(directory, job, worker_id=None, heartbeat_interval=None,
+               lease_timeout=600, poll_interval=None):
+    """
+    Processes games from the queue until none are left.
+
+    Each job runs in a child process while this process renews its
+    lease, and is terminated if the lease is lost to another worker.
+    Once nothing is claimable, the worker keeps polling for
+    lease_timeout while other workers hold leases, so games of workers
+    that crashed are still processed.
+
+    Args:
+        directory (str): queue directory
+        job (function): called as job(game) with game
+            [date, home_team, away_team].  It writes its own results,
+            for example into data/ on the shared mount.  Must be
+            picklable if processes are spawned rather than forked.
+        worker_id (str): unique name of worker.
+            If None, 'hostname-pid' is used.
+        heartbeat_interval (float): seconds between lease renewals.
+            If None, a quarter of lease_timeout.
+        lease_timeout (float): see WorkQueue
+        poll_interval (float): seconds between claims while waiting for
+            games held by other workers.  If None, a twentieth of
+            lease_timeout.
+
+    Returns:
+        int: number of games completed by this worker
+    """
+    worker_id = worker_id or '{host}-{pid}'.format(
+        host=socket.gethostname(), pid=os.getpid())
+    heartbeat_interval = heartbeat_interval or lease_timeout / 4.
+    poll_interval = poll_interval or lease_timeout / 20.
+    queue = WorkQueue(directory, lease_timeout=lease_timeout)
+    completed = 0
+    idle_since = None
+    while True:
+        claimed = queue.claim(worker_id)
+        if claimed is None:
+            # Any lease held now expires within lease_timeout, unless
+            # its owner is alive and will finish the game
+            idle_since = idle_since or time.time()
+            if queue.status()['claimed'] > 0 and \
+                    time.time() - idle_since < lease_timeout + poll_interval:
+                time.sleep(poll_interval)
+                continue
+            break
+        idle_since = None
+        key, game = claimed
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_run_job,
+                                          args=(job, game, sender))
+        process.start()
+        sender.close()
+        lost = False
+        while True:
+            process.join(heartbeat_interval)
+            if process.exitcode is not None:
+                break
+            if not queue.heartbeat(key, worker_id):
+                # Another worker broke the lease and runs the game
+                process.terminate()
+                process.join()
+                lost = True
+                break
+        try:
+            error = receiver.recv()
+        except EOFError:
+            error = 'job exited with code {0}'.format(process.exitcode)
+        receiver.close()
+        if lost:
+            continue
+        if error is not None:
+            queue.fail(key, worker_id, error)
+            continue
+        queue.complete(key, worker_id)
+        completed += 1
+    return completed
+
+
+def run_local_workers(directory, job, processes=4, **kwargs):
+    """
+    Runs several workers as local processes, standing in for nodes.
+
+    Args:
+        directory (str): queue directory
+        job (function): see run_worker().  Must be importable by
+            worker processes.
+        processes (int): number of workers
+        **kwargs: passed to run_worker()
+
+    Returns:
+        int: number of games completed by all workers
+    """
+    # Not a multiprocessing.Pool, whose daemonic workers cannot start
+    # the processes jobs run in
+    with ProcessPoolExecutor(processes) as executor:
+        results = [executor.submit(run_worker, directory, job,
+                                   **dict(kwargs, worker_id='local-{index}'
+                                          .format(index=index)))
+                   for index in range(processes)]
+        return sum(result.result() for result in results)
+
+
+def _load(game, loader):
+    """
+    Helper function for (tracking_data, playbyplay_data) of a game from
+    loader, or (None, None) so the game is downloaded
+    """
+    if loader is None:
+        return (None, None)
+    return loader(game[0], game[1], game[2])
+
+
+def spacing_job(game, loader=None):
+    """
+    Writes spacing statistics of a game, as write_spacing() does.
+    Use functools.partial(spacing_job, loader=...) to read games with a
+    loader of prefetch.py or synthetic.py instead of downloading them.
+    """
+    from spacing_analysis import get_spacing_statistics
+    tracking_data, playbyplay_data = _load(game, loader)
+    get_spacing_statistics(game[0], game[1], game[2],
+                           write_file=True, write_score=True,
+                           tracking_data=tracking_data,
+                           playbyplay_data=playbyplay_data)
+
+
+def velocity_job(game, loader=None):
+    """
+    Writes velocity statistics of a game, as write_velocity() does.
+    See spacing_job() for loader.
+    """
+    from velocity_analysis import get_velocity_statistics
+    tracking_data, playbyplay_data = _load(game, loader)
+    get_velocity_statistics(game[0], game[1], game[2],
+                            write_file=True, write_score=True,
+                            tracking_data=tracking_data,
+                            playbyplay_data=playbyplay_data)
+
+
+def heatmap_job(game, loader=None):
+    """
+    Writes the heatmaps of a game to data/heatmap.
+    Merge them with heatmap.merge_heatmaps().  See spacing_job() for
+    loader.
+    """
+    from game import Game
+    from heatmap import Heatmaps
+    if not os.path.exists('data/heatmap'):
+        os.makedirs('data/heatmap', exist_ok=True)
+    tracking_data, playbyplay_data = _load(game, loader)
+    heatmaps = Heatmaps().add_game(Game(game[0], game[1], game[2],
+                                        tracking_data, playbyplay_data,
+                                        slim=True))
+    heatmaps.save('data/heatmap/{key}.npz'.format(key=game_key(game)))
+
+
+if __name__ == "__main__":
+    queue_directory, command = sys.argv[1], sys.argv[2]
+    if command == 'populate':
+        from spacing_analysis import extract_games
+        print(WorkQueue(queue_directory).populate(extract_games()),
+              'games added')
+    else:
+        jobs = {'spacing': spacing_job, 'velocity': velocity_job,
+                'heatmap': heatmap_job}
+        print(run_worker(queue_directory, jobs[command]), 'games completed')